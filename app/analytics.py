@@ -0,0 +1,90 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Connection
+
+from app.dialects import UPSERT_INSERTS
+from app.schemas.sql_models import OrderHeader, OrderLine, Product, ProductSalesDaily, ProductSalesMonthly
+
+logger = logging.getLogger(__name__)
+
+# Each rollup table with its period column and how an order date maps onto it
+ROLLUPS = (
+    (ProductSalesDaily, "sales_date", lambda order_date: order_date.date()),
+    (ProductSalesMonthly, "sales_month", lambda order_date: order_date.date().replace(day=1)),
+)
+
+
+def sales_rollup_statements(dialect_name: str, order_date: datetime, lines, admin_ids: dict, sign: int = 1):
+    # Upserts that add (sign=1) or remove (sign=-1) an order's lines from every rollup;
+    # lines are mappings with product_id, quantity and line_total
+    deltas = defaultdict(lambda: {"quantity": 0, "order_count": 0, "revenue": 0.0})
+    for line in lines:
+        delta = deltas[line["product_id"]]
+        delta["quantity"] += sign * line["quantity"]
+        delta["order_count"] += sign
+        delta["revenue"] += sign * line["line_total"]
+
+    statements = []
+    for table, period_column, period_of in ROLLUPS:
+        rows = [
+            {"product_id": product_id, period_column: period_of(order_date), "admin_id": admin_ids[product_id], **delta}
+            for product_id, delta in deltas.items()
+        ]
+        statement = UPSERT_INSERTS[dialect_name](table).values(rows)
+        statements.append(statement.on_conflict_do_update(
+            index_elements=[table.product_id, getattr(table, period_column)],
+            set_={
+                "quantity": table.quantity + statement.excluded.quantity,
+                "order_count": table.order_count + statement.excluded.order_count,
+                "revenue": table.revenue + statement.excluded.revenue,
+            }
+        ))
+    return statements
+
+
+def rebuild_sales_rollup(connection: Connection):
+    # Recompute the daily rollup from the order tables and the monthly rollup from the daily one
+    sales_date = func.date(OrderHeader.order_date)
+    connection.execute(delete(ProductSalesDaily))
+    connection.execute(insert(ProductSalesDaily).from_select(
+        ["product_id", "sales_date", "admin_id", "quantity", "order_count", "revenue"],
+        select(
+            OrderLine.product_id,
+            sales_date,
+            Product.admin_id,
+            func.sum(OrderLine.quantity),
+            func.count(OrderLine.id),
+            func.sum(OrderLine.line_total)
+        )
+        .join(OrderHeader, OrderHeader.id == OrderLine.order_id)
+        .join(Product, Product.id == OrderLine.product_id)
+        .group_by(OrderLine.product_id, sales_date, Product.admin_id)
+    ))
+
+    sales_month = func.date(ProductSalesDaily.sales_date, "start of month")
+    connection.execute(delete(ProductSalesMonthly))
+    connection.execute(insert(ProductSalesMonthly).from_select(
+        ["product_id", "sales_month", "admin_id", "quantity", "order_count", "revenue"],
+        select(
+            ProductSalesDaily.product_id,
+            sales_month,
+            ProductSalesDaily.admin_id,
+            func.sum(ProductSalesDaily.quantity),
+            func.sum(ProductSalesDaily.order_count),
+            func.sum(ProductSalesDaily.revenue)
+        )
+        .group_by(ProductSalesDaily.product_id, sales_month, ProductSalesDaily.admin_id)
+    ))
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.begin() as connection:
+        rebuild_sales_rollup(connection)
+        rows = connection.execute(select(func.count()).select_from(ProductSalesDaily)).scalar()
+    logger.info("Rebuilt product_sales_daily with %d rows and product_sales_monthly from it", rows)
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.schemas.sql_models import Product
+from app.serialization import conditional_response, strong_etag
+from app.shared import SharedObjectClient, serve as serve_shared
+
+logger = logging.getLogger(__name__)
+
+# Product cache settings
+PRODUCT_CACHE_BACKEND = os.getenv("PRODUCT_CACHE_BACKEND", "local")  # "local" or "shared"
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "1024"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "300"))
+PRODUCT_CACHE_ADDRESS = os.getenv("PRODUCT_CACHE_ADDRESS", "127.0.0.1:50055")
+PRODUCT_CACHE_AUTHKEY = os.getenv("PRODUCT_CACHE_AUTHKEY", "product-cache").encode()
+# Serialized catalog responses, keyed by the catalog version kept in the database, on the same backend
+# as the product cache
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+
+
+class LRUCache:
+    """Bounded LRU mapping whose entries expire after ttl seconds, with a counter for versioned keys."""
+
+    def __init__(self, maxsize: int = PRODUCT_CACHE_SIZE, ttl: float = PRODUCT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        # Entries keyed by older versions are never read again and age out of the LRU
+        with self._lock:
+            self._version += 1
+            return self._version
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "version": self._version}
+
+
+class SharedCache(SharedObjectClient):
+    """Client for an LRUCache hosted by the stand-in process started with `python -m app.cache`."""
+
+    def __init__(self, address: str = PRODUCT_CACHE_ADDRESS, authkey: bytes = PRODUCT_CACHE_AUTHKEY,
+                 typeid: str = "get_cache"):
+        # An unreachable cache server reads as a miss, so requests fall back to the database
+        super().__init__(address, authkey, typeid, "Shared product cache", fallback=None)
+
+    def get(self, key):
+        return self._call("get", key)
+
+    def set(self, key, value):
+        self._call("set", key, value)
+
+    def delete(self, key):
+        self._call("delete", key)
+
+    def clear(self):
+        self._call("clear")
+
+    def version(self):
+        return self._call("version")
+
+    def bump_version(self):
+        return self._call("bump_version")
+
+    def stats(self):
+        return self._call("stats")
+
+
+def create_product_cache():
+    if PRODUCT_CACHE_BACKEND == "shared":
+        return SharedCache()
+    return LRUCache()
+
+
+def create_catalog_cache():
+    if PRODUCT_CACHE_BACKEND == "shared":
+        return SharedCache(typeid="get_catalog_cache")
+    return LRUCache(maxsize=CATALOG_CACHE_SIZE)
+
+
+# Its version counts invalidations, so a refill can tell whether one happened while it read the row
+product_cache = create_product_cache()
+catalog_cache = create_catalog_cache()
+
+
+async def get_product(db: AsyncSession, product_id: int) -> Optional[Product]:
+    # Serve the product from the cache, filling it from the database on a miss
+    data = product_cache.get(product_id)
+    if data is not None:
+        return Product.model_validate(data)
+
+    # An invalidation while the row is read means the row may predate the write: return it, do not cache it
+    version = product_cache.version()
+    db_product = await db.get(Product, product_id)
+    if db_product and product_cache.version() == version:
+        product_cache.set(product_id, db_product.model_dump())
+    return db_product
+
+
+def invalidate_product(product_id: int):
+    # Called after every committed product write, stock and image updates included
+    product_cache.delete(product_id)
+    product_cache.bump_version()
+
+
+async def catalog_version(db: AsyncSession) -> int:
+    # Bumped by the catalog_version_* triggers on product, in the writing transaction
+    return (await db.execute(text("SELECT version FROM catalogversion"))).scalar_one()
+
+
+async def cached_catalog_response(request: Request, db: AsyncSession, key: tuple, render) -> Response:
+    # render() returns the JSON body and headers of a catalog read; they are reused until the next
+    # product write in any worker. The version is read before rendering, so a body read from the database
+    # while a write commits is filed under the version that write retires.
+    version = await catalog_version(db)
+    entry = catalog_cache.get((version, *key))
+    if entry is None:
+        body, headers = await render()
+        entry = (body, headers, strong_etag(body))
+        catalog_cache.set((version, *key), entry)
+
+    body, headers, etag = entry
+    return conditional_response(request, body, etag, headers)
+
+
+def serve(address: str = PRODUCT_CACHE_ADDRESS, authkey: bytes = PRODUCT_CACHE_AUTHKEY):
+    # Host the product and catalog caches every worker process shares
+    caches = {"get_cache": LRUCache(), "get_catalog_cache": LRUCache(maxsize=CATALOG_CACHE_SIZE)}
+    serve_shared(caches, address, authkey, "Product cache server")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
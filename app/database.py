@@ -1,15 +1,111 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.metrics import instrument_engine
+from app.migrations import run_migrations
 
 
 #Define the database URL (SQLite in this case)
-DATABASE_URL = "sqlite:///./app.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+
+# Optional read-only database for the read endpoints, opened with mode=ro for SQLite;
+# set it to DATABASE_URL for a separate read-only pool on the same file
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", "")
+
+# Async drivers for the same databases, e.g. postgresql+asyncpg://... in production
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def to_async_url(url: str):
+    scheme, rest = url.split(":", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}:{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+# Engine settings
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+# Unbounded by default: a sync handler keeps its connection until its response has been
+# serialized in the threadpool, so a capped pool smaller than the request backlog deadlocks
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "-1"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Pragmas applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative means KiB, so 64 MiB
+}
+
+
+def apply_sqlite_pragmas(engine, pragmas: dict):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    event.listen(engine, "connect", set_pragmas)
+
+
+def engine_options(url: str):
+    options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    # In-memory SQLite uses a single-connection pool that takes no sizing options
+    if ":memory:" not in url:
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+def create_db_engine(url: str = DATABASE_URL, read_only: bool = False, pragmas: dict = SQLITE_PRAGMAS):
+    if url.startswith("sqlite") and read_only:
+        # Open the file through a URI so SQLite itself refuses writes on this engine
+        path = url.split(":///", 1)[1]
+        url = f"sqlite:///file:{path}?mode=ro&uri=true"
+        pragmas = {name: value for name, value in pragmas.items() if name != "journal_mode"}
+
+    db_engine = create_engine(url, **engine_options(url))
+    if url.startswith("sqlite"):
+        apply_sqlite_pragmas(db_engine, pragmas)
+    instrument_engine(db_engine)
+    return db_engine
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL, pragmas: dict = SQLITE_PRAGMAS):
+    db_engine = create_async_engine(url, **engine_options(url))
+    if url.startswith("sqlite"):
+        apply_sqlite_pragmas(db_engine.sync_engine, pragmas)
+    instrument_engine(db_engine.sync_engine)
+    return db_engine
+
 
 #Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_db_engine()
 
-def create_database():
-    SQLModel.metadata.create_all(engine)
+#Create the read-only engine used by read endpoints
+read_engine = create_db_engine(READ_DATABASE_URL, read_only=True) if READ_DATABASE_URL else engine
+
+#Create the async engine used by the async route handlers
+async_engine = create_async_db_engine()
+
+def create_database(db_engine=engine):
+    # Creates the missing tables and migrates in one locked transaction
+    run_migrations(db_engine, SQLModel.metadata)
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+async def get_async_session():
+    # Keep loaded objects usable after commit; lazy refreshes are not allowed under asyncio
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,4 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Dialect specific INSERT constructs that support ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
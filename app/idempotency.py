@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, update
+from sqlalchemy.engine import Engine
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import engine
+from app.dialects import UPSERT_INSERTS
+from app.schemas.sql_models import IdempotencyKey
+from app.sweeper import Sweeper
+
+logger = logging.getLogger(__name__)
+
+# How long a key replays its response, and how often expired keys are purged
+IDEMPOTENCY_KEY_TTL = timedelta(seconds=float(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 60 * 60))))
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "300"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Set on replayed responses so clients and logs can tell them apart
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def request_fingerprint(payload) -> str:
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class IdempotentRequest:
+    """An Idempotency-Key scoped to one user and endpoint; every method is a no-op without a key."""
+
+    def __init__(self, key: Optional[str], user_id: int, endpoint: str, payload):
+        self.key = key
+        self.user_id = user_id
+        self.endpoint = endpoint
+        self.fingerprint = request_fingerprint(payload) if key else None
+
+    def matches(self):
+        return (IdempotencyKey.user_id == self.user_id, IdempotencyKey.endpoint == self.endpoint,
+                IdempotencyKey.key == self.key)
+
+    async def replay(self, db: AsyncSession) -> Optional[Response]:
+        # The stored response of a live key; reusing a key for a different request is an error
+        if not self.key:
+            return None
+        row = (await db.exec(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.response)
+            .where(*self.matches(), IdempotencyKey.created_at >= datetime.utcnow() - IDEMPOTENCY_KEY_TTL)
+        )).first()
+        if row is None:
+            return None
+        if row.fingerprint != self.fingerprint:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Idempotency-Key was already used for a different request")
+        if row.response is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="A request with this Idempotency-Key is still in progress")
+        return Response(content=row.response, status_code=row.status_code, media_type="application/json",
+                        headers={REPLAYED_HEADER: "true"})
+
+    async def claim(self, db: AsyncSession) -> Optional[Response]:
+        # Make this the first write of the transaction: the unique index holds a concurrent
+        # duplicate back until it ends. Returns None once claimed, or, when a duplicate has
+        # committed first, rolls back and returns its response.
+        if not self.key:
+            return None
+        now = datetime.utcnow()
+        statement = UPSERT_INSERTS[db.get_bind().dialect.name](IdempotencyKey).values(
+            user_id=self.user_id,
+            endpoint=self.endpoint,
+            key=self.key,
+            fingerprint=self.fingerprint,
+            created_at=now
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[IdempotencyKey.user_id, IdempotencyKey.endpoint, IdempotencyKey.key],
+            set_={"fingerprint": self.fingerprint, "status_code": None, "response": None, "created_at": now},
+            where=IdempotencyKey.created_at < now - IDEMPOTENCY_KEY_TTL
+        ).returning(IdempotencyKey.id)
+        if (await db.execute(statement)).first() is not None:
+            return None
+
+        await db.rollback()
+        replay = await self.replay(db)
+        if replay is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="A request with this Idempotency-Key is still in progress")
+        return replay
+
+    async def save(self, db: AsyncSession, status_code: int, content):
+        # Store the response in the claiming transaction, so it commits together with the writes
+        if not self.key:
+            return
+        await db.execute(
+            update(IdempotencyKey)
+            .where(*self.matches())
+            .values(status_code=status_code, response=json.dumps(jsonable_encoder(content), separators=(",", ":")))
+        )
+
+
+def purge_expired_keys(engine: Engine = engine):
+    with engine.begin() as connection:
+        return connection.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - IDEMPOTENCY_KEY_TTL)
+        ).rowcount
+
+
+idempotency_key_sweeper = Sweeper("expired idempotency keys", purge_expired_keys, IDEMPOTENCY_SWEEP_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Purged %d expired idempotency keys", purge_expired_keys())
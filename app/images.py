@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageOps
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from app.cache import invalidate_product
+from app.database import engine
+from app.schemas.sql_models import ImageJob, Product
+from app.shared import process_pool
+
+logger = logging.getLogger(__name__)
+
+# Derivative sizes (longest side in pixels) and WebP quality
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "320"))
+DISPLAY_SIZE = int(os.getenv("IMAGE_DISPLAY_SIZE", "1200"))
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+
+# Worker settings; "inprocess" runs the worker inside the app, "external" expects `python -m app.images`
+IMAGE_WORKER_MODE = os.getenv("IMAGE_WORKER_MODE", "inprocess")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_JOB_POLL_INTERVAL = float(os.getenv("IMAGE_JOB_POLL_INTERVAL", "2"))
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS", "3"))
+# A running job not finished within the lease is assumed lost (crash, restart) and claimed again
+IMAGE_JOB_LEASE = timedelta(seconds=float(os.getenv("IMAGE_JOB_LEASE", "300")))
+
+ClaimedJob = namedtuple("ClaimedJob", "id product_id image_path attempts")
+
+
+def derivative_paths(image_path: str):
+    # Derivatives sit next to the original, named after it, so deduplicated uploads share them too
+    stem = os.path.splitext(image_path)[0]
+    return f"{stem}.{THUMBNAIL_SIZE}.webp", f"{stem}.{DISPLAY_SIZE}.webp"
+
+
+def save_webp(image: Image.Image, path: str):
+    temp_path = f"{path}.{os.getpid()}.part"
+    image.save(temp_path, "WEBP", quality=WEBP_QUALITY, method=4)
+    os.replace(temp_path, path)
+
+
+def build_derivatives(image_path: str):
+    # Runs in a worker process; files that already exist are reused as is
+    thumbnail_path, webp_path = derivative_paths(image_path)
+    if os.path.exists(thumbnail_path) and os.path.exists(webp_path):
+        return thumbnail_path, webp_path
+
+    with Image.open(image_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        image.thumbnail((DISPLAY_SIZE, DISPLAY_SIZE))
+        save_webp(image, webp_path)
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        save_webp(image, thumbnail_path)
+    return thumbnail_path, webp_path
+
+
+def enqueue_image_job(db: Session, product: Product):
+    # Queue derivatives for the product's current image in the caller's transaction;
+    # when an identical upload already has them, point the product at those instead
+    product.thumbnail_path, product.webp_path = None, None
+    if not product.image_path:
+        return
+
+    thumbnail_path, webp_path = derivative_paths(product.image_path)
+    if os.path.exists(thumbnail_path) and os.path.exists(webp_path):
+        product.thumbnail_path, product.webp_path = thumbnail_path, webp_path
+        return
+    db.add(ImageJob(product_id=product.id, image_path=product.image_path))
+
+
+def claim_jobs(engine: Engine, limit: int):
+    now = datetime.utcnow()
+    claimable = (
+        select(ImageJob.id)
+        .where(or_(
+            ImageJob.status == "pending",
+            and_(ImageJob.status == "running", ImageJob.updated_at < now - IMAGE_JOB_LEASE)
+        ))
+        .order_by(ImageJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    with engine.begin() as connection:
+        rows = connection.execute(
+            update(ImageJob)
+            .where(ImageJob.id.in_(claimable.scalar_subquery()))
+            .values(status="running", attempts=ImageJob.attempts + 1, updated_at=now)
+            .returning(ImageJob.id, ImageJob.product_id, ImageJob.image_path, ImageJob.attempts)
+        ).all()
+    return [ClaimedJob(*row) for row in rows]
+
+
+def complete_job(engine: Engine, job: ClaimedJob, thumbnail_path: str, webp_path: str):
+    with engine.begin() as connection:
+        # Skip the product if its image changed since the job was queued
+        connection.execute(
+            update(Product)
+            .where(Product.id == job.product_id, Product.image_path == job.image_path)
+            .values(thumbnail_path=thumbnail_path, webp_path=webp_path)
+        )
+        connection.execute(
+            update(ImageJob)
+            .where(ImageJob.id == job.id)
+            .values(status="done", error=None, updated_at=datetime.utcnow())
+        )
+    invalidate_product(job.product_id)
+
+
+def fail_job(engine: Engine, job: ClaimedJob, error: Exception):
+    logger.warning("Image job %d for %s failed: %s", job.id, job.image_path, error)
+    with engine.begin() as connection:
+        connection.execute(
+            update(ImageJob)
+            .where(ImageJob.id == job.id)
+            .values(
+                status="failed" if job.attempts >= IMAGE_JOB_MAX_ATTEMPTS else "pending",
+                error=str(error),
+                updated_at=datetime.utcnow()
+            )
+        )
+
+
+class ImageWorker:
+    """Claims image jobs from the database and builds their derivatives in a process pool."""
+
+    def __init__(self, engine: Engine = engine, workers: int = IMAGE_WORKERS,
+                 poll_interval: float = IMAGE_JOB_POLL_INTERVAL):
+        self.engine = engine
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._pool = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        # Run the worker on a background thread of the app process
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.serve, name="image-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def create_pool(self):
+        return process_pool(self.workers)
+
+    def serve(self):
+        self._pool = self.create_pool()
+        try:
+            self.run()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                logger.exception("Image worker iteration failed")
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self):
+        jobs = claim_jobs(self.engine, self.workers)
+        try:
+            futures = [(self._pool.submit(build_derivatives, job.image_path), job) for job in jobs]
+        except Exception as e:
+            # Hand the jobs back, and replace the pool if a dead worker process broke it
+            for job in jobs:
+                fail_job(self.engine, job, e)
+            if isinstance(e, BrokenProcessPool):
+                self._pool = self.create_pool()
+            raise
+
+        for future, job in futures:
+            try:
+                thumbnail_path, webp_path = future.result()
+            except Exception as e:
+                fail_job(self.engine, job, e)
+            else:
+                complete_job(self.engine, job, thumbnail_path, webp_path)
+        return len(jobs)
+
+
+image_worker = ImageWorker()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Image worker running with %d processes", image_worker.workers)
+    try:
+        image_worker.serve()
+    except KeyboardInterrupt:
+        pass
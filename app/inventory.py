@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.engine import Engine
+
+from app.cache import invalidate_product
+from app.database import engine
+from app.dialects import UPSERT_INSERTS
+from app.schemas.sql_models import Product, StockReservation
+from app.sweeper import Sweeper
+
+logger = logging.getLogger(__name__)
+
+# How long adding to the cart holds stock, and how often expired holds are released
+RESERVATION_TTL = timedelta(seconds=float(os.getenv("RESERVATION_TTL", "900")))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+
+
+# SQLite takes one writer at a time and its busy handler retries with growing sleeps, so under
+# contention some stock writers starve past the busy timeout; this process queues them in order
+stock_write_lock = asyncio.Lock()
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+@asynccontextmanager
+async def stock_writes(db):
+    # Hold around a stock changing transaction, up to and including its commit or rollback
+    if db.get_bind().dialect.name != "sqlite":
+        yield
+        return
+    async with stock_write_lock:
+        yield
+
+
+def stock_adjustment(deltas: dict):
+    # One conditional UPDATE taking deltas[product_id] units from each tracked product (negative
+    # deltas put stock back); a product short of stock is not matched, so callers compare the
+    # rowcount with len(deltas). Untracked products (stock NULL) are left out of deltas.
+    taken = case(deltas, value=Product.id)
+    return (
+        update(Product)
+        .where(Product.id.in_(deltas), Product.stock.is_not(None), Product.stock >= taken)
+        .values(stock=Product.stock - taken)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def check_adjusted(result, deltas: dict):
+    if result.rowcount != len(deltas):
+        raise InsufficientStock(sorted(deltas))
+
+
+def reservation_deltas(products: dict, quantities: dict, reserved: dict):
+    # Units still to take (or, when negative, to give back) for tracked products once the
+    # user's holds are accounted for
+    deltas = {}
+    for product_id in quantities.keys() | reserved.keys():
+        product = products.get(product_id)
+        if product is None or product.stock is None:
+            continue
+        delta = quantities.get(product_id, 0) - reserved.get(product_id, 0)
+        if delta:
+            deltas[product_id] = delta
+    return deltas
+
+
+async def reserve_stock(db, user_id: int, quantities: dict) -> list:
+    # Take quantities[product_id] more units of each tracked product with one conditional decrement
+    # and add them to the user's holds, refreshing their expiry; raises InsufficientStock when a
+    # product is short (the caller rolls back). Returns the products whose stock changed
+    tracked_ids = (await db.execute(
+        select(Product.id).where(Product.id.in_(quantities), Product.stock.is_not(None))
+    )).scalars().all()
+    deltas = {product_id: quantities[product_id] for product_id in tracked_ids if quantities[product_id] > 0}
+    if not deltas:
+        return []
+    check_adjusted(await db.execute(stock_adjustment(deltas)), deltas)
+
+    expires_at = datetime.utcnow() + RESERVATION_TTL
+    statement = UPSERT_INSERTS[db.get_bind().dialect.name](StockReservation).values([
+        {"user_id": user_id, "product_id": product_id, "quantity": quantity, "expires_at": expires_at}
+        for product_id, quantity in deltas.items()
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[StockReservation.user_id, StockReservation.product_id],
+        set_={"quantity": StockReservation.quantity + statement.excluded.quantity, "expires_at": expires_at}
+    ))
+    return list(deltas)
+
+
+async def trim_reservations(db, user_id: int, quantities: dict) -> list:
+    # Cut the user's holds down to what is left in the cart (quantities[product_id], 0 for a removed
+    # line) and put the difference back in stock; returns the products whose stock changed
+    held = (await db.execute(
+        select(StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.user_id == user_id, StockReservation.product_id.in_(quantities))
+    )).all()
+
+    released = {}
+    for product_id, quantity in held:
+        kept = max(quantities[product_id], 0)
+        if quantity <= kept:
+            continue
+        released[product_id] = kept - quantity
+        hold = (StockReservation.user_id == user_id, StockReservation.product_id == product_id)
+        if kept:
+            await db.execute(update(StockReservation).where(*hold).values(quantity=kept))
+        else:
+            await db.execute(delete(StockReservation).where(*hold))
+
+    if released:
+        await db.execute(stock_adjustment(released))
+    return list(released)
+
+
+def release_expired_reservations(engine: Engine = engine):
+    # Delete expired holds and return their units to stock in one transaction
+    with engine.begin() as connection:
+        rows = connection.execute(
+            delete(StockReservation)
+            .where(StockReservation.expires_at < datetime.utcnow())
+            .returning(StockReservation.product_id, StockReservation.quantity)
+        ).all()
+        released = defaultdict(int)
+        for product_id, quantity in rows:
+            released[product_id] -= quantity
+        if released:
+            connection.execute(stock_adjustment(dict(released)))
+
+    for product_id in released:
+        invalidate_product(product_id)
+    return len(rows)
+
+
+reservation_sweeper = Sweeper("expired stock reservations", release_expired_reservations, RESERVATION_SWEEP_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Released %d expired stock reservations", release_expired_reservations())
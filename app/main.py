@@ -1,14 +1,29 @@
 import os
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.database import create_database
+from app.idempotency import idempotency_key_sweeper
+from app.images import IMAGE_WORKER_MODE, image_worker
+from app.inventory import reservation_sweeper
+from app.metrics import MetricsMiddleware
+from app.passwords import password_pool
+from app.profiling import PROFILE_REQUESTS_ENABLED, RequestProfilerMiddleware, install_profile_signal, profile_sync_endpoints
+from app.ratelimit import RateLimitMiddleware
+from app.static import CachedStaticFiles
 
 from sqlmodel import SQLModel, create_engine, Session
 
-from app.routes import user, product, cart, order, admin
+from app.routes import user, product, cart, order, admin, metrics
 
-app = FastAPI()
+# orjson encodes every response_model result several times faster than the stdlib json module
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Innermost, so ?profile=1 reports cover the handler and not the other middleware
+app.add_middleware(RequestProfilerMiddleware)
+
+# Per-client budgets; added before CORS so throttled responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
 
 origins = ["*"]
 app.add_middleware(
@@ -17,19 +32,42 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed", "ETag"],
 )
 
-# Mount the static directory to serve files
-app.mount("/static", StaticFiles(directory=os.path.join(os.getcwd(), "static")), name="static")
+# Outermost, so latency covers every other middleware and throttled requests are counted too
+app.add_middleware(MetricsMiddleware)
+
+# Mount the static directory to serve files with cache headers, ranges and precompressed variants
+app.mount("/static", CachedStaticFiles(directory=os.path.join(os.getcwd(), "static")), name="static")
 
 
+# Before the product routes, whose /{product_id} would otherwise match /metrics
+app.include_router(metrics.router)
 app.include_router(user.router)
 app.include_router(product.router)
 app.include_router(cart.router)
 app.include_router(order.router)
 app.include_router(admin.router)
 
+if PROFILE_REQUESTS_ENABLED:
+    profile_sync_endpoints(app.routes)
+
 
 @app.on_event("startup")
 def startup_event():
-    create_database()
\ No newline at end of file
+    create_database()
+    if IMAGE_WORKER_MODE == "inprocess":
+        image_worker.start()
+    reservation_sweeper.start()
+    idempotency_key_sweeper.start()
+    password_pool.start()
+    install_profile_signal()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    image_worker.stop()
+    reservation_sweeper.stop()
+    idempotency_key_sweeper.stop()
+    password_pool.shutdown()
@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Instrumentation settings; requests slower than SLOW_REQUEST_SECONDS are logged with their
+# slowest SQL statements
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0.5"))
+SLOW_REQUEST_STATEMENTS = int(os.getenv("SLOW_REQUEST_STATEMENTS", "5"))
+# Statements kept per request for the slow request log; later ones are only counted
+STATEMENTS_KEPT = 200
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """Database work done on behalf of one request."""
+
+    __slots__ = ("queries", "db_seconds", "rows", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.statements = []
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class RouteMetrics:
+    """Running totals for one (method, route template) pair."""
+
+    __slots__ = ("buckets", "count", "seconds", "queries", "db_seconds", "rows", "statuses")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    """In-process aggregation of request metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            metrics = self.routes.get((method, route))
+            if metrics is None:
+                metrics = self.routes[(method, route)] = RouteMetrics()
+            metrics.buckets[bucket] += 1
+            metrics.count += 1
+            metrics.seconds += seconds
+            metrics.queries += stats.queries
+            metrics.db_seconds += stats.db_seconds
+            metrics.rows += stats.rows
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            snapshot = [
+                (method, route, list(m.buckets), m.count, m.seconds, m.queries, m.db_seconds, m.rows, dict(m.statuses))
+                for (method, route), m in sorted(self.routes.items())
+            ]
+
+        lines = [
+            "# HELP http_requests_total Requests served, by route template and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for method, route, _, _, _, _, _, _, statuses in snapshot:
+            for status, count in sorted(statuses.items()):
+                lines.append(f'http_requests_total{{{labels(method, route)},status="{status}"}} {count}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, until the last byte of the body was sent.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for method, route, buckets, count, seconds, _, _, _, _ in snapshot:
+            cumulative = 0
+            for bound, observed in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                cumulative += observed
+                lines.append(f'http_request_duration_seconds_bucket{{{labels(method, route)},le="{bound}"}} {cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels(method, route)}}} {seconds}")
+            lines.append(f"http_request_duration_seconds_count{{{labels(method, route)}}} {count}")
+
+        for name, help_text, index in (
+            ("db_queries_total", "SQL statements executed.", 5),
+            ("db_seconds_total", "Time spent executing SQL statements.", 6),
+            ("db_rows_total", "Rows fetched by queries or changed by writes.", 7),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for entry in snapshot:
+                lines.append(f"{name}{{{labels(entry[0], entry[1])}}} {entry[index]}")
+
+        return "\n".join(lines) + "\n"
+
+
+def labels(method: str, route: str) -> str:
+    route = route.replace("\\", "\\\\").replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+registry = MetricsRegistry()
+
+
+class CountingCursor:
+    """DBAPI cursor wrapper counting the rows fetched through it."""
+
+    def __init__(self, cursor, stats: RequestStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_request.get() is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    started = getattr(context, "metrics_started", None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if len(stats.statements) < STATEMENTS_KEPT:
+        stats.statements.append((elapsed, statement))
+
+    if cursor.description is None:
+        stats.rows += max(cursor.rowcount, 0)
+    else:
+        # The result reads its rows through context.cursor, which is set up after this event
+        context.cursor = CountingCursor(cursor, stats)
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def route_template(scope: Scope, root_path: str) -> str:
+    # Label by the matched route, never the raw path, so the number of series stays bounded
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("root_path", "") != root_path:
+        # A mounted app such as /static
+        return scope["root_path"][len(root_path):]
+    return "unmatched"
+
+
+def log_slow_request(scope: Scope, status: int, seconds: float, stats: RequestStats):
+    slowest = sorted(stats.statements, key=lambda entry: entry[0], reverse=True)[:SLOW_REQUEST_STATEMENTS]
+    logger.warning(
+        "Slow request %s %s -> %d in %.0f ms: %d queries, %.0f ms in the database, %d rows%s",
+        scope["method"], scope["path"], status, seconds * 1000, stats.queries, stats.db_seconds * 1000, stats.rows,
+        "".join(f"\n  {elapsed * 1000:.1f} ms  {' '.join(statement.split())}" for elapsed, statement in slowest)
+    )
+
+
+class MetricsMiddleware:
+    """Records latency and database work per route template, and logs slow requests."""
+
+    def __init__(self, app: ASGIApp, metrics: MetricsRegistry = registry):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        root_path = scope.get("root_path", "")
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            current_request.reset(token)
+            self.metrics.observe(scope["method"], route_template(scope, root_path), status, seconds, stats)
+            if seconds >= SLOW_REQUEST_SECONDS:
+                log_slow_request(scope, status, seconds, stats)
@@ -0,0 +1,198 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.analytics import rebuild_sales_rollup
+
+logger = logging.getLogger(__name__)
+
+# Rows of the old per-product order table placed by the same user within this
+# window belong to one checkout (the old place_order committed line by line)
+ORDER_GROUP_WINDOW = timedelta(seconds=5)
+
+
+def parse_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def convert_orders_to_header_lines(connection: Connection):
+    # Move the per-product "order" rows into orderheader/orderline
+    if not inspect(connection).has_table("order"):
+        return
+
+    rows = connection.execute(text(
+        'SELECT id, user_id, product_id, quantity, total_amount, order_date FROM "order" ORDER BY user_id, id'
+    )).all()
+
+    groups = []
+    for row in rows:
+        order_date = parse_datetime(row.order_date)
+        if groups:
+            last_date, last_row = groups[-1][-1]
+            if last_row.user_id == row.user_id and order_date - last_date <= ORDER_GROUP_WINDOW:
+                groups[-1].append((order_date, row))
+                continue
+        groups.append([(order_date, row)])
+
+    for group in groups:
+        # The header keeps the id and date of the first row, the lines keep their original ids
+        first_date, first_row = group[0]
+        connection.execute(
+            text("INSERT INTO orderheader (id, user_id, order_date, total_quantity, total_amount) "
+                 "VALUES (:id, :user_id, :order_date, :total_quantity, :total_amount)"),
+            {
+                "id": first_row.id,
+                "user_id": first_row.user_id,
+                "order_date": first_date,
+                "total_quantity": sum(row.quantity for _, row in group),
+                "total_amount": sum(row.total_amount for _, row in group),
+            }
+        )
+        connection.execute(
+            text("INSERT INTO orderline (id, order_id, product_id, quantity, unit_price, line_total) "
+                 "VALUES (:id, :order_id, :product_id, :quantity, :unit_price, :line_total)"),
+            [
+                {
+                    "id": row.id,
+                    "order_id": first_row.id,
+                    "product_id": row.product_id,
+                    "quantity": row.quantity,
+                    "unit_price": row.total_amount / row.quantity if row.quantity else 0.0,
+                    "line_total": row.total_amount,
+                }
+                for _, row in group
+            ]
+        )
+
+    connection.execute(text('DROP TABLE "order"'))
+    logger.info("Converted %d order rows into %d orders", len(rows), len(groups))
+
+
+def create_product_search_index(connection: Connection):
+    # Replace the B-tree on product.description with an FTS5 index kept in sync by triggers
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_product_description")
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+        "name, description, content='product', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN "
+        "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); "
+        "END"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "END"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, description ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); "
+        "END"
+    )
+    connection.exec_driver_sql("INSERT INTO product_fts(product_fts) VALUES ('rebuild')")
+
+
+def add_product_image_derivatives(connection: Connection):
+    # Add the derivative path columns to an existing product table and queue every image for the worker
+    columns = {column["name"] for column in inspect(connection).get_columns("product")}
+    for name in ("thumbnail_path", "webp_path"):
+        if name not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE product ADD COLUMN {name} VARCHAR")
+
+    # Rows saved on Windows hold backslash separated paths, which neither the worker nor a URL can use
+    connection.exec_driver_sql("UPDATE product SET image_path = REPLACE(image_path, '\\', '/')")
+
+    now = datetime.utcnow()
+    connection.execute(
+        text("INSERT INTO imagejob (product_id, image_path, status, attempts, created_at, updated_at) "
+             "SELECT id, image_path, 'pending', 0, :now, :now FROM product WHERE image_path IS NOT NULL"),
+        {"now": now}
+    )
+
+
+def merge_duplicate_cart_items(connection: Connection):
+    # Fold duplicate (user_id, product_id) cart rows into the oldest one, then enforce uniqueness
+    connection.exec_driver_sql(
+        "UPDATE cartitem SET quantity = ("
+        "SELECT SUM(duplicate.quantity) FROM cartitem AS duplicate "
+        "WHERE duplicate.user_id = cartitem.user_id AND duplicate.product_id = cartitem.product_id"
+        ") WHERE id IN (SELECT MIN(id) FROM cartitem GROUP BY user_id, product_id HAVING COUNT(*) > 1)"
+    )
+    merged = connection.exec_driver_sql(
+        "DELETE FROM cartitem WHERE id NOT IN (SELECT MIN(id) FROM cartitem GROUP BY user_id, product_id)"
+    ).rowcount
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_cartitem_user_id_product_id ON cartitem (user_id, product_id)"
+    )
+    logger.info("Merged %d duplicate cart items", merged)
+
+
+def add_product_stock(connection: Connection):
+    # Existing products start untracked (NULL stock) and keep selling without limit until stock is set
+    columns = {column["name"] for column in inspect(connection).get_columns("product")}
+    if "stock" not in columns:
+        connection.exec_driver_sql("ALTER TABLE product ADD COLUMN stock INTEGER")
+
+
+def add_catalog_version(connection: Connection):
+    # One counter row, bumped by triggers in the transaction of every product write, so every worker
+    # sees the same catalog version; it keys the cached catalog responses
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS catalogversion (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)"
+    )
+    connection.exec_driver_sql("INSERT OR IGNORE INTO catalogversion (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS catalog_version_{event.lower()} AFTER {event} ON product BEGIN "
+            "UPDATE catalogversion SET version = version + 1; "
+            "END"
+        )
+
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    convert_orders_to_header_lines,
+    create_product_search_index,
+    rebuild_sales_rollup,
+    add_product_image_derivatives,
+    merge_duplicate_cart_items,
+    add_product_stock,
+    add_catalog_version,
+]
+
+
+def run_migrations(engine: Engine, metadata: MetaData = None):
+    # Every worker runs this at startup. BEGIN IMMEDIATE takes the database's write lock before
+    # user_version is read, so a worker starting next to another one waits until that one commits,
+    # then finds the tables created and the version current instead of applying the migrations twice
+    with engine.connect() as connection:
+        # Leave the transaction to the BEGIN below rather than the driver's deferred one
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            if metadata is not None:
+                metadata.create_all(connection)
+            version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logger.info("Applying migration %d: %s", number, migration.__name__)
+                migration(connection)
+                connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+        except BaseException:
+            connection.exec_driver_sql("ROLLBACK")
+            raise
+        connection.exec_driver_sql("COMMIT")
+
+
+if __name__ == "__main__":
+    from app.database import create_database
+    import app.schemas.sql_models  # noqa: F401  (registers the tables)
+
+    logging.basicConfig(level=logging.INFO)
+    create_database()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import anyio
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from app.shared import process_pool
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor; hashes made with another cost are redone at the next successful login
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+# Hashing runs in its own processes so a login burst cannot take the CPU time and threadpool
+# workers the other requests need; 0 workers hashes in the app's threadpool instead. Past
+# PASSWORD_QUEUE_LIMIT hashes waiting or running, new ones are refused with a 503.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", str(max(1, PASSWORD_WORKERS) * 8)))
+PASSWORD_RETRY_AFTER = os.getenv("PASSWORD_RETRY_AFTER", "1")
+# Workers run at a lower CPU priority, so on a busy machine request handling goes first
+PASSWORD_WORKER_NICE = int(os.getenv("PASSWORD_WORKER_NICE", "10"))
+
+# Password hashing context
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS)
+
+
+def hash_secret(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_secret(password: str, hashed_password: str):
+    # Returns (verified, new hash or None), rehashing when the stored cost is not the current one
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+def lower_worker_priority():
+    # os.nice only exists on Unix; Windows workers keep the default priority
+    if hasattr(os, "nice"):
+        os.nice(PASSWORD_WORKER_NICE)
+
+
+class PasswordPool:
+    """Bounded process pool for bcrypt."""
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def create_executor(self):
+        return process_pool(self.workers, initializer=lower_worker_priority)
+
+    def start(self):
+        # Spawn the workers up front so the first logins do not wait for process start up
+        with self._lock:
+            if not self.workers or self._executor is not None:
+                return
+            self._executor = self.create_executor()
+            for _ in range(self.workers):
+                self._executor.submit(os.getpid)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    async def run(self, function, *args):
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many password checks in progress, try again shortly",
+                    headers={"Retry-After": PASSWORD_RETRY_AFTER}
+                )
+            self.pending += 1
+            if self.workers and self._executor is None:
+                self._executor = self.create_executor()
+            executor = self._executor
+
+        try:
+            if not self.workers:
+                return await anyio.to_thread.run_sync(function, *args)
+            return await asyncio.wrap_future(executor.submit(function, *args))
+        except BrokenProcessPool:
+            # A worker process died; replace the pool for the next caller
+            logger.exception("Password pool broken, restarting it")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password service restarting, try again shortly",
+                headers={"Retry-After": PASSWORD_RETRY_AFTER}
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+
+password_pool = PasswordPool()
+
+
+async def hash_password(password: str) -> str:
+    return await password_pool.run(hash_secret, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    return await password_pool.run(verify_secret, password, hashed_password)
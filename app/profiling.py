@@ -0,0 +1,196 @@
+import asyncio
+import cProfile
+import functools
+import io
+import linecache
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, status
+from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Sampling profiler: how often the stacks of every thread are read, and the longest run allowed.
+# No thread runs, and nothing is sampled, unless a profile has been asked for.
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+# `kill -USR2 <worker pid>` samples that worker for PROFILE_SIGNAL_SECONDS into PROFILE_DIR
+PROFILE_SIGNAL_SECONDS = float(os.getenv("PROFILE_SIGNAL_SECONDS", "10"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# `?profile=1` answers with the cProfile report of that call instead of its response; off by
+# default, since it lets any caller spend server time on profiling
+PROFILE_REQUESTS_ENABLED = os.getenv("PROFILE_REQUESTS_ENABLED", "false").lower() == "true"
+PROFILE_REPORT_LINES = int(os.getenv("PROFILE_REPORT_LINES", "50"))
+
+# A thread is taken to be waiting for work when its innermost Python frame is in one of these
+# files, or on a line making one of these calls (a C-level blocking call leaves no frame of its own)
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+IDLE_CALLS = (".get(", ".wait(", ".select(", "run_until_complete(", "sleep(")
+
+
+def frame_label(code) -> str:
+    # co_qualname (Class.method) is new in Python 3.11; older versions only have the bare name
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def is_idle(frame) -> bool:
+    if os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+        return True
+    line = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+    return any(call in line for call in IDLE_CALLS)
+
+
+class SamplingProfiler:
+    """Statistical profiler reading every thread's stack at a fixed interval, one run at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL, include_idle: bool = False) -> Counter:
+        # Returns collapsed stacks (thread;outermost;...;innermost) and their sample counts
+        if not self._lock.acquire(blocking=False):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running")
+        try:
+            stacks = Counter()
+            own_thread = threading.get_ident()
+            deadline = time.perf_counter() + min(seconds, PROFILE_MAX_SECONDS)
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    if not include_idle and is_idle(frame):
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(frame_label(frame.f_code))
+                        frame = frame.f_back
+                    labels.append(names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(labels))] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+
+sampling_profiler = SamplingProfiler()
+
+
+def collapsed(stacks: Counter) -> str:
+    # The folded format read by flamegraph.pl, speedscope and inferno
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile_to_file(seconds: float = PROFILE_SIGNAL_SECONDS):
+    try:
+        stacks = sampling_profiler.sample(seconds)
+    except HTTPException:
+        logger.warning("Profile requested while another one is running")
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{int(time.time())}.folded")
+    with open(path, "w") as profile_file:
+        profile_file.write(collapsed(stacks))
+    logger.info("Wrote %d samples to %s", sum(stacks.values()), path)
+
+
+def install_profile_signal():
+    # SIGUSR2 profiles the worker it is sent to, without going through the load balancer
+    if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(
+            target=profile_to_file, name="profiler", daemon=True).start())
+
+
+# cProfile profilers of the request being profiled; only one runs at a time, since
+# profilers enabled on the same thread would replace each other
+request_profiles: ContextVar[Optional[list]] = ContextVar("request_profiles", default=None)
+request_profile_lock = asyncio.Lock()
+
+
+def profiled_call(call):
+    # Sync endpoints run in the threadpool, out of reach of the profiler on the event loop thread
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        profiles = request_profiles.get()
+        if profiles is None:
+            return call(*args, **kwargs)
+        profiler = cProfile.Profile()
+        profiles.append(profiler)
+        profiler.enable()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return wrapper
+
+
+def profile_sync_endpoints(routes):
+    # Call once, after every router has been included
+    for route in routes:
+        if isinstance(route, APIRoute) and not asyncio.iscoroutinefunction(route.dependant.call):
+            route.dependant.call = profiled_call(route.dependant.call)
+
+
+class RequestProfilerMiddleware:
+    """Answers `?profile=1` requests with the cProfile report of the call, when PROFILE_REQUESTS_ENABLED."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] != "http" or not PROFILE_REQUESTS_ENABLED
+                or ("profile", "1") not in parse_qsl(scope["query_string"].decode("latin-1"))):
+            await self.app(scope, receive, send)
+            return
+
+        if request_profile_lock.locked():
+            await send_text(send, status.HTTP_409_CONFLICT, "Another request is being profiled\n")
+            return
+
+        async with request_profile_lock:
+            response_status = 500
+
+            async def discard(message: Message):
+                # The report replaces the response; only its status is kept
+                nonlocal response_status
+                if message["type"] == "http.response.start":
+                    response_status = message["status"]
+
+            # Everything else the event loop runs meanwhile is in the report too
+            profiles = []
+            token = request_profiles.set(profiles)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                profiler.disable()
+                request_profiles.reset(token)
+
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        for thread_profiler in profiles:
+            stats.add(thread_profiler)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        await send_text(send, status.HTTP_200_OK, report.getvalue(), {"X-Profiled-Status": str(response_status)})
+
+
+async def send_text(send: Send, status_code: int, text: str, headers: Optional[dict] = None):
+    body = text.encode()
+    raw_headers = [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())]
+    raw_headers += [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
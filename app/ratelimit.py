@@ -0,0 +1,237 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from fastapi import HTTPException, Request, status
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.shared import SharedObjectClient, serve as serve_shared
+from app.utils import decode_token
+
+logger = logging.getLogger(__name__)
+
+# Limiter settings; "shared" keeps the buckets in the stand-in process started with
+# `python -m app.ratelimit`, so every worker draws from the same budgets
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")  # "local" or "shared"
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_ADDRESS = os.getenv("RATE_LIMIT_ADDRESS", "127.0.0.1:50056")
+RATE_LIMIT_AUTHKEY = os.getenv("RATE_LIMIT_AUTHKEY", "rate-limit").encode()
+
+
+def rate_limit_budget(name: str, rate: float, burst: int):
+    # (rate, burst) of a rule, overridden by RATE_LIMIT_<NAME>_RATE and RATE_LIMIT_<NAME>_BURST
+    prefix = "RATE_LIMIT_" + name.upper().replace("-", "_")
+    return float(os.getenv(f"{prefix}_RATE", str(rate))), int(os.getenv(f"{prefix}_BURST", str(burst)))
+
+
+# Budget for requests no other rule matches, per client (the user of a bearer token, else the IP)
+RATE_LIMIT_DEFAULT_RATE, RATE_LIMIT_DEFAULT_BURST = rate_limit_budget("default", 50, 100)
+
+# Failed logins per (IP, account): the first few are free, then each one locks the pair out
+# for twice as long as the last, up to the maximum; the count resets after a quiet window
+LOGIN_FREE_FAILURES = int(os.getenv("LOGIN_FREE_FAILURES", "3"))
+LOGIN_BACKOFF_BASE = float(os.getenv("LOGIN_BACKOFF_BASE", "1"))
+LOGIN_BACKOFF_MAX = float(os.getenv("LOGIN_BACKOFF_MAX", str(15 * 60)))
+LOGIN_FAILURE_WINDOW = float(os.getenv("LOGIN_FAILURE_WINDOW", str(15 * 60)))
+
+# Paths served without a budget
+EXEMPT_PREFIXES = ("/static/",)
+
+# pattern is matched against the path and query string; rate is in requests per second;
+# key is "ip", "client" (user or IP) or "route" (one budget for everyone). Each budget can be
+# overridden like the default one, e.g. RATE_LIMIT_CATALOG_FULL_RATE and RATE_LIMIT_CATALOG_FULL_BURST
+RateLimit = namedtuple("RateLimit", "name methods pattern rate burst key")
+
+RATE_LIMITS = (
+    RateLimit("login", {"POST"}, re.compile(r"^/(login/|adminlogin/|token)$"),
+              *rate_limit_budget("login", 10 / 60, 10), "ip"),
+    RateLimit("register", {"POST"}, re.compile(r"^/(register|adminregister)/$"),
+              *rate_limit_budget("register", 5 / 60, 5), "ip"),
+    RateLimit("register-all", {"POST"}, re.compile(r"^/(register|adminregister)/$"),
+              *rate_limit_budget("register-all", 5, 20), "route"),
+    RateLimit("catalog", {"GET"}, re.compile(r"^/allproducts(\?|$)"),
+              *rate_limit_budget("catalog", 5, 20), "client"),
+    # Streaming the whole catalog: stream=true without a limit; paged reads only spend the catalog budget
+    RateLimit("catalog-full", {"GET"}, re.compile(
+        r"^/allproducts\?(?=(.*&)?stream=(?i:true|1|yes|on|t|y)(&|$))(?!(.*&)?limit=)"),
+              *rate_limit_budget("catalog-full", 1 / 10, 3), "client"),
+)
+
+
+class RateLimitStore:
+    """Token buckets and login failure counts in a bounded LRU mapping."""
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def take(self, key, rate: float, burst: int) -> float:
+        # Take one token; returns 0 when allowed, else the seconds until a token is available
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._entries.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._set(key, (tokens - 1, now))
+                return 0.0
+            self._set(key, (tokens, now))
+            return (1 - tokens) / rate
+
+    def backoff_wait(self, key, window: float) -> float:
+        # Seconds left on the lockout of key; failures older than window are forgotten
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return 0.0
+            failures, locked_until, last_failure = entry
+            if now - last_failure > window:
+                del self._entries[key]
+                return 0.0
+            return max(locked_until - now, 0.0)
+
+    def record_failure(self, key, free: int, base: float, maximum: float, window: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            failures, _, last_failure = self._entries.get(key, (0, now, now))
+            failures = failures + 1 if now - last_failure <= window else 1
+            lockout = 0.0 if failures <= free else min(maximum, base * 2 ** (failures - free - 1))
+            self._set(key, (failures, now + lockout, now))
+            return lockout
+
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SharedRateLimitStore(SharedObjectClient):
+    """Client for a RateLimitStore hosted by the stand-in process started with `python -m app.ratelimit`."""
+
+    def __init__(self, address: str = RATE_LIMIT_ADDRESS, authkey: bytes = RATE_LIMIT_AUTHKEY):
+        # Fail open: an unreachable limiter lets every request through
+        super().__init__(address, authkey, "get_store", "Shared rate limit store", fallback=0.0)
+
+    def take(self, key, rate: float, burst: int) -> float:
+        return self._call("take", key, rate, burst)
+
+    def backoff_wait(self, key, window: float) -> float:
+        return self._call("backoff_wait", key, window)
+
+    def record_failure(self, key, free: int, base: float, maximum: float, window: float) -> float:
+        return self._call("record_failure", key, free, base, maximum, window)
+
+    def reset(self, key):
+        self._call("reset", key)
+
+
+def create_rate_limit_store():
+    if RATE_LIMIT_BACKEND == "shared":
+        return SharedRateLimitStore()
+    return RateLimitStore()
+
+
+rate_limit_store = create_rate_limit_store()
+
+
+def too_many_requests(retry_after: float):
+    return {"Retry-After": str(max(math.ceil(retry_after), 1))}
+
+
+def client_ip(scope: Scope) -> str:
+    # Run uvicorn with --proxy-headers behind a load balancer so this is the caller's address
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def client_key(scope: Scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            try:
+                claims = decode_token(value[7:].decode("latin-1"))
+            except HTTPException:
+                break
+            return f"{claims.get('role')}:{claims['sub']}"
+    return f"ip:{client_ip(scope)}"
+
+
+class RateLimitMiddleware:
+    """Applies the RATE_LIMITS budgets (or the default one) and answers 429 with Retry-After."""
+
+    def __init__(self, app: ASGIApp, limits=RATE_LIMITS, store=None):
+        self.app = app
+        self.limits = limits
+        self.store = store or rate_limit_store
+        self.default = RateLimit("default", None, None, RATE_LIMIT_DEFAULT_RATE, RATE_LIMIT_DEFAULT_BURST, "client")
+
+    def matching(self, method: str, target: str):
+        rules = [rule for rule in self.limits if method in rule.methods and rule.pattern.match(target)]
+        return rules or [self.default]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        target = scope["path"]
+        if scope["query_string"]:
+            target += "?" + scope["query_string"].decode("latin-1")
+        for rule in self.matching(scope["method"], target):
+            if rule.key == "route":
+                key = rule.name
+            elif rule.key == "ip":
+                key = f"{rule.name}:ip:{client_ip(scope)}"
+            else:
+                key = f"{rule.name}:{client_key(scope)}"
+            wait = self.store.take(key, rule.rate, rule.burst)
+            if wait:
+                body = json.dumps({"detail": "Too many requests"}).encode()
+                headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                headers += [(name.lower().encode(), value.encode()) for name, value in too_many_requests(wait).items()]
+                await send({"type": "http.response.start", "status": status.HTTP_429_TOO_MANY_REQUESTS, "headers": headers})
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        await self.app(scope, receive, send)
+
+
+def login_backoff_key(request: Request, role: str, account: str) -> str:
+    return f"login-failures:{role}:{account}:{client_ip(request.scope)}"
+
+
+def check_login_backoff(key: str):
+    # Refuse before any password check while the (IP, account) pair is locked out
+    wait = rate_limit_store.backoff_wait(key, LOGIN_FAILURE_WINDOW)
+    if wait:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many failed logins, try again later", headers=too_many_requests(wait))
+
+
+def record_login_failure(key: str):
+    rate_limit_store.record_failure(key, LOGIN_FREE_FAILURES, LOGIN_BACKOFF_BASE, LOGIN_BACKOFF_MAX, LOGIN_FAILURE_WINDOW)
+
+
+def reset_login_backoff(key: str):
+    rate_limit_store.reset(key)
+
+
+def serve(address: str = RATE_LIMIT_ADDRESS, authkey: bytes = RATE_LIMIT_AUTHKEY):
+    # Host a single RateLimitStore that every worker process shares
+    serve_shared({"get_store": RateLimitStore()}, address, authkey, "Rate limit store")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
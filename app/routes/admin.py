@@ -1,9 +1,15 @@
-from fastapi import Depends, HTTPException, status, APIRouter
-from sqlmodel import Session
+import anyio
+from fastapi import Depends, HTTPException, Query, Request, status, APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.schemas.sql_models import  Admin
-from app.schemas.admin_schema import AdminCreate, AdminBase, AdminResponse, AdminLogin
-from app.database import get_session
-from app.utils import hash_password, verify_password
+from app.schemas.admin_schema import AdminCreate, AdminBase, AdminResponse, AdminLogin, AdminLoginResponse
+from app.database import get_session, get_async_session
+from app.passwords import hash_password, verify_password
+from app.profiling import PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL, collapsed, sampling_profiler
+from app.ratelimit import check_login_backoff, login_backoff_key, record_login_failure, reset_login_backoff
+from app.utils import create_access_token, get_current_admin, invalidate_account, require_admin
 from typing import List
 from app import schemas
 
@@ -11,14 +17,14 @@ router = APIRouter(tags=["Admin"])
 
 
 @router.post("/adminregister/", response_model=schemas.admin_schema.AdminResponse, status_code=status.HTTP_201_CREATED)
-def register_admin(admin_create: AdminCreate, db: Session = Depends(get_session)):
+async def register_admin(admin_create: AdminCreate, db: AsyncSession = Depends(get_async_session)):
     # Check if the admin already exists
-    existing_admin = db.query(Admin).filter(Admin.adminname == admin_create.adminname).first()
+    existing_admin = (await db.exec(select(Admin).where(Admin.adminname == admin_create.adminname))).first()
     if existing_admin:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Admin already exists")
 
     # Hash the admin's password before storing it
-    hashed_password = hash_password(admin_create.password)
+    hashed_password = await hash_password(admin_create.password)
 
     # Create a new admin instance
     new_admin = Admin(
@@ -29,8 +35,8 @@ def register_admin(admin_create: AdminCreate, db: Session = Depends(get_session)
 
     # Add the new admin to the database
     db.add(new_admin)
-    db.commit()
-    db.refresh(new_admin)
+    await db.commit()
+    await db.refresh(new_admin)
 
     # Return AdminResponse with the registered admin details
     return schemas.admin_schema.AdminResponse(
@@ -40,29 +46,47 @@ def register_admin(admin_create: AdminCreate, db: Session = Depends(get_session)
     )
 
 
-@router.post("/adminlogin/", response_model=AdminResponse)
-def login_admin(admin_login: AdminLogin, db: Session = Depends(get_session)):
+@router.post("/adminlogin/", response_model=AdminLoginResponse)
+async def login_admin(request: Request, admin_login: AdminLogin, db: AsyncSession = Depends(get_async_session)):
+    # Refuse early while this client is backing off from failed attempts on the account
+    backoff_key = login_backoff_key(request, "admin", admin_login.adminname)
+    check_login_backoff(backoff_key)
+
     # Retrieve the admin by adminname
-    db_admin = db.query(Admin).filter(Admin.adminname == admin_login.adminname).first()
+    db_admin = (await db.exec(select(Admin).where(Admin.adminname == admin_login.adminname))).first()
     if not db_admin:
+        record_login_failure(backoff_key)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Admin not found")
 
     # Verify the password
-    if not verify_password(admin_login.password, db_admin.password):
+    verified, new_hash = await verify_password(admin_login.password, db_admin.password)
+    if not verified:
+        record_login_failure(backoff_key)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password")
-
-    # Admin authenticated successfully, return admin details as AdminResponse
-    return AdminResponse(id=db_admin.id, adminname=db_admin.adminname, email=db_admin.email)
+    reset_login_backoff(backoff_key)
+
+    # Store a hash at the current cost factor
+    if new_hash:
+        db_admin.password = new_hash
+        await db.commit()
+
+    # Admin authenticated successfully, return admin details with a bearer token for later requests
+    return AdminLoginResponse(
+        id=db_admin.id,
+        adminname=db_admin.adminname,
+        email=db_admin.email,
+        access_token=create_access_token("admin", db_admin.id)
+    )
 
 
-@router.get("/admins/", response_model=List[AdminResponse])
+@router.get("/admins/", response_model=List[AdminResponse], dependencies=[Depends(get_current_admin)])
 def get_all_admins(db: Session = Depends(get_session)):
     # Retrieve all admins from the database
     admins = db.query(Admin).all()
     return admins
 
 
-@router.get("/admins/{admin_id}", response_model=AdminResponse)
+@router.get("/admins/{admin_id}", response_model=AdminResponse, dependencies=[Depends(require_admin)])
 def read_admin(admin_id: int, db: Session = Depends(get_session)):
     db_admin = db.query(Admin).filter(Admin.id == admin_id).first()
     if not db_admin:
@@ -71,7 +95,7 @@ def read_admin(admin_id: int, db: Session = Depends(get_session)):
 
 
 
-@router.delete("/admins/{admin_id}", response_model=AdminResponse)
+@router.delete("/admins/{admin_id}", response_model=AdminResponse, dependencies=[Depends(require_admin)])
 def delete_admin(admin_id: int, db: Session = Depends(get_session)):
     # Retrieve the admin from the database
     db_admin = db.query(Admin).filter(Admin.id == admin_id).first()
@@ -81,6 +105,19 @@ def delete_admin(admin_id: int, db: Session = Depends(get_session)):
     # Delete the admin from the database
     db.delete(db_admin)
     db.commit()
+    invalidate_account("admin", admin_id)
 
     # Return the deleted admin details as AdminResponse
-    return db_admin
\ No newline at end of file
+    return db_admin
+
+
+@router.get("/admins/{admin_id}/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile_worker(
+    admin_id: int,
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval: float = Query(PROFILE_SAMPLE_INTERVAL, ge=0.001, le=1),
+    include_idle: bool = False
+):
+    # Sample every thread of the worker serving this request, answered as collapsed stacks for a flame graph
+    stacks = await anyio.to_thread.run_sync(sampling_profiler.sample, seconds, interval, include_idle)
+    return PlainTextResponse(collapsed(stacks))
@@ -1,17 +1,33 @@
-from typing import List
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from pydantic import TypeAdapter
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import schemas
-from app.database import get_session
+from app.database import get_async_session
+from app.cache import get_product, invalidate_product
+from app.dialects import UPSERT_INSERTS
+from app.idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotentRequest
+from app.inventory import InsufficientStock, reserve_stock, stock_writes, trim_reservations
+from app.serialization import dump_response
 from app.schemas.cartitem_schema import CartItemResponse, CartItemCreate
 from app.schemas.sql_models import CartItem, Product, User
 from app.schemas import product_schema, cartitem_schema
 from app.schemas import user_schema
+from app.utils import get_current_user, require_user
 
 router = APIRouter(tags=["Cart"])
 
+# Upper bound on operations accepted by one cart batch
+CART_BATCH_MAX_OPERATIONS = 500
+
+# Serializers for the cart responses built with model_construct, see dump_response
+CART = TypeAdapter(cartitem_schema.CartResponse)
+CART_ITEM = TypeAdapter(cartitem_schema.CartItemResponse)
+CART_ITEMS = TypeAdapter(List[cartitem_schema.CartItemResponse])
+
 
 # @router.post("/users/{user_id}/cart/add", response_model=cartitem_schema.CartItemResponse)
 # def add_to_cart(user_id: int, cart_item: cartitem_schema.CartItemCreate, db: Session = Depends(get_session)):
@@ -75,184 +91,321 @@ router = APIRouter(tags=["Cart"])
 
 
 
-@router.post("/users/{user_id}/cart/add", response_model=cartitem_schema.CartItemResponse)
-def add_to_cart(user_id: int, cart_item: cartitem_schema.CartItemCreate, db: Session = Depends(get_session)):
+@router.post("/users/{user_id}/cart/add", response_model=cartitem_schema.CartItemResponse, dependencies=[Depends(require_user)])
+async def add_to_cart(
+    user_id: int,
+    cart_item: cartitem_schema.CartItemCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+    db: AsyncSession = Depends(get_async_session)
+):
+    # A retried request replays the stored response instead of adding the units again
+    idempotent = IdempotentRequest(idempotency_key, user_id, "add_to_cart", cart_item)
+    if replay := await idempotent.replay(db):
+        return replay
+
     # Check if the product exists
-    db_product = db.query(Product).get(cart_item.product_id)
+    db_product = await get_product(db, cart_item.product_id)
     if not db_product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
     # Retrieve user details
-    db_user = db.query(User).get(user_id)
+    db_user = await db.get(User, user_id)
     if not db_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    # Check if the product is already in the user's cart
-    existing_cart_item = (
-        db.query(CartItem)
-        .filter(CartItem.user_id == user_id)
-        .filter(CartItem.product_id == cart_item.product_id)
-        .first()
-    )
+    upsert_insert = UPSERT_INSERTS[db.get_bind().dialect.name]
+    async with stock_writes(db):
+        if replay := await idempotent.claim(db):
+            return replay
+
+        # Hold tracked stock for the added units, refreshing the expiry of the user's reservation
+        try:
+            reserved_ids = await reserve_stock(db, user_id, {cart_item.product_id: cart_item.quantity})
+        except InsufficientStock:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Insufficient stock")
 
-    if existing_cart_item:
-        # If the product is already in the cart, increment the quantity
-        existing_cart_item.quantity += cart_item.quantity
-        db.commit()
-        db.refresh(existing_cart_item)
-        new_cart_item = existing_cart_item
-    else:
-        # Otherwise, create a new cart item associated with the user
-        new_cart_item = CartItem(
+        # Insert the line or add to the quantity of the existing one in a single statement
+        statement = upsert_insert(CartItem).values(
             user_id=user_id,
             product_id=cart_item.product_id,
-            admin_id=db_product.admin_id,  # Set admin_id from the product's admin_id
             quantity=cart_item.quantity
         )
-        db.add(new_cart_item)
-        db.commit()
-        db.refresh(new_cart_item)
-
-    # Construct the product details for the newly added cart item
-    product_detail = db_product
-
-    # Construct the user details
-    user_details = user_schema.UserResponse(
-        id=db_user.id,
-        username=db_user.username,
-        email=db_user.email
-    )
-
-    # Construct the CartItemResponse with the user and product details
-    cart_item_response = cartitem_schema.CartItemResponse(
-        id=new_cart_item.id,
-        user_details=user_details,
-        product_id=new_cart_item.product_id,
-        product_details=product_detail,
-        quantity=new_cart_item.quantity
-    )
+        statement = statement.on_conflict_do_update(
+            index_elements=[CartItem.user_id, CartItem.product_id],
+            set_={"quantity": CartItem.quantity + statement.excluded.quantity}
+        ).returning(CartItem.id, CartItem.product_id, CartItem.quantity)
+        new_cart_item = (await db.execute(statement)).one()
+
+        # Construct the product details for the newly added cart item from the row as this
+        # transaction left it, stock decrement included, rather than from the product cache
+        product_detail = await db.get(Product, cart_item.product_id, populate_existing=True)
+        if not product_detail:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+
+        # Construct the user details
+        user_details = user_schema.UserResponse(
+            id=db_user.id,
+            username=db_user.username,
+            email=db_user.email
+        )
 
-    return cart_item_response
+        # Construct the CartItemResponse with the user and product details
+        cart_item_response = cartitem_schema.CartItemResponse(
+            id=new_cart_item.id,
+            user_details=user_details,
+            product_id=new_cart_item.product_id,
+            product_details=product_detail,
+            quantity=new_cart_item.quantity
+        )
 
+        await idempotent.save(db, status.HTTP_200_OK, cart_item_response)
+        await db.commit()
+    for product_id in reserved_ids:
+        invalidate_product(product_id)
 
+    return cart_item_response
 
-@router.get("/cart/items/", response_model=List[cartitem_schema.CartItemResponse])
-def get_cart_items(user_id: int, db: Session = Depends(get_session)):
-    # Retrieve cart items for the specified user including product details
-    cart_items = (
-        db.query(CartItem)
-        .filter(CartItem.user_id == user_id)
-        .all()
-    )
 
-    if not cart_items:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No cart items found for user {user_id}")
 
-    # Dictionary to aggregate cart items by product ID
-    product_dict = {}
-    for cart_item in cart_items:
-        if cart_item.product_id in product_dict:
-            # If product ID already exists in the dictionary, increment the quantity
-            product_dict[cart_item.product_id]["quantity"] += cart_item.quantity
-        else:
-            # If product ID is not in the dictionary, add a new entry
-            product_dict[cart_item.product_id] = {
-                "id": cart_item.id,
-                "product_id": cart_item.product_id,
-                "quantity": cart_item.quantity
-            }
-
-    # List to hold the final cart item responses
-    cart_item_responses = []
-    for product_id, item_info in product_dict.items():
-        # Retrieve the associated product details
-        db_product = db.query(Product).get(product_id)
+async def load_cart_rows(db: AsyncSession, user_id: int):
+    # Retrieve the cart lines joined with their products in one query
+    rows = (await db.exec(
+        select(CartItem, Product)
+        .join(Product, Product.id == CartItem.product_id, isouter=True)
+        .where(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+    )).all()
 
+    for cart_item, db_product in rows:
         if not db_product:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {product_id} not found")
-
-        # Retrieve user details (including the username) from the database
-        db_user = db.query(User).get(user_id)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {cart_item.product_id} not found")
+    return rows
 
-        if not db_user:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found")
 
-        # Construct the ProductResponse for the associated product
-        product_details = db_product
+def build_cart_response(rows, db_user: User, lite: bool):
+    user_details = user_schema.UserResponse.model_construct(id=db_user.id, username=db_user.username, email=db_user.email)
 
-        # Construct the UserResponse with the retrieved username
-        user_details = user_schema.UserResponse(
-            id=db_user.id,
-            username=db_user.username,
-            email=db_user.email
+    # Lite mode sends the user block once instead of on every line
+    if lite:
+        cart = cartitem_schema.CartResponse.model_construct(
+            user_details=user_details,
+            items=[
+                cartitem_schema.CartLineResponse.model_construct(
+                    id=cart_item.id,
+                    product_id=cart_item.product_id,
+                    product_details=db_product,
+                    quantity=cart_item.quantity
+                )
+                for cart_item, db_product in rows
+            ]
         )
+        return dump_response(CART, cart)
 
-        # Construct the CartItemResponse
-        cart_item_response = cartitem_schema.CartItemResponse(
-            id=item_info["id"],
+    items = [
+        cartitem_schema.CartItemResponse.model_construct(
+            id=cart_item.id,
             user_details=user_details,
-            product_id=item_info["product_id"],
-            product_details=product_details,
-            quantity=item_info["quantity"],
+            product_id=cart_item.product_id,
+            product_details=db_product,
+            quantity=cart_item.quantity
         )
-        cart_item_responses.append(cart_item_response)
+        for cart_item, db_product in rows
+    ]
+    return dump_response(CART_ITEMS, items)
+
+
+@router.get(
+    "/cart/items/",
+    response_model=Union[List[cartitem_schema.CartItemResponse], cartitem_schema.CartResponse],
+    dependencies=[Depends(require_user)]
+)
+async def get_cart_items(user_id: int, lite: bool = False, db: AsyncSession = Depends(get_async_session)):
+    rows = await load_cart_rows(db, user_id)
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No cart items found for user {user_id}")
+
+    # Retrieve user details once for the whole cart
+    db_user = await db.get(User, user_id)
+    if not db_user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found")
 
-    return cart_item_responses
+    return build_cart_response(rows, db_user, lite)
 
 
+def fold_cart_operations(operations: List[cartitem_schema.CartOperation]):
+    # Collapse the ordered operations into one final action per product:
+    # ("add", n) adds to whatever is in the cart, ("set", n) replaces it, ("remove", 0) deletes it
+    actions = {}
+    for operation in operations:
+        action, quantity = actions.get(operation.product_id, ("add", 0))
+        if operation.op == "add":
+            actions[operation.product_id] = ("add" if action == "add" else "set", quantity + operation.quantity)
+        elif operation.op == "set" and operation.quantity > 0:
+            actions[operation.product_id] = ("set", operation.quantity)
+        else:
+            actions[operation.product_id] = ("remove", 0)
+    return actions
+
+
+@router.post(
+    "/users/{user_id}/cart/batch",
+    response_model=Union[List[cartitem_schema.CartItemResponse], cartitem_schema.CartResponse],
+    dependencies=[Depends(require_user)]
+)
+async def batch_update_cart(
+    user_id: int,
+    operations: List[cartitem_schema.CartOperation],
+    lite: bool = False,
+    db: AsyncSession = Depends(get_async_session)
+):
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch takes at most {CART_BATCH_MAX_OPERATIONS} operations"
+        )
+    for operation in operations:
+        if operation.quantity < (1 if operation.op == "add" else 0):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid quantity {operation.quantity} for {operation.op} of product {operation.product_id}"
+            )
+
+    db_user = await db.get(User, user_id)
+    if not db_user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-@router.delete("/{user_id}/cart/{product_id}")
-def delete_cart_item(user_id: int, product_id: int, db: Session = Depends(get_session)):
+    # Validate every product that ends up in the cart with one query before writing anything
+    actions = fold_cart_operations(operations)
+    wanted_ids = {product_id for product_id, (action, _) in actions.items() if action != "remove"}
+    if wanted_ids:
+        found_ids = set((await db.exec(select(Product.id).where(Product.id.in_(wanted_ids)))).all())
+        missing_ids = sorted(wanted_ids - found_ids)
+        if missing_ids:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Products not found: {missing_ids}")
+
+    # Apply at most one statement per kind of action, all in one transaction
+    upsert_insert = UPSERT_INSERTS[db.get_bind().dialect.name]
+    async with stock_writes(db):
+        # Hold tracked stock for the units each line gains: all of an add, what a set goes above the cart
+        in_cart = dict((await db.execute(
+            select(CartItem.product_id, CartItem.quantity)
+            .where(CartItem.user_id == user_id, CartItem.product_id.in_(wanted_ids))
+        )).all())
+        try:
+            reserved_ids = await reserve_stock(db, user_id, {
+                product_id: quantity if action == "add" else quantity - in_cart.get(product_id, 0)
+                for product_id, (action, quantity) in actions.items() if action != "remove"
+            })
+        except InsufficientStock:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Insufficient stock")
+
+        for kind in ("add", "set"):
+            rows = [
+                {"user_id": user_id, "product_id": product_id, "quantity": quantity}
+                for product_id, (action, quantity) in actions.items() if action == kind
+            ]
+            if not rows:
+                continue
+            statement = upsert_insert(CartItem).values(rows)
+            quantity = CartItem.quantity + statement.excluded.quantity if kind == "add" else statement.excluded.quantity
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[CartItem.user_id, CartItem.product_id],
+                set_={"quantity": quantity}
+            ))
+
+        removed_ids = [product_id for product_id, (action, _) in actions.items() if action == "remove"]
+        if removed_ids:
+            await db.execute(delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id.in_(removed_ids)))
+
+        # Lines set lower or removed give back the stock held beyond their new quantity
+        released_ids = await trim_reservations(db, user_id, {
+            product_id: quantity for product_id, (action, quantity) in actions.items() if action != "add"
+        })
+
+        # Return the resulting cart, read inside the same transaction
+        rows = await load_cart_rows(db, user_id)
+        await db.commit()
+    for product_id in {*reserved_ids, *released_ids}:
+        invalidate_product(product_id)
+    return build_cart_response(rows, db_user, lite)
+
+
+
+@router.delete("/{user_id}/cart/{product_id}", dependencies=[Depends(require_user)])
+async def delete_cart_item(user_id: int, product_id: int, db: AsyncSession = Depends(get_async_session)):
     # Check if the user exists
-    user = db.query(schemas.sql_models.User).filter(schemas.sql_models.User.id == user_id).first()
+    user = await db.get(schemas.sql_models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Check if there are cart items with the specified product ID for the user
-    cart_items = db.query(schemas.sql_models.CartItem).filter(
+    cart_items = (await db.exec(select(schemas.sql_models.CartItem).where(
         schemas.sql_models.CartItem.user_id == user_id,
         schemas.sql_models.CartItem.product_id == product_id
-    ).all()
+    ))).all()
 
     if not cart_items:
         raise HTTPException(status_code=404, detail=f"No cart items found for user with product ID {product_id}")
 
-    # Delete all cart items with the specified product ID for the user
-    for cart_item in cart_items:
-        db.delete(cart_item)
-
-    db.commit()
+    # Delete all cart items with the specified product ID for the user, and release their stock hold
+    async with stock_writes(db):
+        for cart_item in cart_items:
+            await db.delete(cart_item)
+        released_ids = await trim_reservations(db, user_id, {product_id: 0})
+        await db.commit()
+    for released_id in released_ids:
+        invalidate_product(released_id)
 
     return {"message": f"All cart items with product ID {product_id} deleted successfully for user"}
 
 
 
 @router.put("/cart/items/{item_id}", response_model=schemas.cartitem_schema.CartItemResponse)
-def update_cart_item_quantity(cart_item_id: int, quantity: int, db: Session = Depends(get_session)):
-    # Retrieve the cart item by its ID
-    cart_item = db.query(schemas.sql_models.CartItem).get(cart_item_id)
-    if not cart_item:
+async def update_cart_item_quantity(
+    cart_item_id: int,
+    quantity: int = Query(gt=0),
+    current_user: user_schema.UserResponse = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_session)
+):
+    # Retrieve the cart item by its ID; other users' items are reported as missing
+    cart_item = await db.get(schemas.sql_models.CartItem, cart_item_id)
+    if not cart_item or cart_item.user_id != current_user.id:
         raise HTTPException(status_code=404, detail=f"Cart item with ID {cart_item_id} not found")
 
-    # Update the quantity of the cart item
-    cart_item.quantity = quantity
-    db.commit()
-    db.refresh(cart_item)
-
-    # Retrieve associated product and user details
-    db_product = db.query(schemas.sql_models.Product).get(cart_item.product_id)
+    # Update the quantity of the cart item; a higher quantity holds stock for the extra units,
+    # a lower one releases the stock held beyond it
+    async with stock_writes(db):
+        await db.refresh(cart_item)
+        try:
+            reserved_ids = await reserve_stock(db, cart_item.user_id, {cart_item.product_id: quantity - cart_item.quantity})
+        except InsufficientStock:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Insufficient stock")
+        cart_item.quantity = quantity
+        released_ids = await trim_reservations(db, cart_item.user_id, {cart_item.product_id: quantity})
+        await db.commit()
+    for product_id in {*reserved_ids, *released_ids}:
+        invalidate_product(product_id)
+    await db.refresh(cart_item)
+
+    # Retrieve associated product and user details; the product from the database rather than
+    # the product cache, so it shows the stock this update left
+    db_product = await db.get(schemas.sql_models.Product, cart_item.product_id)
     if not db_product:
         raise HTTPException(status_code=404, detail=f"Product with ID {cart_item.product_id} not found")
 
-    db_user = db.query(schemas.sql_models.User).get(cart_item.user_id)
+    db_user = await db.get(schemas.sql_models.User, cart_item.user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail=f"User with ID {cart_item.user_id} not found")
 
     # Construct the CartItemResponse with updated details
-    product_details = schemas.sql_models.Product.from_orm(db_product)
-    user_details = schemas.user_schema.UserResponse(id=db_user.id, username=db_user.username, email=db_user.email)
+    product_details = db_product
+    user_details = schemas.user_schema.UserResponse.model_construct(id=db_user.id, username=db_user.username, email=db_user.email)
 
-    cart_item_response = schemas.cartitem_schema.CartItemResponse(
+    cart_item_response = schemas.cartitem_schema.CartItemResponse.model_construct(
         id=cart_item.id,
         user_details=user_details,
         product_id=cart_item.product_id,
@@ -260,7 +413,7 @@ def update_cart_item_quantity(cart_item_id: int, quantity: int, db: Session = De
         quantity=cart_item.quantity
     )
 
-    return cart_item_response
+    return dump_response(CART_ITEM, cart_item_response)
 
 
 
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.metrics import registry
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    # Prometheus text exposition format; keep this endpoint off the public network
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
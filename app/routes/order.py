@@ -1,134 +1,215 @@
-from typing import List
+from collections import defaultdict
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import joinedload
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from pydantic import TypeAdapter
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import joinedload, selectinload
 from sqlmodel import Session, select
-from app.database import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_session, get_read_session, get_async_session
+from app.analytics import sales_rollup_statements
+from app.cache import invalidate_product
+from app.idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotentRequest
+from app.inventory import InsufficientStock, check_adjusted, reservation_deltas, stock_adjustment, stock_writes
+from app.serialization import dump_response
 from app.schemas import order_schema, product_schema, user_schema
 from datetime import datetime
 from pytz import timezone
-from app.utils import get_current_user
+from app.utils import get_current_user, require_admin, require_user
 from app import schemas
 from app.schemas.cartitem_schema import CartItemResponse, CartBase
-from app.schemas.sql_models import Order, User, CartItem, Product, Admin
+from app.schemas.sql_models import OrderHeader, OrderLine, User, CartItem, Product, Admin, StockReservation
 from app.schemas.order_schema import OrderCreate, OrderResponse, PlaceOrderRequest, OrderUpdate
 from app.schemas.user_schema import UserResponse
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
 
+# Indian Standard Time (IST) timezone used for order dates in responses
+IST = timezone('Asia/Kolkata')
 
+# Page size limits for the order listings
+ORDERS_DEFAULT_LIMIT = 100
+ORDERS_MAX_LIMIT = 1000
+
+# Serializers for the order listings, see dump_response
+USER_ORDERS = TypeAdapter(List[order_schema.OrderResponse])
+ADMIN_ORDERS = TypeAdapter(List[order_schema.OrderEachResponse])
+
+
+
+@router.post("/place", response_model=order_schema.OrderResponse, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(require_user)])
+async def place_order(
+    user_id: int,
+    idempotency_key: Optional[str] = Header(None, max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+    db: AsyncSession = Depends(get_async_session)
+):
+    # A retried request replays the stored order instead of placing another one
+    idempotent = IdempotentRequest(idempotency_key, user_id, "place_order", {"user_id": user_id})
+    if replay := await idempotent.replay(db):
+        return replay
 
-@router.post("/place", response_model=List[order_schema.OrderResponse], status_code=status.HTTP_201_CREATED)
-def place_order(user_id: int, db: Session = Depends(get_session)):
     # Retrieve cart items for the specified user_id
-    cart_items = db.query(CartItem).filter(CartItem.user_id == user_id).all()
+    cart_items = (await db.exec(select(CartItem).where(CartItem.user_id == user_id))).all()
 
     if not cart_items:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No cart items found for user ID {user_id}")
 
-    # List to hold order details
-    order_details = []
-    total_order_amount = 0.0
-
-    for cart_item in cart_items:
-        # Retrieve product details
-        product = db.query(Product).get(cart_item.product_id)
-        if not product:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {cart_item.product_id} not found")
-
-        # Calculate total amount for the current cart item
-        item_total_amount = product.price * cart_item.quantity
-        total_order_amount += item_total_amount
-
-        # Create Order record
-        order = Order(
-            user_id=user_id,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            total_amount=item_total_amount,
-            order_date=datetime.now()
+    # Lines written before quantities were validated must not turn into negative orders that restock
+    invalid_ids = sorted(cart_item.product_id for cart_item in cart_items if cart_item.quantity <= 0)
+    if invalid_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cart quantities for products {invalid_ids}")
+
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found")
+
+    # Look up every product in the cart with a single IN query
+    product_ids = {cart_item.product_id for cart_item in cart_items}
+    products = {product.id: product for product in await db.exec(select(Product).where(Product.id.in_(product_ids)))}
+    missing_ids = product_ids - products.keys()
+    if missing_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with id {min(missing_ids)} not found")
+
+    async with stock_writes(db):
+        if replay := await idempotent.claim(db):
+            return replay
+
+        # Take the user's stock holds and settle the difference with the cart in one conditional
+        # update; a shortfall on any tracked product rejects the whole order
+        reserved = defaultdict(int)
+        for product_id, quantity in await db.execute(
+            delete(StockReservation)
+            .where(StockReservation.user_id == user_id)
+            .returning(StockReservation.product_id, StockReservation.quantity)
+        ):
+            reserved[product_id] += quantity
+        quantities = defaultdict(int)
+        for cart_item in cart_items:
+            quantities[cart_item.product_id] += cart_item.quantity
+        deltas = reservation_deltas(products, quantities, reserved)
+        if deltas:
+            try:
+                check_adjusted(await db.execute(stock_adjustment(deltas)), deltas)
+            except InsufficientStock:
+                await db.rollback()
+                short_ids = [product_id for product_id, delta in deltas.items() if delta > 0]
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Insufficient stock for products {short_ids}")
+
+        # Snapshot the current prices on the order lines and precompute the header totals
+        line_rows = [
+            {
+                "product_id": cart_item.product_id,
+                "quantity": cart_item.quantity,
+                "unit_price": products[cart_item.product_id].price,
+                "line_total": products[cart_item.product_id].price * cart_item.quantity,
+            }
+            for cart_item in cart_items
+        ]
+        order_date = datetime.now()
+        order_id = await db.scalar(
+            insert(OrderHeader)
+            .values(
+                user_id=user_id,
+                order_date=order_date,
+                total_quantity=sum(row["quantity"] for row in line_rows),
+                total_amount=sum(row["line_total"] for row in line_rows)
+            )
+            .returning(OrderHeader.id)
         )
-        db.add(order)
-        db.commit()
-        db.refresh(order)
-
-        # Prepare OrderResponse
-        user = db.query(User).get(user_id)
-        if not user:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found")
 
-        user_details = user_schema.UserResponse(
-            id=user.id,
-            username=user.username,
-            email=user.email
-        )
+        # Insert all order lines with a single executemany and clear the cart in the same transaction
+        await db.execute(insert(OrderLine), [{"order_id": order_id, **row} for row in line_rows])
+        await db.execute(delete(CartItem).where(CartItem.user_id == user_id))
 
-        product_details = product_schema.ProductResponse(
-            id=product.id,
-            name=product.name,
-            description=product.description,
-            price=product.price,
-            image_path=product.image_path,
-            admin_id=product.admin_id
-        )
+        # Add the order to the daily sales rollup
+        admin_ids = {product.id: product.admin_id for product in products.values()}
+        for statement in sales_rollup_statements(db.get_bind().dialect.name, order_date, line_rows, admin_ids):
+            await db.execute(statement)
 
         order_response = order_schema.OrderResponse(
-            id=order.id,
-            user_details=user_details,
-            products=[product_details],
-            quantity=[cart_item.quantity],
-            total_amount=item_total_amount,
-            order_date=order.order_date
+            id=order_id,
+            user_details=user_schema.UserResponse(id=user.id, username=user.username, email=user.email),
+            lines=[
+                order_schema.OrderLineResponse(product_details=products[row["product_id"]], **row)
+                for row in line_rows
+            ],
+            total_quantity=sum(row["quantity"] for row in line_rows),
+            total_amount=sum(row["line_total"] for row in line_rows),
+            order_date=order_date
         )
 
-        order_details.append(order_response)
+        await idempotent.save(db, status.HTTP_201_CREATED, order_response)
+        await db.commit()
+    for product_id in deltas:
+        invalidate_product(product_id)
 
-    # Clear the cart after placing the order
-    db.query(CartItem).filter(CartItem.user_id == user_id).delete()
-    db.commit()
+    return order_response
 
-    return order_details
 
+def to_ist(order_date: datetime):
+    # Convert order_date to Indian Standard Time (IST) and make it naive
+    return order_date.astimezone(IST).replace(tzinfo=None)
 
-@router.get("/{user_id}", response_model=List[order_schema.OrderEachResponse], status_code=200)
-def get_user_orders(user_id: int, db: Session = Depends(get_session)):
+
+def apply_date_range(query, start_date: Optional[datetime], end_date: Optional[datetime]):
+    if start_date:
+        query = query.filter(OrderHeader.order_date >= start_date)
+    if end_date:
+        query = query.filter(OrderHeader.order_date < end_date)
+    return query
+
+
+@router.get("/{user_id}", response_model=List[order_schema.OrderResponse], status_code=200,
+            dependencies=[Depends(require_user)])
+def get_user_orders(
+    user_id: int,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(ORDERS_DEFAULT_LIMIT, ge=1, le=ORDERS_MAX_LIMIT),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: Session = Depends(get_read_session)
+):
     try:
-        # Retrieve all orders for the specified user within no_autoflush block
-        with db.no_autoflush:
-            orders = db.query(Order).filter(Order.user_id == user_id).all()
-
-            if not orders:
-                raise HTTPException(status_code=404, detail=f"No orders found for user ID {user_id}")
-
-            # Prepare response
-            order_responses = []
-            for order in orders:
-                user = db.query(User).get(order.user_id)
-                if not user:
-                    raise HTTPException(status_code=404, detail=f"User with ID {order.user_id} not found")
-
-                user_details = order_schema.UserResponse(id=user.id, username=user.username, email=user.email)
-                product = db.query(Product).get(order.product_id)
-                if not product:
-                    raise HTTPException(status_code=404, detail=f"Product with ID {order.product_id} not found")
-
-                # Get Indian Standard Time (IST) timezone
-                ist = timezone('Asia/Kolkata')
-
-                # Convert order_date to Indian Standard Time (IST) and make it naive
-                order_date_ist = order.order_date.astimezone(ist).replace(tzinfo=None)
-
-                order_response = order_schema.OrderEachResponse(
-                    id=order.id,
-                    user_details=user_details,
-                    products=order_schema.Product.from_orm(product),
-                    quantity=order.quantity,
-                    total_amount=order.total_amount,
-                    order_date=order_date_ist  # Include order_date in IST without timezone info
-                )
-                order_responses.append(order_response)
-
-        return order_responses
+        # Range scan the user's order headers, then load all their lines and products in one more query
+        query = (
+            db.query(OrderHeader, User)
+            .join(User, User.id == OrderHeader.user_id)
+            .options(selectinload(OrderHeader.lines).joinedload(OrderLine.product))
+            .filter(OrderHeader.user_id == user_id, OrderHeader.id > after_id)
+        )
+        rows = apply_date_range(query, start_date, end_date).order_by(OrderHeader.id).limit(limit).all()
+
+        if not rows:
+            raise HTTPException(status_code=404, detail=f"No orders found for user ID {user_id}")
+
+        headers = {"X-Next-Cursor": str(rows[-1][0].id)} if len(rows) == limit else None
+
+        user_details = order_schema.UserResponse.model_construct(
+            id=rows[0][1].id, username=rows[0][1].username, email=rows[0][1].email
+        )
+        orders = [
+            order_schema.OrderResponse.model_construct(
+                id=order.id,
+                user_details=user_details,
+                lines=[
+                    order_schema.OrderLineResponse.model_construct(
+                        product_id=line.product_id,
+                        product_details=line.product,
+                        quantity=line.quantity,
+                        unit_price=line.unit_price,
+                        line_total=line.line_total
+                    )
+                    for line in order.lines
+                ],
+                total_quantity=order.total_quantity,
+                total_amount=order.total_amount,
+                order_date=to_ist(order.order_date)  # Include order_date in IST without timezone info
+            )
+            for order, user in rows
+        ]
+        return dump_response(USER_ORDERS, orders, headers=headers)
 
     except HTTPException as e:
         raise e
@@ -138,48 +219,46 @@ def get_user_orders(user_id: int, db: Session = Depends(get_session)):
 
 
 
-@router.get("/admin/{admin_id}/orders", response_model=List[order_schema.OrderEachResponse], status_code=200)
-def get_admin_orders(admin_id: int, db: Session = Depends(get_session)):
+@router.get("/admin/{admin_id}/orders", response_model=List[order_schema.OrderEachResponse], status_code=200,
+            dependencies=[Depends(require_admin)])
+def get_admin_orders(
+    admin_id: int,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(ORDERS_DEFAULT_LIMIT, ge=1, le=ORDERS_MAX_LIMIT),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: Session = Depends(get_read_session)
+):
     try:
-        with db.no_autoflush:
-            # Retrieve all orders for the specified admin_id by joining with Product table
-            orders = db.query(Order).join(Product, Product.id == Order.product_id).filter(Product.admin_id == admin_id).all()
-
-            if not orders:
-                raise HTTPException(status_code=404, detail=f"No orders found for admin ID {admin_id}")
-
-            order_responses = []
-            for order in orders:
-                # Retrieve user details for the order
-                user = db.query(User).get(order.user_id)
-                if not user:
-                    raise HTTPException(status_code=404, detail=f"User with ID {order.user_id} not found")
-
-                user_details = order_schema.UserResponse(id=user.id, username=user.username, email=user.email)
-
-                # Retrieve product details for the order
-                product = db.query(Product).get(order.product_id)
-                if not product:
-                    raise HTTPException(status_code=404, detail=f"Product with ID {order.product_id} not found")
-
-                # Get Indian Standard Time (IST) timezone
-                ist = timezone('Asia/Kolkata')
-
-                # Convert order_date to Indian Standard Time (IST) and make it naive
-                order_date_ist = order.order_date.astimezone(ist).replace(tzinfo=None)
-
-                # Construct order response
-                order_response = order_schema.OrderEachResponse(
-                    id=order.id,
-                    user_details=user_details,
-                    products=order_schema.Product.from_orm(product),
-                    quantity=order.quantity,
-                    total_amount=order.total_amount,
-                    order_date=order_date_ist
-                )
-                order_responses.append(order_response)
-
-            return order_responses
+        # Fetch the order lines for the admin's products with their order, user and product in one joined query
+        query = (
+            db.query(OrderLine, OrderHeader, User, Product)
+            .join(OrderHeader, OrderHeader.id == OrderLine.order_id)
+            .join(User, User.id == OrderHeader.user_id)
+            .join(Product, Product.id == OrderLine.product_id)
+            .filter(Product.admin_id == admin_id, OrderLine.id > after_id)
+        )
+        rows = apply_date_range(query, start_date, end_date).order_by(OrderLine.id).limit(limit).all()
+
+        if not rows:
+            raise HTTPException(status_code=404, detail=f"No orders found for admin ID {admin_id}")
+
+        headers = {"X-Next-Cursor": str(rows[-1][0].id)} if len(rows) == limit else None
+
+        orders = [
+            order_schema.OrderEachResponse.model_construct(
+                id=order.id,
+                line_id=line.id,
+                user_details=order_schema.UserResponse.model_construct(id=user.id, username=user.username, email=user.email),
+                products=product,
+                quantity=line.quantity,
+                unit_price=line.unit_price,
+                total_amount=line.line_total,
+                order_date=to_ist(order.order_date)
+            )
+            for line, order, user, product in rows
+        ]
+        return dump_response(ADMIN_ORDERS, orders, headers=headers)
 
     except HTTPException as e:
         raise e
@@ -190,42 +269,59 @@ def get_admin_orders(admin_id: int, db: Session = Depends(get_session)):
 
 
 @router.delete("/{order_id}", response_model=dict)
-def delete_order(order_id: int, db: Session = Depends(get_session)):
+def delete_order(order_id: int, current_user: UserResponse = Depends(get_current_user), db: Session = Depends(get_session)):
     try:
         # Retrieve the order by its ID
-        db_order = db.query(Order).filter(Order.id == order_id).first()
-        if not db_order:
+        db_order = (
+            db.query(OrderHeader)
+            .options(selectinload(OrderHeader.lines).joinedload(OrderLine.product))
+            .filter(OrderHeader.id == order_id)
+            .first()
+        )
+        if not db_order or db_order.user_id != current_user.id:
             raise HTTPException(status_code=404, detail=f"Order with ID {order_id} not found")
 
-        # Get Indian Standard Time (IST) timezone
-        ist = timezone('Asia/Kolkata')
-
-        # Convert order_date to Indian Standard Time (IST) and make it naive
-        order_date_ist = db_order.order_date.astimezone(ist).replace(tzinfo=None)
-
-        # Get the ID of the order being deleted
-        deleted_order_id = db_order.id
-
-        # Delete the order from the database
-        db.delete(db_order)
-        db.commit()
-
-        # Return a dictionary with the details of the deleted order
-        return {
-            "id": deleted_order_id,
+        # Capture the order details before they are expired by the commit
+        deleted_order = {
+            "id": db_order.id,
             "user_id": db_order.user_id,
-            "product_id": db_order.product_id,
-            "quantity": db_order.quantity,
+            "product_ids": [line.product_id for line in db_order.lines],
+            "quantity": [line.quantity for line in db_order.lines],
             "total_amount": db_order.total_amount,
-            "order_date": order_date_ist,
-            "message": f"Order {deleted_order_id} deleted successfully"
+            "order_date": to_ist(db_order.order_date),
+            "message": f"Order {db_order.id} deleted successfully"
         }
 
+        # Remove the order from the daily sales rollup (lines of since deleted products have no rollup)
+        rollup_lines = [
+            {"product_id": line.product_id, "quantity": line.quantity, "line_total": line.line_total}
+            for line in db_order.lines if line.product
+        ]
+        if rollup_lines:
+            admin_ids = {line.product_id: line.product.admin_id for line in db_order.lines if line.product}
+            dialect_name = db.get_bind().dialect.name
+            for statement in sales_rollup_statements(dialect_name, db_order.order_date, rollup_lines, admin_ids, sign=-1):
+                db.execute(statement)
+
+        # Return tracked stock
+        restock = defaultdict(int)
+        for line in db_order.lines:
+            if line.product and line.product.stock is not None:
+                restock[line.product_id] -= line.quantity
+        if restock:
+            db.execute(stock_adjustment(dict(restock)))
+
+        # Delete the order lines and the order header from the database
+        db.query(OrderLine).filter(OrderLine.order_id == order_id).delete()
+        db.query(OrderHeader).filter(OrderHeader.id == order_id).delete()
+        db.commit()
+        for product_id in restock:
+            invalidate_product(product_id)
+
+        return deleted_order
+
     except HTTPException as e:
         raise e
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-
-
-
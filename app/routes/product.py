@@ -1,33 +1,57 @@
-import os
-from typing import List
-
-from fastapi import APIRouter, HTTPException, Form, File, Depends, UploadFile
-from sqlalchemy import func, extract
+import re
+from datetime import date
+from typing import List, Optional
+
+import orjson
+from fastapi import APIRouter, HTTPException, Form, File, Depends, UploadFile, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import func, text
 from sqlmodel import Session, select
 
 from app import schemas
-from app.schemas.sql_models import Product, Order
+from app.schemas.sql_models import Product, ProductSalesMonthly
+from app.schemas.admin_schema import AdminResponse
 from app.schemas.product_schema import ProductSalesData
-from app.database import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import get_session, get_read_session, get_async_session, read_engine
+from app.cache import cached_catalog_response, invalidate_product
+from app.images import enqueue_image_job, image_worker
+from app.serialization import dump_response
+from app.uploads import remove_unreferenced_image, save_upload
+from app.utils import get_current_admin, require_admin
 
 router = APIRouter(tags=["Products"])
 
-@router.post("/admins/{admin_id}/products/", response_model=schemas.sql_models.Product, status_code=201)
+# Page size limits and stream batch size for the catalog listing
+ALLPRODUCTS_DEFAULT_LIMIT = 100
+ALLPRODUCTS_MAX_LIMIT = 1000
+ALLPRODUCTS_STREAM_BATCH = 500
+PRODUCT_COLUMNS = {column.name: column for column in Product.__table__.columns}
+
+# Page size limits and BM25 name weight for product search
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_NAME_WEIGHT = 10.0
+
+# Serializer for the product lists read straight from the database
+PRODUCT_LIST = TypeAdapter(List[Product])
+
+@router.post("/admins/{admin_id}/products/", response_model=schemas.sql_models.Product, status_code=201,
+             dependencies=[Depends(require_admin)])
 def create_product(
     admin_id: int,
     name: str,
     description: str,
     price: float,
     image_file: UploadFile = File(...),
+    stock: Optional[int] = Query(None, ge=0),
     db: Session = Depends(get_session)
 ):
     try:
-        # Save uploaded image to a directory within the project
-        upload_folder = "./static/uploads"
-        os.makedirs(upload_folder, exist_ok=True)
-        image_path = os.path.join(upload_folder, image_file.filename)
-        with open(image_path, "wb") as image:
-            image.write(image_file.file.read())
+        # Stream the uploaded image into the content addressed upload directory
+        image_path = save_upload(image_file)
 
         # Create new product instance with provided data including admin_id
         db_product = schemas.sql_models.Product(
@@ -35,54 +59,168 @@ def create_product(
             description=description,
             price=price,
             image_path=image_path,
+            stock=stock,
             admin_id=admin_id
         )
 
-        # Add product to database
+        # Add product to database along with the job that builds its thumbnails
         db.add(db_product)
+        db.flush()
+        enqueue_image_job(db, db_product)
         db.commit()
         db.refresh(db_product)
+        invalidate_product(db_product.id)
+        image_worker.wake()
 
         # Return the product with image_path included in the response
         return db_product
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def parse_product_fields(fields: Optional[str]):
+    # Resolve a comma separated ?fields= value into product columns, always keeping the id cursor
+    if not fields:
+        return list(PRODUCT_COLUMNS.values())
+
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PRODUCT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown product fields: {', '.join(unknown)}")
+
+    if "id" not in names:
+        names.insert(0, "id")
+    return [PRODUCT_COLUMNS[name] for name in dict.fromkeys(names)]
+
+
+def product_row(product: Product) -> dict:
+    # Table column order, whatever order the ORM loaded the attributes in, so equal products encode to
+    # equal bytes and equal ETags
+    return {name: getattr(product, name) for name in PRODUCT_COLUMNS}
+
+
+def stream_products(columns, after_id: int, limit: Optional[int]):
+    # Use a dedicated session so the cursor outlives the request dependency
+    with Session(read_engine) as session:
+        statement = (
+            select(*columns)
+            .where(Product.id > after_id)
+            .order_by(Product.id)
+            .execution_options(stream_results=True, yield_per=ALLPRODUCTS_STREAM_BATCH)
+        )
+        if limit is not None:
+            statement = statement.limit(limit)
+
+        # One chunk per batch: StreamingResponse hops to the threadpool for every item a sync generator yields
+        for rows in session.execute(statement).partitions():
+            yield b"".join(orjson.dumps(dict(row._mapping)) + b"\n" for row in rows)
+
+
+def build_search_query(q: str):
+    # Quote every term and match it as a prefix, so user input is never parsed as FTS5 syntax
+    terms = re.findall(r"\w+", q)
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+@router.get("/products/search", response_model=list[schemas.sql_models.Product])
+async def search_products(
+    q: str = Query(..., min_length=1),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_session)
+):
+    match = build_search_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="Search query has no searchable terms")
+
+    # Rank the FTS5 matches with BM25, weighting the name above the description
+    sql = (
+        "SELECT product.* FROM product_fts JOIN product ON product.id = product_fts.rowid "
+        "WHERE product_fts MATCH :match"
+    )
+    params = {"match": match, "limit": limit, "offset": offset}
+    if min_price is not None:
+        sql += " AND product.price >= :min_price"
+        params["min_price"] = min_price
+    if max_price is not None:
+        sql += " AND product.price <= :max_price"
+        params["max_price"] = max_price
+    sql += f" ORDER BY bm25(product_fts, {SEARCH_NAME_WEIGHT}, 1.0) LIMIT :limit OFFSET :offset"
+
+    statement = select(Product).from_statement(text(sql).bindparams(**params))
+    return dump_response(PRODUCT_LIST, (await db.execute(statement)).scalars().all())
+
+
 @router.get("/allproducts", response_model=list[schemas.sql_models.Product])
-def get_all_products(db: Session = Depends(get_session)):
-    db_product = db.query(schemas.sql_models.Product).all()
-    return db_product
+async def get_all_products(
+    request: Request,
+    after_id: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=ALLPRODUCTS_MAX_LIMIT),
+    fields: Optional[str] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_session)
+):
+    columns = parse_product_fields(fields)
+
+    # Stream the catalog as NDJSON straight from the cursor, one batch of rows at a time
+    if stream:
+        return StreamingResponse(stream_products(columns, after_id, limit), media_type="application/x-ndjson")
+
+    page_size = limit or ALLPRODUCTS_DEFAULT_LIMIT
+
+    async def render():
+        # Keyset pagination on Product.id, so every page is an index range scan
+        statement = select(*columns).where(Product.id > after_id).order_by(Product.id).limit(page_size)
+        products = [dict(row._mapping) for row in await db.execute(statement)]
+
+        headers = {}
+        if len(products) == page_size:
+            headers["X-Next-Cursor"] = str(products[-1]["id"])
+        return orjson.dumps(products), headers
+
+    key = ("allproducts", after_id, page_size, tuple(column.name for column in columns))
+    return await cached_catalog_response(request, db, key, render)
 
 @router.get("/{product_id}", response_model=schemas.sql_models.Product)
-def read_product(product_id: int, db: Session = Depends(get_session)):
-    db_product = db.query(schemas.sql_models.Product).filter(schemas.sql_models.Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return db_product  # This will automatically serialize to schemas.Product
+async def read_product(product_id: int, request: Request, db: AsyncSession = Depends(get_async_session)):
+    async def render():
+        # Straight from the database: a worker's product cache may predate a write made on another worker
+        db_product = await db.get(Product, product_id)
+        if not db_product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return orjson.dumps(product_row(db_product)), {}
+
+    return await cached_catalog_response(request, db, ("product", product_id), render)
 
 
 @router.get("/admins/{admin_id}/products/", response_model=list[schemas.sql_models.Product])
-def get_products_by_seller(admin_id: int, db: Session = Depends(get_session)):
-    try:
+async def get_products_by_seller(admin_id: int, request: Request, db: AsyncSession = Depends(get_async_session)):
+    async def render():
         # Query the database to retrieve all products associated with the specified admin_id
         db_products = (
-            db.query(schemas.sql_models.Product)
-            .filter(schemas.sql_models.Product.admin_id == admin_id)
-            .all()
-        )
+            await db.exec(select(schemas.sql_models.Product).where(schemas.sql_models.Product.admin_id == admin_id))
+        ).all()
 
         if not db_products:
             raise HTTPException(status_code=404, detail="Products not found for this seller")
+        return orjson.dumps([product_row(db_product) for db_product in db_products]), {}
 
-        return db_products
+    try:
+        return await cached_catalog_response(request, db, ("seller", admin_id), render)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/products/{product_id}/admin/{admin_id}", response_model=schemas.sql_models.Product)
+@router.delete("/products/{product_id}/admin/{admin_id}", response_model=schemas.sql_models.Product,
+               dependencies=[Depends(require_admin)])
 def delete_product(product_id: int, admin_id: int, db: Session = Depends(get_session)):
     db_product = db.query(schemas.sql_models.Product).filter(
         schemas.sql_models.Product.id == product_id,
@@ -91,16 +229,17 @@ def delete_product(product_id: int, admin_id: int, db: Session = Depends(get_ses
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Create a copy of the product before deletion for response
-    deleted_product = schemas.sql_models.Product.from_orm(db_product)
-
-    # Delete the image file from the filesystem if it exists
-    if db_product.image_path and os.path.exists(db_product.image_path):
-        os.remove(db_product.image_path)
+    # Copy the column values before deletion for the response (from_orm also copied the
+    # admin relationship, and the autoflush of that copy failed on admin_id)
+    deleted_product = schemas.sql_models.Product.model_validate(db_product.model_dump())
 
     # Delete the product from the database
     db.delete(db_product)
     db.commit()
+    invalidate_product(product_id)
+
+    # Delete the image file once no other product uses it
+    remove_unreferenced_image(db, deleted_product.image_path)
 
     return deleted_product
 
@@ -113,10 +252,15 @@ def update_product(
     description: str = Form(None),
     price: float = Form(None),
     image_file: UploadFile = File(None),
+    stock: Optional[int] = Form(None, ge=0),
+    current_admin: AdminResponse = Depends(get_current_admin),
     db: Session = Depends(get_session)
 ):
-    # Check if the product with the specified ID exists in the database
-    db_product = db.query(schemas.sql_models.Product).filter(schemas.sql_models.Product.id == product_id).first()
+    # Check if the product with the specified ID exists in the database and belongs to the admin
+    db_product = db.query(schemas.sql_models.Product).filter(
+        schemas.sql_models.Product.id == product_id,
+        schemas.sql_models.Product.admin_id == current_admin.id
+    ).first()
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -127,19 +271,25 @@ def update_product(
         db_product.description = description
     if price is not None:
         db_product.price = price
+    if stock is not None:
+        db_product.stock = stock
 
     # Handle image file update if provided
+    previous_image_path = db_product.image_path
     if image_file:
-        upload_folder = "./static/uploads"
-        os.makedirs(upload_folder, exist_ok=True)
-        image_path = os.path.join(upload_folder, image_file.filename)
-        with open(image_path, "wb") as image:
-            image.write(image_file.file.read())
-        db_product.image_path = image_path
+        db_product.image_path = save_upload(image_file)
+        if db_product.image_path != previous_image_path:
+            enqueue_image_job(db, db_product)
 
     # Commit the changes to the database
     db.commit()
     db.refresh(db_product)
+    invalidate_product(product_id)
+    image_worker.wake()
+
+    # Delete the replaced image file once no other product uses it
+    if db_product.image_path != previous_image_path:
+        remove_unreferenced_image(db, previous_image_path)
 
     # Return the updated product
     return db_product
@@ -149,14 +299,21 @@ def update_product(
 # route for analysis
 
 
-@router.get("/admins/{admin_id}/product-sales", response_model=List[ProductSalesData])
-def get_product_sales_data(admin_id: int, db: Session = Depends(get_session)):
+@router.get("/admins/{admin_id}/product-sales", response_model=List[ProductSalesData], dependencies=[Depends(require_admin)])
+def get_product_sales_data(admin_id: int, db: Session = Depends(get_read_session)):
     try:
+        # Total the monthly rollup per product first so the name lookup runs once per product
+        product_totals = (
+            select(ProductSalesMonthly.product_id, func.sum(ProductSalesMonthly.quantity).label("quantity"))
+            .where(ProductSalesMonthly.admin_id == admin_id)
+            .group_by(ProductSalesMonthly.product_id)
+            .subquery()
+        )
         statement = (
-            select(Product.name, func.sum(Order.quantity).label("total_quantity"))
-            .join(Order, Product.id == Order.product_id)
-            .where(Product.admin_id == admin_id)
+            select(Product.name, func.sum(product_totals.c.quantity).label("total_quantity"))
+            .join(product_totals, Product.id == product_totals.c.product_id)
             .group_by(Product.name)
+            .having(func.sum(product_totals.c.quantity) > 0)
         )
         results = db.exec(statement).all()
 
@@ -165,6 +322,8 @@ def get_product_sales_data(admin_id: int, db: Session = Depends(get_session)):
 
         return [ProductSalesData(name=name, total_quantity=total_quantity) for name, total_quantity in results]
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -204,18 +363,18 @@ def get_product_sales_data(admin_id: int, db: Session = Depends(get_session)):
 
 
 
-@router.get("/admins/{admin_id}/products/{year}/monthly-orders", response_model=dict)
-def get_monthly_orders(admin_id: int, year: int, db: Session = Depends(get_session)):
+@router.get("/admins/{admin_id}/products/{year}/monthly-orders", response_model=dict, dependencies=[Depends(require_admin)])
+def get_monthly_orders(admin_id: int, year: int, db: Session = Depends(get_read_session)):
     try:
+        # Range scan the admin's monthly rollup rows for the year instead of extracting the year per order
         monthly_orders = (
-            db.query(
-                Product.id.label("product_id"),
-                func.strftime("%m", Order.order_date).label("month"),
-                func.count(Order.id).label("order_count")
+            db.query(ProductSalesMonthly.product_id, ProductSalesMonthly.sales_month, ProductSalesMonthly.order_count)
+            .filter(
+                ProductSalesMonthly.admin_id == admin_id,
+                ProductSalesMonthly.sales_month >= date(year, 1, 1),
+                ProductSalesMonthly.sales_month < date(year + 1, 1, 1),
+                ProductSalesMonthly.order_count > 0
             )
-            .join(Order.product)
-            .filter(extract('year', Order.order_date) == year)
-            .group_by(Product.id, "month")
             .all()
         )
 
@@ -225,17 +384,25 @@ def get_monthly_orders(admin_id: int, year: int, db: Session = Depends(get_sessi
         # Organize the results by month
         orders_by_month = {month: {} for month in range(1, 13)}
         for order in monthly_orders:
-            orders_by_month[int(order.month)][order.product_id] = order.order_count
+            orders_by_month[order.sales_month.month][order.product_id] = order.order_count
 
-        return orders_by_month
+        # Plain dict of ints, skip jsonable_encoder walking every entry; the month and product keys are ints
+        return Response(orjson.dumps(orders_by_month, option=orjson.OPT_NON_STR_KEYS), media_type="application/json")
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/admins/{admin_id}/years", response_model=list)
-def get_years(admin_id: int, db: Session = Depends(get_session)):
+@router.get("/admins/{admin_id}/years", response_model=list, dependencies=[Depends(require_admin)])
+def get_years(admin_id: int, db: Session = Depends(get_read_session)):
     try:
-        years = db.query(extract('year', Order.order_date).distinct().label("year")).all()
-        return [year.year for year in years]
+        years = (
+            db.query(func.strftime("%Y", ProductSalesMonthly.sales_month).distinct().label("year"))
+            .filter(ProductSalesMonthly.admin_id == admin_id, ProductSalesMonthly.order_count > 0)
+            .order_by("year")
+            .all()
+        )
+        return [int(year.year) for year in years]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,9 +1,13 @@
-from fastapi import Depends, HTTPException, status, APIRouter
-from sqlmodel import Session
+from fastapi import Depends, HTTPException, Request, status, APIRouter
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.schemas.sql_models import  User
-from app.schemas.user_schema import UserCreate, UserBase, UserResponse, UserLogin
-from app.database import get_session
-from app.utils import hash_password, verify_password
+from app.schemas.user_schema import UserCreate, UserBase, UserResponse, UserLogin, UserLoginResponse, Token
+from app.database import get_session, get_async_session
+from app.passwords import hash_password, verify_password
+from app.ratelimit import check_login_backoff, login_backoff_key, record_login_failure, reset_login_backoff
+from app.utils import create_access_token, invalidate_account
 from typing import List
 from app import schemas
 
@@ -11,14 +15,14 @@ router = APIRouter(tags=["User"])
 
 
 @router.post("/register/", response_model=schemas.user_schema.UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(user_create: UserCreate, db: Session = Depends(get_session)):
+async def register_user(user_create: UserCreate, db: AsyncSession = Depends(get_async_session)):
     # Check if the user already exists
-    existing_user = db.query(User).filter(User.username == user_create.username).first()
+    existing_user = (await db.exec(select(User).where(User.username == user_create.username))).first()
     if existing_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User already exists")
 
     # Hash the user's password before storing it
-    hashed_password = hash_password(user_create.password)
+    hashed_password = await hash_password(user_create.password)
 
     # Create a new user instance
     new_user = User(
@@ -29,8 +33,8 @@ def register_user(user_create: UserCreate, db: Session = Depends(get_session)):
 
     # Add the new user to the database
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     # Return UserResponse with the registered user details
     return schemas.user_schema.UserResponse(
@@ -40,19 +44,50 @@ def register_user(user_create: UserCreate, db: Session = Depends(get_session)):
     )
 
 
-@router.post("/login/", response_model=UserResponse)
-def login_user(user_login: UserLogin, db: Session = Depends(get_session)):
+async def authenticate_user(request: Request, db: AsyncSession, username: str, password: str) -> User:
+    # Refuse early while this client is backing off from failed attempts on the account
+    backoff_key = login_backoff_key(request, "user", username)
+    check_login_backoff(backoff_key)
+
     # Retrieve the user by username
-    db_user = db.query(User).filter(User.username == user_login.username).first()
+    db_user = (await db.exec(select(User).where(User.username == username))).first()
     if not db_user:
+        record_login_failure(backoff_key)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     # Verify the password
-    if not verify_password(user_login.password, db_user.password):
+    verified, new_hash = await verify_password(password, db_user.password)
+    if not verified:
+        record_login_failure(backoff_key)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password")
+    reset_login_backoff(backoff_key)
+
+    # Store a hash at the current cost factor
+    if new_hash:
+        db_user.password = new_hash
+        await db.commit()
+    return db_user
+
+
+@router.post("/login/", response_model=UserLoginResponse)
+async def login_user(request: Request, user_login: UserLogin, db: AsyncSession = Depends(get_async_session)):
+    db_user = await authenticate_user(request, db, user_login.username, user_login.password)
+
+    # User authenticated successfully, return user details with a bearer token for later requests
+    return UserLoginResponse(
+        id=db_user.id,
+        username=db_user.username,
+        email=db_user.email,
+        access_token=create_access_token("user", db_user.id)
+    )
+
 
-    # User authenticated successfully, return user details as UserResponse
-    return UserResponse(id=db_user.id, username=db_user.username, email=db_user.email)
+@router.post("/token", response_model=Token)
+async def issue_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(),
+                      db: AsyncSession = Depends(get_async_session)):
+    # OAuth2 password flow for the interactive docs and form based clients
+    db_user = await authenticate_user(request, db, form_data.username, form_data.password)
+    return Token(access_token=create_access_token("user", db_user.id))
 
 
 @router.get("/users/", response_model=List[UserResponse])
@@ -81,6 +116,7 @@ def delete_user(user_id: int, db: Session = Depends(get_session)):
     # Delete the user from the database
     db.delete(db_user)
     db.commit()
+    invalidate_account("user", user_id)
 
     # Return the deleted user details as UserResponse
     return db_user
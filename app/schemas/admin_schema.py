@@ -23,4 +23,8 @@ class AdminResponse(BaseModel):
 
 class AdminLogin(BaseModel):
     adminname: str
-    password: str
\ No newline at end of file
+    password: str
+
+class AdminLoginResponse(AdminResponse):
+    access_token: str
+    token_type: str = "bearer"
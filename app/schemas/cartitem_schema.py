@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import List, Literal
+
+from pydantic import BaseModel, Field
 from app.schemas.sql_models import Product
 from app.schemas.user_schema import UserResponse
 
@@ -10,7 +12,7 @@ class CartItemBase(BaseModel):
 
 class CartItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(gt=0)
 
 class CartBase(BaseModel):
     id: int
@@ -22,3 +24,17 @@ class CartItemResponse(BaseModel):
     product_details: Product
     quantity: int
 
+class CartLineResponse(BaseModel):
+    id: int
+    product_id: int
+    product_details: Product
+    quantity: int
+
+class CartResponse(BaseModel):
+    user_details: UserResponse
+    items: List[CartLineResponse]
+
+class CartOperation(BaseModel):
+    op: Literal["add", "set", "remove"]
+    product_id: int
+    quantity: int = 1
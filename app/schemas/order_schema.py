@@ -21,19 +21,28 @@ class OrderUpdate(BaseModel):
 class PlaceOrderRequest(BaseModel):
     cart_id: int
 
+class OrderLineResponse(BaseModel):
+    product_id: int
+    product_details: Product
+    quantity: int
+    unit_price: float
+    line_total: float
+
 class OrderResponse(BaseModel):
     id: int
     user_details: UserResponse
-    products: List[Product]
-    quantity: List[int]
+    lines: List[OrderLineResponse]
+    total_quantity: int
     total_amount: float
     order_date: datetime
 
 class OrderEachResponse(BaseModel):
     id: int
+    line_id: int
     user_details: UserResponse
     products: Product
     quantity: int
+    unit_price: float
     total_amount: float
     order_date: datetime
 
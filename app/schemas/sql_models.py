@@ -1,5 +1,6 @@
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import List, Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -10,7 +11,7 @@ class User(SQLModel, table=True):
     password: str = Field()
 
     cart_items: Optional["CartItem"] = Relationship(back_populates="user")
-    orders: Optional["Order"] = Relationship(back_populates="user")
+    orders: List["OrderHeader"] = Relationship(back_populates="user")
 
 
 class Admin(SQLModel, table=True):
@@ -25,16 +26,21 @@ class Admin(SQLModel, table=True):
 class Product(SQLModel, table=True):
     id: int = Field(primary_key=True, index=True)
     name: str = Field(index=True)
-    description: str = Field(index=True)
+    description: str = Field()
     price: float = Field()
     image_path: str = Field(nullable=True)
+    thumbnail_path: Optional[str] = Field(default=None, nullable=True)
+    webp_path: Optional[str] = Field(default=None, nullable=True)
+    stock: Optional[int] = Field(default=None, nullable=True)  # units available, None when not tracked
     admin_id: int = Field(foreign_key="admin.id")
 
     cart_items: Optional["CartItem"] = Relationship(back_populates="product")
-    orders: Optional["Order"] = Relationship(back_populates="product")
+    order_lines: List["OrderLine"] = Relationship(back_populates="product")
     admin: Optional["Admin"] = Relationship(back_populates="products")
 
 class CartItem(SQLModel, table=True):
+    __table_args__ = (Index("ix_cartitem_user_id_product_id", "user_id", "product_id", unique=True),)
+
     id: int = Field(primary_key=True, index=True)
     user_id: int = Field(foreign_key="user.id")
     product_id: int = Field(foreign_key="product.id")
@@ -45,14 +51,89 @@ class CartItem(SQLModel, table=True):
 
 
 
-class Order(SQLModel, table=True):
+class OrderHeader(SQLModel, table=True):
+    __table_args__ = (Index("ix_orderheader_user_id_order_date", "user_id", "order_date"),)
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     user_id: int = Field(foreign_key="user.id")
-    product_id: int = Field(foreign_key="product.id")
-    quantity: int
+    order_date: datetime = Field(index=True)
+    total_quantity: int
     total_amount: float
-    order_date: datetime
-
 
     user: Optional["User"] = Relationship(back_populates="orders")
-    product: Optional["Product"] = Relationship(back_populates="orders")
+    lines: List["OrderLine"] = Relationship(back_populates="order")
+
+
+class OrderLine(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    order_id: int = Field(foreign_key="orderheader.id", index=True)
+    product_id: int = Field(foreign_key="product.id", index=True)
+    quantity: int
+    unit_price: float
+    line_total: float
+
+    order: Optional["OrderHeader"] = Relationship(back_populates="lines")
+    product: Optional["Product"] = Relationship(back_populates="order_lines")
+
+
+class ProductSalesDaily(SQLModel, table=True):
+    __tablename__ = "product_sales_daily"
+    __table_args__ = (Index("ix_product_sales_daily_admin_id_sales_date", "admin_id", "sales_date"),)
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    sales_date: date = Field(primary_key=True)
+    admin_id: int = Field(foreign_key="admin.id")
+    quantity: int = Field(default=0)
+    order_count: int = Field(default=0)
+    revenue: float = Field(default=0.0)
+
+
+class ProductSalesMonthly(SQLModel, table=True):
+    __tablename__ = "product_sales_monthly"
+    __table_args__ = (
+        Index("ix_product_sales_monthly_admin_id_sales_month", "admin_id", "sales_month"),
+        Index("ix_product_sales_monthly_admin_id_product_id", "admin_id", "product_id"),
+    )
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    sales_month: date = Field(primary_key=True)  # first day of the month
+    admin_id: int = Field(foreign_key="admin.id")
+    quantity: int = Field(default=0)
+    order_count: int = Field(default=0)
+    revenue: float = Field(default=0.0)
+
+
+class ImageJob(SQLModel, table=True):
+    __table_args__ = (Index("ix_imagejob_status_id", "status", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    product_id: int = Field(index=True)
+    image_path: str = Field()
+    status: str = Field(default="pending")  # pending, running, done or failed
+    attempts: int = Field(default=0)
+    error: Optional[str] = Field(default=None, nullable=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class StockReservation(SQLModel, table=True):
+    __table_args__ = (Index("ix_stockreservation_user_id_product_id", "user_id", "product_id", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    product_id: int = Field(foreign_key="product.id")
+    quantity: int = Field()
+    expires_at: datetime = Field(index=True)
+
+
+class IdempotencyKey(SQLModel, table=True):
+    __table_args__ = (Index("ix_idempotencykey_user_id_endpoint_key", "user_id", "endpoint", "key", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field()
+    endpoint: str = Field()
+    key: str = Field()
+    fingerprint: str = Field()  # sha256 of the request, a reused key must come with the same request
+    status_code: Optional[int] = Field(default=None, nullable=True)
+    response: Optional[str] = Field(default=None, nullable=True)  # JSON body replayed to retries
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
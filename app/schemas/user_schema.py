@@ -23,4 +23,13 @@ class UserResponse(BaseModel):
 
 class UserLogin(BaseModel):
     username: str
-    password: str
\ No newline at end of file
+    password: str
+
+class UserLoginResponse(UserResponse):
+    access_token: str
+    token_type: str = "bearer"
+
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
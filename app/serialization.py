@@ -0,0 +1,35 @@
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+# Sent with every conditional response: clients may keep the body but must revalidate it before reuse
+CONDITIONAL_CACHE_CONTROL = "no-cache"
+
+
+def dump_response(adapter: TypeAdapter, content: Any, headers: Optional[dict] = None, status_code: int = 200) -> Response:
+    # For content built with model_construct from rows the database already typed: the adapter's compiled
+    # serializer writes the JSON in one pass, where a response_model would validate the models, dump them
+    # to dicts and encode those separately
+    return Response(adapter.dump_json(content), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def strong_etag(body: bytes) -> str:
+    # Derived from the bytes themselves, so every worker gives the same body the same tag
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses the weak comparison: a W/ prefix on the client's tags is ignored
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def conditional_response(request: Request, body: bytes, etag: str, headers: Optional[dict] = None) -> Response:
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, headers=headers, media_type="application/json")
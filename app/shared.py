@@ -0,0 +1,60 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import BaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class SharedObjectManager(BaseManager):
+    pass
+
+
+def parse_address(address: str):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class SharedObjectClient:
+    """Calls the methods of an object hosted by a stand-in process started with serve(), connecting on first use."""
+
+    def __init__(self, address: str, authkey: bytes, typeid: str, name: str, fallback=None):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.typeid = typeid
+        self.name = name
+        self.fallback = fallback
+        self._proxy = None
+        self._lock = threading.Lock()
+
+    def _call(self, method: str, *args):
+        try:
+            with self._lock:
+                if self._proxy is None:
+                    SharedObjectManager.register(self.typeid)
+                    manager = SharedObjectManager(address=self.address, authkey=self.authkey)
+                    manager.connect()
+                    self._proxy = getattr(manager, self.typeid)()
+            return getattr(self._proxy, method)(*args)
+        except (OSError, EOFError) as e:
+            # Degrade to the fallback and reconnect on the next call: an unreachable helper process
+            # must not take the whole API down with it
+            logger.warning("%s unavailable: %s", self.name, e)
+            self._proxy = None
+            return self.fallback
+
+
+def process_pool(workers: int, initializer=None) -> ProcessPoolExecutor:
+    # Spawn rather than fork: the app process runs threads of its own, and a forked child would
+    # inherit whatever locks they held at that moment
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=initializer)
+
+
+def serve(objects: dict, address: str, authkey: bytes, name: str):
+    # Host objects[typeid] for every SharedObjectClient of that typeid, until the process is stopped
+    for typeid, shared_object in objects.items():
+        SharedObjectManager.register(typeid, callable=lambda shared_object=shared_object: shared_object)
+    server = SharedObjectManager(address=parse_address(address), authkey=authkey).get_server()
+    logger.info("%s listening on %s", name, address)
+    server.serve_forever()
@@ -0,0 +1,228 @@
+import gzip
+import hashlib
+import logging
+import os
+import re
+import sys
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from app.cache import LRUCache
+from app.serialization import etag_matches
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip siblings are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Cache lifetime for files whose name is not a content hash; they revalidate with the ETag after that
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_CHUNK_SIZE = 64 * 1024
+
+# Uploads are named <sha256>.<ext> and their derivatives <sha256>.<size>.webp
+HASHED_NAME = re.compile(r"^([0-9a-f]{64})(\.|$)")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Text assets worth serving from precompressed siblings, with the sibling suffix per encoding
+COMPRESSIBLE_EXTENSIONS = {".css", ".html", ".js", ".json", ".map", ".mjs", ".svg", ".txt", ".xml"}
+PRECOMPRESSED_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+
+etag_cache = LRUCache(maxsize=4096, ttl=float("inf"))
+
+
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(STATIC_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+async def content_hash(path: str, stat_result: os.stat_result) -> str:
+    # Hash named files carry their hash, others are hashed off the event loop once per (mtime, size)
+    match = HASHED_NAME.match(os.path.basename(path))
+    if match:
+        return match.group(1)
+
+    key = (path, stat_result.st_mtime_ns, stat_result.st_size)
+    digest = etag_cache.get(key)
+    if digest is None:
+        digest = await anyio.to_thread.run_sync(hash_file, path)
+        etag_cache.set(key, digest)
+    return digest
+
+
+def find_precompressed(path: str, stat_result: os.stat_result, accept_encoding: str):
+    # Pick the first sibling the client accepts that is at least as new as the original
+    accepted = {value.split(";")[0].strip() for value in accept_encoding.split(",")}
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        if encoding not in accepted:
+            continue
+        try:
+            sibling_stat = os.stat(path + suffix)
+        except OSError:
+            continue
+        if sibling_stat.st_mtime >= stat_result.st_mtime:
+            return encoding, path + suffix, sibling_stat.st_size
+    return None
+
+
+def parse_range(range_header: str, size: int):
+    # Single byte ranges only; returns (start, end), None to ignore the header, or ValueError if unsatisfiable
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(range_header)
+    return start, end
+
+
+class StaticFileResponse(Response):
+    """One static file with a content hash ETag, cache headers, precompressed variants and byte ranges."""
+
+    def __init__(self, path: str, stat_result: os.stat_result, scope: Scope):
+        self.path = path
+        self.stat_result = stat_result
+        self.request_headers = Headers(scope=scope)
+        self.background = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path, size = self.path, self.stat_result.st_size
+        digest = await content_hash(path, self.stat_result)
+        name = os.path.basename(path)
+        headers = {
+            "content-type": guess_type(name)[0] or "text/plain",
+            "cache-control": IMMUTABLE_CACHE_CONTROL if HASHED_NAME.match(name) else f"public, max-age={STATIC_MAX_AGE}",
+            "last-modified": formatdate(self.stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+        }
+
+        # Serve a precompressed sibling when the client accepts one; each encoding gets its own ETag
+        encoding = None
+        if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            headers["vary"] = "Accept-Encoding"
+            variant = await anyio.to_thread.run_sync(
+                find_precompressed, path, self.stat_result, self.request_headers.get("accept-encoding", "")
+            )
+            if variant:
+                encoding, path, size = variant
+                headers["content-encoding"] = encoding
+        headers["etag"] = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+        if self.is_not_modified(headers["etag"]):
+            await self.send_headers(send, 304, headers)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        status_code, start, end = 200, 0, size - 1
+        range_header = self.request_headers.get("range")
+        if_range = self.request_headers.get("if-range")
+        if range_header and (if_range is None or if_range == headers["etag"]):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                headers["content-range"] = f"bytes */{size}"
+                headers["content-length"] = "0"
+                await self.send_headers(send, 416, headers)
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            if byte_range:
+                status_code, (start, end) = 206, byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        headers["content-length"] = str(end - start + 1)
+        await self.send_headers(send, status_code, headers)
+        await self.send_body(scope, send, path, start, end - start + 1, whole=status_code == 200)
+
+    def is_not_modified(self, etag: str) -> bool:
+        if_none_match = self.request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = self.request_headers.get("if-modified-since")
+        try:
+            return if_modified_since is not None and \
+                int(self.stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    async def send_headers(self, send: Send, status_code: int, headers: dict):
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(key.encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+        })
+
+    async def send_body(self, scope: Scope, send: Send, path: str, offset: int, count: int, whole: bool):
+        # Hand the file to the server for a zero-copy send when it offers one, else stream chunks
+        extensions = scope.get("extensions") or {}
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif whole and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": path})
+        elif "http.response.zerocopysend" in extensions:
+            with open(path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file.fileno(), "offset": offset, "count": count})
+        else:
+            async with await anyio.open_file(path, "rb") as file:
+                await file.seek(offset)
+                more_body = True
+                while more_body:
+                    chunk = await file.read(min(STATIC_CHUNK_SIZE, count))
+                    count -= len(chunk)
+                    more_body = count > 0 and bool(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles serving through StaticFileResponse."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        return StaticFileResponse(str(full_path), stat_result, scope)
+
+
+def precompress(directory: str):
+    # Write .gz (and .br when brotli is installed) siblings for compressible files that lack an up to date one
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                data = file.read()
+            variants = [(".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", lambda: brotli.compress(data, quality=11)))
+            for suffix, compress in variants:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                compressed = compress()
+                if len(compressed) >= len(data):
+                    continue
+                temp_path = f"{target}.{os.getpid()}.part"
+                with open(temp_path, "wb") as file:
+                    file.write(compressed)
+                os.replace(temp_path, target)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    directory = sys.argv[1] if len(sys.argv) > 1 else "static"
+    logger.info("Wrote %d precompressed files under %s", precompress(directory), directory)
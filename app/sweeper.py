@@ -0,0 +1,37 @@
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Sweeper:
+    """Runs a cleanup function every interval seconds on a background thread."""
+
+    def __init__(self, name: str, sweep: Callable[[], int], interval: float):
+        self.name = name
+        self.sweep = sweep
+        self.interval = interval
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name=f"sweeper-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                swept = self.sweep()
+                if swept:
+                    logger.info("Swept %d %s", swept, self.name)
+            except Exception:
+                logger.exception("Sweeping %s failed", self.name)
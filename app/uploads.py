@@ -0,0 +1,71 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from fastapi import HTTPException, UploadFile, status
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.images import derivative_paths
+from app.schemas.sql_models import Product
+
+# Upload settings
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./static/uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Extensions kept from the client filename; anything else is stored without one
+EXTENSION_PATTERN = re.compile(r"^\.[a-z0-9]{1,5}$")
+
+
+def upload_extension(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if EXTENSION_PATTERN.match(extension) else ""
+
+
+def save_upload(upload: UploadFile, upload_dir: str = UPLOAD_DIR, max_bytes: int = UPLOAD_MAX_BYTES) -> str:
+    # Stream the upload into a temp file beside its destination, hashing as we go, then
+    # rename it to <sha256><ext> so identical images share one file. Blocking I/O, so call
+    # it from a sync handler (FastAPI runs those in its threadpool, off the event loop).
+    os.makedirs(upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=upload_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while chunk := upload.file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Image exceeds {max_bytes} bytes"
+                    )
+                digest.update(chunk)
+                temp_file.write(chunk)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        image_path = os.path.join(upload_dir, digest.hexdigest() + upload_extension(upload.filename))
+        if os.path.exists(image_path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, image_path)
+        return image_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def remove_unreferenced_image(db: Session, image_path: str):
+    # Content addressed files can back several products, only delete the last reference
+    # along with its derivatives
+    if not image_path:
+        return
+    references = db.exec(select(func.count()).select_from(Product).where(Product.image_path == image_path)).one()
+    if references:
+        return
+    for path in (image_path, *derivative_paths(image_path)):
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,36 +1,97 @@
-from fastapi import HTTPException, Depends
+import os
+import time
+
+from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app import schemas
-from app.database import get_session
-from app.schemas.sql_models import User
+from app.cache import LRUCache
+from app.database import get_async_session
+from app.schemas.admin_schema import AdminResponse
+from app.schemas.sql_models import Admin, User
+from app.schemas.user_schema import UserResponse
 import jwt
 from jwt import PyJWTError
-from passlib.context import CryptContext
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Secret key and JWT algorithm
-SECRET_KEY = "your_secret_key_here"
+# Secret key and JWT algorithm. Tokens signed with a known key can claim any admin account, so the app
+# refuses to start without JWT_SECRET_KEY, or with the placeholder it used to fall back to
+INSECURE_SECRET_KEYS = {"", "your_secret_key_here"}
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
+if SECRET_KEY in INSECURE_SECRET_KEYS:
+    raise RuntimeError("Set JWT_SECRET_KEY to a long random value, e.g. python -c 'import secrets; print(secrets.token_hex(32))'")
 JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", str(60 * 60)))
+
+# Decoded tokens and the accounts they name, so authenticated requests skip the signature
+# check and the account lookup; a deleted account is dropped here but other processes keep
+# it for up to AUTH_CACHE_TTL seconds
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+token_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+account_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Token role -> table and response schema of the account it names
+ACCOUNTS = {"user": (User, UserResponse), "admin": (Admin, AdminResponse)}
 
 def get_user_by_username(db: Session, username: str):
     return db.query(schemas.sql_models.User).filter(schemas.sql_models.User.username == username).first()
 
-def hash_password(password: str):
-    return pwd_context.hash(password)
+def create_access_token(role: str, account_id: int) -> str:
+    now = int(time.time())
+    payload = {"sub": str(account_id), "role": role, "iat": now, "exp": now + ACCESS_TOKEN_TTL}
+    return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+def decode_token(token: str) -> dict:
+    # Verify the signature once per token; cached claims still have their expiry checked
+    claims = token_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "sub"]})
+        except PyJWTError:
+            # Token verification failed
+            raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+        token_cache.set(token, claims)
+    elif claims["exp"] <= time.time():
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+def invalidate_account(role: str, account_id: int):
+    account_cache.delete((role, account_id))
+
+async def get_account(role: str, token: str, db: AsyncSession):
+    claims = decode_token(token)
+    if claims.get("role") != role:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Requires a {role} token")
+
+    model, response_schema = ACCOUNTS[role]
+    key = (role, int(claims["sub"]))
+    data = account_cache.get(key)
+    if data is None:
+        account = await db.get(model, key[1])
+        if not account:
+            raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+        data = response_schema.model_validate(account, from_attributes=True).model_dump()
+        account_cache.set(key, data)
+    # Cached data was validated when it was loaded
+    return response_schema.model_construct(**data)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_session)) -> UserResponse:
+    return await get_account("user", token, db)
+
+async def get_current_admin(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_session)) -> AdminResponse:
+    return await get_account("admin", token, db)
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+async def require_user(user_id: int, current_user: UserResponse = Depends(get_current_user)) -> UserResponse:
+    # For routes scoped to a user_id: only that user's token is accepted
+    if current_user.id != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed for this user")
+    return current_user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        # Perform additional checks or database queries to validate the user
-    except PyJWTError:
-        # Token verification failed
-        raise HTTPException(status_code=401, detail="Invalid token")
+async def require_admin(admin_id: int, current_admin: AdminResponse = Depends(get_current_admin)) -> AdminResponse:
+    # For routes scoped to an admin_id: only that admin's token is accepted
+    if current_admin.id != admin_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed for this admin")
+    return current_admin
@@ -0,0 +1,38 @@
+"""Time the admin dashboard endpoints against order history size.
+
+Run with `python -m benchmarks.analytics [orders]` (default 1,000,000 orders).
+Products are spread over ten admins. The endpoints read the
+product_sales_monthly rollup, so their latency depends on the admin's
+products and months of history, not on the number of orders.
+"""
+import statistics
+import sys
+
+from benchmarks.common import auth_headers, count_queries, seed, timed
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+ENDPOINTS = ("/admins/1/product-sales", "/admins/1/products/2024/monthly-orders", "/admins/1/years")
+ROUNDS = 20
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with timed() as elapsed:
+        seed(products=1000, users=100, orders=orders, admins=10)
+    print(f"seeded {orders} orders in {elapsed['seconds']:.1f} s")
+
+    print(f"{'endpoint':<42} {'median ms':>10} {'max ms':>8} {'queries':>8}")
+    with TestClient(app, headers=auth_headers("admin", 1)) as client:
+        for url in ENDPOINTS:
+            samples = []
+            for _ in range(ROUNDS):
+                with count_queries() as queries, timed() as elapsed:
+                    client.get(url).raise_for_status()
+                samples.append(elapsed["seconds"] * 1000)
+            print(f"{url:<42} {statistics.median(samples):>10.2f} {max(samples):>8.2f} {queries['count']:>8}")
+
+
+if __name__ == "__main__":
+    main()
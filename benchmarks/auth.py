@@ -0,0 +1,64 @@
+"""Compare authenticating every call with the password against a bearer token.
+
+Run with `python -m benchmarks.auth [rounds]` (default 50). Each flow reads a
+ten item cart. "password" logs in before every call as clients without a
+token had to (one bcrypt verify each), "token cold" clears the token and
+account caches before every call, "token" is the steady state.
+"""
+import statistics
+import sys
+
+from benchmarks.common import count_queries, fill_cart, seed, timed
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.database import engine
+from app.main import app
+from app.passwords import hash_secret
+from app.schemas.sql_models import User
+from app.utils import account_cache, token_cache
+
+PASSWORD = "correct horse battery staple"
+
+
+def password_flow(client: TestClient, token: str):
+    response = client.post("/login/", json={"username": "user1", "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def cold_token_flow(client: TestClient, token: str):
+    token_cache.clear()
+    account_cache.clear()
+    return {"Authorization": f"Bearer {token}"}
+
+
+def token_flow(client: TestClient, token: str):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seed(products=10, users=1)
+    with Session(engine) as session:
+        session.get(User, 1).password = hash_secret(PASSWORD)
+        session.commit()
+    fill_cart(1, 10)
+
+    print(f"{'flow':<11} {'median ms':>10} {'p99 ms':>8} {'queries':>8}")
+    with TestClient(app) as client:
+        token = client.post("/login/", json={"username": "user1", "password": PASSWORD}).json()["access_token"]
+        for name, flow in (("password", password_flow), ("token cold", cold_token_flow), ("token", token_flow)):
+            samples = []
+            for _ in range(rounds):
+                with count_queries() as queries, timed() as elapsed:
+                    headers = flow(client, token)
+                    client.get("/cart/items/", params={"user_id": 1, "lite": True}, headers=headers).raise_for_status()
+                samples.append(elapsed["seconds"] * 1000)
+            samples.sort()
+            print(f"{name:<11} {statistics.median(samples):>10.2f} {samples[int(len(samples) * 0.99) - 1]:>8.2f} "
+                  f"{queries['count']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Measure GET /cart/items/ latency, query count and body size against cart size.
+
+Run with `python -m benchmarks.cart_read`. The query count should stay at
+two for every cart size; lite mode sends the user block once.
+"""
+import statistics
+
+from benchmarks.common import auth_headers, count_queries, fill_cart, seed, timed
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+CART_SIZES = (1, 10, 100, 250)
+ROUNDS = 5
+
+
+def main():
+    seed(products=max(CART_SIZES), users=len(CART_SIZES))
+    print(f"{'cart size':>10} {'mode':>5} {'median ms':>10} {'queries':>8} {'bytes':>8}")
+    with TestClient(app) as client:
+        for user_id, size in enumerate(CART_SIZES, start=1):
+            fill_cart(user_id, size)
+            for lite in (False, True):
+                samples = []
+                for _ in range(ROUNDS):
+                    with count_queries() as queries, timed() as elapsed:
+                        response = client.get("/cart/items/", params={"user_id": user_id, "lite": lite},
+                                              headers=auth_headers("user", user_id))
+                    response.raise_for_status()
+                    samples.append(elapsed["seconds"] * 1000)
+                mode = "lite" if lite else "full"
+                print(f"{size:>10} {mode:>5} {statistics.median(samples):>10.2f} "
+                      f"{queries['count']:>8} {len(response.content):>8}")
+
+
+if __name__ == "__main__":
+    main()
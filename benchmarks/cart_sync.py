@@ -0,0 +1,64 @@
+"""Compare syncing an offline cart with one request per item against one batch.
+
+Run with `python -m benchmarks.cart_sync`. Each sync adds every item and
+then changes the quantity of half of them; the batch should take one
+request and one commit whatever the size.
+"""
+import statistics
+
+from benchmarks.common import auth_headers, count_queries, seed, timed
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, delete
+
+from app.database import async_engine, engine
+from app.main import app
+from app.schemas.sql_models import CartItem
+
+SYNC_SIZES = (10, 50, 200)
+ROUNDS = 3
+
+
+def clear_cart(user_id: int):
+    with Session(engine) as session:
+        session.exec(delete(CartItem).where(CartItem.user_id == user_id))
+        session.commit()
+
+
+def sync_one_by_one(client: TestClient, user_id: int, size: int):
+    for product_id in range(1, size + 1):
+        client.post(f"/users/{user_id}/cart/add", json={"product_id": product_id, "quantity": 1}).raise_for_status()
+    for product_id in range(1, size + 1, 2):
+        client.post(f"/users/{user_id}/cart/add", json={"product_id": product_id, "quantity": 2}).raise_for_status()
+    return size + (size + 1) // 2
+
+
+def sync_batch(client: TestClient, user_id: int, size: int):
+    operations = [{"op": "add", "product_id": product_id, "quantity": 1} for product_id in range(1, size + 1)]
+    operations += [{"op": "set", "product_id": product_id, "quantity": 3} for product_id in range(1, size + 1, 2)]
+    client.post(f"/users/{user_id}/cart/batch", json=operations, params={"lite": True}).raise_for_status()
+    return 1
+
+
+def main():
+    seed(products=max(SYNC_SIZES), users=1)
+    commits = {"count": 0}
+    event.listen(async_engine.sync_engine, "commit", lambda connection: commits.__setitem__("count", commits["count"] + 1))
+
+    print(f"{'items':>6} {'mode':>10} {'median ms':>10} {'requests':>9} {'queries':>8} {'commits':>8}")
+    with TestClient(app, headers=auth_headers("user", 1)) as client:
+        for size in SYNC_SIZES:
+            for mode, sync in (("one by one", sync_one_by_one), ("batch", sync_batch)):
+                samples = []
+                for _ in range(ROUNDS):
+                    clear_cart(1)
+                    commits["count"] = 0
+                    with count_queries() as queries, timed() as elapsed:
+                        requests = sync(client, 1, size)
+                    samples.append(elapsed["seconds"] * 1000)
+                print(f"{size:>6} {mode:>10} {statistics.median(samples):>10.2f} {requests:>9} "
+                      f"{queries['count']:>8} {commits['count']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Measure POST /orders/place latency and query count against cart size.
+
+Run with `python -m benchmarks.checkout`.
+"""
+import statistics
+
+from benchmarks.common import auth_headers, count_queries, fill_cart, seed, timed
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+CART_SIZES = (1, 10, 40, 100, 250)
+ROUNDS = 5
+
+
+def main():
+    seed(products=max(CART_SIZES), users=1)
+    print(f"{'cart size':>10} {'median ms':>10} {'queries':>8}")
+    with TestClient(app, headers=auth_headers("user", 1)) as client:
+        for size in CART_SIZES:
+            samples = []
+            for _ in range(ROUNDS):
+                fill_cart(1, size)
+                with count_queries() as queries, timed() as elapsed:
+                    response = client.post("/orders/place", params={"user_id": 1})
+                response.raise_for_status()
+                samples.append(elapsed["seconds"] * 1000)
+            print(f"{size:>10} {statistics.median(samples):>10.2f} {queries['count']:>8}")
+
+
+if __name__ == "__main__":
+    main()
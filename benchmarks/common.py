@@ -0,0 +1,123 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import random
+
+# Point the app at a scratch database before app.database is imported
+SCRATCH_DIR = tempfile.mkdtemp(prefix="ecommerce-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH_DIR, 'bench.db')}")
+# Keep the image worker's polling out of the measured query counts
+os.environ.setdefault("IMAGE_WORKER_MODE", "external")
+# Benchmarks drive one client far past the per-client budgets
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# Tokens only ever sign into the scratch database
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key")
+
+from sqlalchemy import event, insert
+from sqlmodel import Session
+
+from app.analytics import rebuild_sales_rollup
+from app.database import engine, async_engine, create_database
+from app.schemas.sql_models import Admin, User, Product, CartItem, OrderHeader, OrderLine
+from app.utils import create_access_token
+
+SEED_BATCH = 10_000
+WORDS = (
+    "apple banana laptop mouse keyboard ring watch frame book shuttle bat spray grape pineapple "
+    "feather silver gold leather cotton wooden steel glass wireless portable classic premium organic "
+    "fresh vintage compact deluxe smart solar travel kitchen garden office sport kids"
+).split()
+
+
+@contextmanager
+def count_queries():
+    # Count the statements sent to the database while the block runs
+    counter = {"count": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["count"] += 1
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        for target in (engine, async_engine.sync_engine):
+            event.remove(target, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def timed():
+    result = {"seconds": 0.0}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = time.perf_counter() - start
+
+
+def seed(products: int = 100, users: int = 10, orders: int = 0, history_days: int = 3 * 365,
+         admins: int = 1, carts: int = 0, max_order_lines: int = 1, seed_value: int = 42, db_engine=engine):
+    # Fill the scratch database with admins, users, products dealt round robin to the admins, carts of
+    # 1-10 items for the first `carts` users and orders of 1-max_order_lines lines spread over history_days
+    create_database(db_engine)
+    rng = random.Random(seed_value)
+    prices = []
+    with Session(db_engine) as session:
+        session.add_all(Admin(id=i, email=f"admin{i}@example.com", adminname=f"admin{i}", password="x")
+                        for i in range(1, admins + 1))
+        session.add_all(User(id=i, email=f"user{i}@example.com", username=f"user{i}", password="x")
+                        for i in range(1, users + 1))
+        for batch_start in range(1, products + 1, SEED_BATCH):
+            batch = range(batch_start, min(batch_start + SEED_BATCH, products + 1))
+            batch_prices = [round(rng.uniform(10, 5000), 2) for _ in batch]
+            prices += batch_prices
+            session.execute(insert(Product), [
+                {
+                    "id": i,
+                    "name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+                    "description": " ".join(rng.choices(WORDS, k=12)),
+                    "price": price,
+                    "image_path": f"./static/uploads/{i}.jpg",
+                    "admin_id": (i - 1) % admins + 1,
+                }
+                for i, price in zip(batch, batch_prices)
+            ])
+        for batch_start in range(1, carts + 1, SEED_BATCH):
+            session.execute(insert(CartItem), [
+                {"user_id": user_id, "product_id": product_id, "quantity": rng.randint(1, 3)}
+                for user_id in range(batch_start, min(batch_start + SEED_BATCH, carts + 1))
+                for product_id in rng.sample(range(1, products + 1), min(rng.randint(1, 10), products))
+            ])
+        start = datetime(2022, 1, 1)
+        spacing = timedelta(days=history_days) / max(orders, 1)
+        for batch_start in range(1, orders + 1, SEED_BATCH):
+            headers, lines = [], []
+            for i in range(batch_start, min(batch_start + SEED_BATCH, orders + 1)):
+                order_lines = []
+                for _ in range(rng.randint(1, max_order_lines)):
+                    product_id, quantity = rng.randint(1, products), rng.randint(1, 5)
+                    unit_price = prices[product_id - 1]
+                    order_lines.append({"order_id": i, "product_id": product_id, "quantity": quantity,
+                                        "unit_price": unit_price, "line_total": round(quantity * unit_price, 2)})
+                headers.append({"id": i, "user_id": rng.randint(1, users), "order_date": start + spacing * i,
+                                "total_quantity": sum(line["quantity"] for line in order_lines),
+                                "total_amount": round(sum(line["line_total"] for line in order_lines), 2)})
+                lines += order_lines
+            session.execute(insert(OrderHeader), headers)
+            session.execute(insert(OrderLine), lines)
+        rebuild_sales_rollup(session.connection())
+        session.commit()
+
+
+def auth_headers(role: str = "user", account_id: int = 1):
+    # Bearer token for a seeded account, as the login endpoints would issue it
+    return {"Authorization": f"Bearer {create_access_token(role, account_id)}"}
+
+
+def fill_cart(user_id: int, items: int):
+    with Session(engine) as session:
+        session.add_all(CartItem(user_id=user_id, product_id=i, quantity=1) for i in range(1, items + 1))
+        session.commit()
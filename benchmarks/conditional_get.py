@@ -0,0 +1,59 @@
+"""Compare catalog reads rendered from the database, served from the catalog cache, and revalidated with a 304.
+
+Run with `python -m benchmarks.conditional_get [rounds]` (default 200 per
+case). "render" bumps the catalog version before every call, as a product
+write would; "cached" repeats the call; "304" sends the ETag back in
+If-None-Match. Exits non-zero if a cached or revalidated read runs more than
+the one catalog version lookup, or an unchanged read does not answer 304.
+"""
+import statistics
+import sys
+
+from benchmarks.common import count_queries, seed, timed
+from fastapi.testclient import TestClient
+
+from app.database import engine
+from app.main import app
+
+URLS = ("/allproducts", "/allproducts?limit=1000", "/7", "/admins/1/products/")
+
+
+def measure(client: TestClient, url: str, rounds: int, headers=None, bump: bool = False):
+    samples, queries, statuses = [], 0, set()
+    for _ in range(rounds):
+        if bump:
+            with engine.begin() as connection:
+                connection.exec_driver_sql("UPDATE catalogversion SET version = version + 1")
+        with count_queries() as counter, timed() as elapsed:
+            response = client.get(url, headers=headers)
+        samples.append(elapsed["seconds"])
+        queries += counter["count"]
+        statuses.add(response.status_code)
+    return statistics.median(samples) * 1000, queries / rounds, statuses, response
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seed(products=5000, users=10)
+
+    failures = 0
+    print(f"{'url':<26} {'case':<7} {'median ms':>10} {'queries':>8} {'status':>7} {'bytes':>8}")
+    with TestClient(app) as client:
+        for url in URLS:
+            etag = client.get(url).headers["ETag"]
+            for case, headers, bump in (("render", None, True), ("cached", None, False),
+                                        ("304", {"If-None-Match": etag}, False)):
+                median, queries, statuses, response = measure(client, url, rounds, headers, bump)
+                print(f"{url:<26} {case:<7} {median:>10.2f} {queries:>8.2f} {'/'.join(map(str, sorted(statuses))):>7} "
+                      f"{len(response.content):>8}")
+                if case != "render" and queries != 1:
+                    print(f"FAIL {url}: {case} reads ran {queries:.2f} queries instead of the version lookup")
+                    failures += 1
+                if case == "304" and statuses != {304}:
+                    print(f"FAIL {url}: unchanged reads answered {statuses}")
+                    failures += 1
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
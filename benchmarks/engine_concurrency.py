@@ -0,0 +1,101 @@
+"""Mixed reader/writer throughput with the default engine versus create_db_engine.
+
+Run with `python -m benchmarks.engine_concurrency [readers] [writers] [seconds]`.
+"before" is a plain create_engine() on a rollback-journal database; "after"
+is create_db_engine() with the pool settings and WAL/synchronous/mmap pragmas.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+from benchmarks.common import SCRATCH_DIR
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, Session
+
+from app.database import create_db_engine
+from app.schemas.sql_models import Admin, CartItem, Product, User
+
+PRODUCTS = 10_000
+
+
+def prepare(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    with Session(db_engine) as session:
+        session.add(Admin(id=1, email="admin@example.com", adminname="admin", password="x"))
+        session.add(User(id=1, email="user@example.com", username="user", password="x"))
+        session.execute(insert(Product), [
+            {"id": i, "name": f"Product {i}", "description": "x" * 200, "price": i, "image_path": "", "admin_id": 1}
+            for i in range(1, PRODUCTS + 1)
+        ])
+        session.commit()
+
+
+def run(db_engine, readers: int, writers: int, seconds: float):
+    stats = {"reads": [], "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader(n):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with Session(db_engine) as session:
+                    session.execute(select(Product).where(Product.id.between(n * 50, n * 50 + 50))).all()
+                with lock:
+                    stats["reads"].append(time.perf_counter() - start)
+            except OperationalError:
+                with lock:
+                    stats["errors"] += 1
+
+    def writer(n):
+        while time.perf_counter() < deadline:
+            try:
+                with Session(db_engine) as session:
+                    session.add(CartItem(user_id=1, product_id=n + 1, quantity=1))
+                    session.commit()
+                with lock:
+                    stats["writes"] += 1
+            except OperationalError:
+                with lock:
+                    stats["errors"] += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reads = sorted(stats["reads"])
+    return {
+        "reads/s": len(reads) / seconds,
+        "writes/s": stats["writes"] / seconds,
+        "read p50 ms": statistics.median(reads) * 1000 if reads else 0.0,
+        "read p99 ms": reads[int(len(reads) * 0.99) - 1] * 1000 if reads else 0.0,
+        "errors": stats["errors"],
+    }
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    engines = {
+        "before": create_engine(f"sqlite:///{os.path.join(SCRATCH_DIR, 'before.db')}"),
+        "after": create_db_engine(f"sqlite:///{os.path.join(SCRATCH_DIR, 'after.db')}"),
+    }
+    print(f"{readers} readers, {writers} writers, {seconds:.0f} s")
+    for name, db_engine in engines.items():
+        prepare(db_engine)
+        with db_engine.connect() as connection:
+            journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+        result = run(db_engine, readers, writers, seconds)
+        print(f"{name} ({journal_mode}): " + ", ".join(f"{key} {value:.1f}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Build a reproducible synthetic dataset for the benchmark suite.
+
+Run with `python -m benchmarks.generate [size] [seed]` (default 10k, seed 42),
+size being one of the keys of SIZES. The same size and seed always produce
+the same rows; the database is kept in BENCH_DATA_DIR and reused by later
+runs, so the 1m catalog is only built once.
+"""
+import os
+import sys
+import time
+
+from benchmarks.common import seed
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+from app.database import create_db_engine
+from app.schemas.sql_models import CartItem, OrderHeader, OrderLine, Product, User
+
+BENCH_DATA_DIR = os.getenv("BENCH_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+
+# Catalog size -> seed() arguments; three years of orders, carts for a tenth of the users at most
+SIZES = {
+    "1k": dict(products=1_000, users=200, orders=5_000, carts=50, admins=2),
+    "10k": dict(products=10_000, users=2_000, orders=50_000, carts=500, admins=10),
+    "100k": dict(products=100_000, users=20_000, orders=500_000, carts=2_000, admins=50),
+    "1m": dict(products=1_000_000, users=100_000, orders=2_000_000, carts=10_000, admins=200),
+}
+MAX_ORDER_LINES = 4
+
+
+def dataset_path(size: str, seed_value: int = 42) -> str:
+    return os.path.join(BENCH_DATA_DIR, f"{size}-seed{seed_value}.db")
+
+
+def build_dataset(size: str, seed_value: int = 42) -> str:
+    # Returns the path of the dataset, generating it first unless a finished one is already there
+    path = dataset_path(size, seed_value)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(BENCH_DATA_DIR, exist_ok=True)
+    partial = path + ".partial"
+    for leftover in (partial, partial + "-wal", partial + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    # A plain rollback journal, so the finished file holds every row on its own
+    db_engine = create_db_engine(f"sqlite:///{partial}", pragmas={"journal_mode": "DELETE", "synchronous": "OFF"})
+    try:
+        seed(**SIZES[size], max_order_lines=MAX_ORDER_LINES, seed_value=seed_value, db_engine=db_engine)
+    finally:
+        db_engine.dispose()
+    os.replace(partial, path)
+    return path
+
+
+def describe(path: str) -> str:
+    db_engine = create_db_engine(f"sqlite:///{path}")
+    try:
+        with Session(db_engine) as session:
+            counts = {model.__tablename__: session.execute(select(func.count()).select_from(model)).scalar()
+                      for model in (Product, User, CartItem, OrderHeader, OrderLine)}
+    finally:
+        db_engine.dispose()
+    return ", ".join(f"{count} {table} rows" for table, count in counts.items())
+
+
+def main():
+    size = sys.argv[1] if len(sys.argv) > 1 else "10k"
+    seed_value = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+    if size not in SIZES:
+        sys.exit(f"Unknown size {size!r}, pick one of {', '.join(SIZES)}")
+
+    start = time.perf_counter()
+    path = build_dataset(size, seed_value)
+    print(f"{path} ({time.perf_counter() - start:.1f} s): {describe(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Load test the async product read and search endpoints against sync equivalents.
+
+Run with `python -m benchmarks.load_test [clients] [seconds]` (default 200
+clients for 10 seconds per endpoint). The app is served by uvicorn in a
+subprocess; the sync endpoints below are plain `def` handlers running the
+same queries on the blocking engine through FastAPI's threadpool.
+"""
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+# Measure the database path, not the product cache
+os.environ.setdefault("PRODUCT_CACHE_SIZE", "0")
+
+from benchmarks.common import seed
+from fastapi import Depends, HTTPException
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+import httpx
+
+from app.database import get_session
+from app.main import app as bench_app
+from app.schemas.sql_models import Product
+
+PORT = 8765
+PRODUCTS = 10_000
+
+
+@bench_app.get("/sync/products/search", response_model=list[Product])
+def sync_search_products(q: str, db: Session = Depends(get_session)):
+    statement = select(Product).from_statement(text(
+        "SELECT product.* FROM product_fts JOIN product ON product.id = product_fts.rowid "
+        "WHERE product_fts MATCH :match ORDER BY bm25(product_fts, 10.0, 1.0) LIMIT 20"
+    ).bindparams(match=f'"{q}"*'))
+    return db.execute(statement).scalars().all()
+
+
+@bench_app.get("/sync/products/{product_id}", response_model=Product)
+def sync_read_product(product_id: int, db: Session = Depends(get_session)):
+    db_product = db.get(Product, product_id)
+    if not db_product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return db_product
+
+
+SCENARIOS = {
+    "read_product": ("/sync/products/{id}", "/{id}"),
+    "search": ("/sync/products/search?q={word}", "/products/search?q={word}"),
+}
+WORDS = ("laptop", "silver", "garden", "wireless", "vintage")
+
+
+async def run_load(path: str, clients: int, seconds: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            rng = random.Random()
+            while time.perf_counter() < deadline:
+                url = path.format(id=rng.randint(1, PRODUCTS), word=rng.choice(WORDS))
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "rps": (len(latencies) - errors) / seconds,
+        "errors": errors,
+    }
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    seed(products=PRODUCTS, users=10)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.load_test:bench_app",
+         "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+        env=os.environ.copy(),
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(50):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/1")
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+
+        print(f"{clients} concurrent clients, {seconds:.0f} s per run")
+        print(f"{'scenario':<14} {'mode':<6} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+        for name, (sync_path, async_path) in SCENARIOS.items():
+            for mode, path in (("sync", sync_path), ("async", async_path)):
+                result = asyncio.run(run_load(path, clients, seconds))
+                print(f"{name:<14} {mode:<6} {result['p50']:>9.1f} {result['p99']:>9.1f} "
+                      f"{result['rps']:>9.0f} {result['errors']:>7}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
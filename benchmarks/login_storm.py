@@ -0,0 +1,133 @@
+"""Measure login throughput and catalog latency while clients storm /login/.
+
+Run with `python -m benchmarks.login_storm [login clients] [seconds]`
+(default 50 login clients for 10 seconds per scenario, next to 10 catalog
+clients sending 10 requests/s each). "inline" hashes in the app's threadpool with no queue limit, as
+the sync login handlers used to; "pool" uses the default bounded process
+pool, which answers 503 with Retry-After once its queue is full.
+"""
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import seed
+from sqlalchemy import update
+from sqlmodel import Session
+
+import httpx
+
+from app.database import engine
+from app.passwords import PASSWORD_BCRYPT_ROUNDS, hash_secret
+from app.schemas.sql_models import User
+
+PORT = 8768
+USERS = 100
+PRODUCTS = 1000
+CATALOG_CLIENTS = 10
+CATALOG_INTERVAL = 0.1
+PASSWORD = "correct horse battery staple"
+
+# (name, environment overrides, whether login clients run)
+SCENARIOS = (
+    ("no logins", {}, False),
+    ("inline", {"PASSWORD_WORKERS": "0", "PASSWORD_QUEUE_LIMIT": "1000000"}, True),
+    ("pool", {}, True),
+)
+
+
+def percentile(samples, fraction):
+    return samples[max(int(len(samples) * fraction) - 1, 0)] * 1000
+
+
+async def run_storm(login_clients: int, seconds: float):
+    logins, catalog = [], []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+    clients = login_clients + CATALOG_CLIENTS
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=120) as client:
+        async def login_worker():
+            rng = random.Random()
+            while time.perf_counter() < deadline:
+                body = {"username": f"user{rng.randint(1, USERS)}", "password": PASSWORD}
+                start = time.perf_counter()
+                response = await client.post("/login/", json=body)
+                if time.perf_counter() > deadline:
+                    break
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    logins.append(time.perf_counter() - start)
+                elif response.status_code == 503:
+                    await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+
+        async def catalog_worker():
+            # Paced rather than back to back, so the catalog alone leaves the CPU mostly idle
+            rng = random.Random()
+            next_start = time.perf_counter()
+            while next_start < deadline:
+                await asyncio.sleep(max(next_start - time.perf_counter(), 0))
+                url = rng.choice((f"/{rng.randint(1, PRODUCTS)}", "/allproducts?limit=20"))
+                start = time.perf_counter()
+                (await client.get(url)).raise_for_status()
+                if time.perf_counter() > deadline:
+                    break
+                catalog.append(time.perf_counter() - start)
+                next_start = max(next_start + CATALOG_INTERVAL, time.perf_counter())
+
+        await asyncio.gather(*(login_worker() for _ in range(login_clients)),
+                             *(catalog_worker() for _ in range(CATALOG_CLIENTS)))
+
+    logins.sort()
+    catalog.sort()
+    return {
+        "logins": len(logins) / seconds,
+        "login_p50": statistics.median(logins) * 1000 if logins else 0.0,
+        "rejected": statuses.get(503, 0),
+        "catalog": len(catalog) / seconds,
+        "catalog_p50": statistics.median(catalog) * 1000,
+        "catalog_p99": percentile(catalog, 0.99),
+    }
+
+
+def main():
+    login_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    seed(products=PRODUCTS, users=USERS)
+    with Session(engine) as session:
+        session.exec(update(User).values(password=hash_secret(PASSWORD)))
+        session.commit()
+
+    print(f"{login_clients} login clients and {CATALOG_CLIENTS} catalog clients, {seconds:.0f} s per scenario, "
+          f"bcrypt cost {PASSWORD_BCRYPT_ROUNDS}, {os.cpu_count()} CPUs")
+    print(f"{'scenario':<9} {'logins/s':>9} {'login p50':>10} {'503s':>6} {'catalog/s':>10} "
+          f"{'cat p50':>8} {'cat p99':>8}")
+    for name, overrides, storm in SCENARIOS:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app",
+             "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+            env={**os.environ, **overrides},
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            for _ in range(50):
+                try:
+                    httpx.get(f"http://127.0.0.1:{PORT}/1")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.2)
+            result = asyncio.run(run_storm(login_clients if storm else 0, seconds))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{name:<9} {result['logins']:>9.1f} {result['login_p50']:>10.0f} {result['rejected']:>6} "
+              f"{result['catalog']:>10.0f} {result['catalog_p50']:>8.1f} {result['catalog_p99']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
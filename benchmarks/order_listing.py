@@ -0,0 +1,36 @@
+"""Check that the order listings run a constant number of queries.
+
+Run with `python -m benchmarks.order_listing`. Exits non-zero if the
+query count grows with the number of orders (the N+1 pattern).
+"""
+import sys
+
+from benchmarks.common import auth_headers, count_queries, seed, timed
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+def main():
+    seed(products=50, users=5, orders=2000)
+    failures = 0
+    with TestClient(app) as client:
+        for url, headers in (("/orders/1", auth_headers("user", 1)), ("/orders/admin/1/orders", auth_headers("admin", 1))):
+            # Warm the account cache so the first measured call does not count its lookup
+            client.get(url, params={"limit": 1}, headers=headers).raise_for_status()
+            counts = []
+            for limit in (10, 1000):
+                with count_queries() as queries, timed() as elapsed:
+                    response = client.get(url, params={"limit": limit}, headers=headers)
+                response.raise_for_status()
+                counts.append(queries["count"])
+                print(f"{url} limit={limit}: {len(response.json())} orders, "
+                      f"{queries['count']} queries, {elapsed['seconds'] * 1000:.1f} ms")
+            if counts[0] != counts[1]:
+                print(f"FAIL {url}: query count grows with page size {counts}")
+                failures += 1
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Measure normal clients' latency while one client abuses logins and full-catalog reads.
+
+Run with `python -m benchmarks.rate_limit [abusive connections] [seconds]`
+(default 20 connections for 10 seconds per scenario, next to 10 normal
+clients sending 10 requests/s each). The abusive client sends every
+request from one address, alternating wrong-password logins with streamed
+reads of the whole catalog; normal clients each use an address of their
+own, passed in X-Forwarded-For to a server started with --proxy-headers.
+The abusive client runs in a process of its own so its retry loop does not
+queue behind the normal clients' event loop.
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import seed
+
+import httpx
+
+PORT = 8769
+USERS = 100
+PRODUCTS = 20000
+NORMAL_CLIENTS = 10
+NORMAL_INTERVAL = 0.1
+
+# (name, environment overrides)
+SCENARIOS = (
+    ("off", {"RATE_LIMIT_ENABLED": "false"}),
+    ("on", {"RATE_LIMIT_ENABLED": "true"}),
+)
+
+
+def percentile(samples, fraction):
+    return samples[max(int(len(samples) * fraction) - 1, 0)] * 1000
+
+
+async def abuse(connections: int, seconds: float, counts):
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    headers = {"X-Forwarded-For": "203.0.113.1"}
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=120) as client:
+        async def abusive_worker():
+            # Ignores Retry-After, as an abusive client would
+            rng = random.Random()
+            while time.perf_counter() < deadline:
+                if rng.random() < 0.5:
+                    body = {"username": f"user{rng.randint(1, USERS)}", "password": "wrong"}
+                    response = await client.post("/login/", json=body, headers=headers)
+                else:
+                    response = await client.get("/allproducts", params={"stream": True}, headers=headers)
+                counts["throttled" if response.status_code == 429 else "served"] += 1
+
+        await asyncio.gather(*(abusive_worker() for _ in range(connections)))
+
+
+def run_abuser(connections: int, seconds: float, queue):
+    counts = {"served": 0, "throttled": 0}
+    asyncio.run(abuse(connections, seconds, counts))
+    queue.put(counts)
+
+
+async def run_normal(seconds: float):
+    normal = []
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=NORMAL_CLIENTS, max_keepalive_connections=NORMAL_CLIENTS)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=120) as client:
+        async def normal_worker(number: int):
+            headers = {"X-Forwarded-For": f"198.51.100.{number + 1}"}
+            rng = random.Random()
+            next_start = time.perf_counter()
+            while next_start < deadline:
+                await asyncio.sleep(max(next_start - time.perf_counter(), 0))
+                url = rng.choice((f"/{rng.randint(1, PRODUCTS)}", "/allproducts?limit=20"))
+                start = time.perf_counter()
+                (await client.get(url, headers=headers)).raise_for_status()
+                if time.perf_counter() > deadline:
+                    break
+                normal.append(time.perf_counter() - start)
+                next_start = max(next_start + NORMAL_INTERVAL, time.perf_counter())
+
+        await asyncio.gather(*(normal_worker(number) for number in range(NORMAL_CLIENTS)))
+    return sorted(normal)
+
+
+def run_scenario(connections: int, seconds: float):
+    queue = multiprocessing.Queue()
+    abuser = multiprocessing.Process(target=run_abuser, args=(connections, seconds, queue))
+    abuser.start()
+    normal = asyncio.run(run_normal(seconds))
+    counts = queue.get()
+    abuser.join()
+    return {
+        "served": counts["served"] / seconds,
+        "throttled": counts["throttled"] / seconds,
+        "normal": len(normal) / seconds,
+        "normal_p50": statistics.median(normal) * 1000,
+        "normal_p99": percentile(normal, 0.99),
+    }
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    seed(products=PRODUCTS, users=USERS)
+
+    print(f"{connections} abusive connections and {NORMAL_CLIENTS} normal clients, {seconds:.0f} s per scenario, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'limiter':<8} {'abuse ok/s':>11} {'abuse 429/s':>12} {'normal/s':>9} {'p50 ms':>7} {'p99 ms':>7}")
+    for name, overrides in SCENARIOS:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT),
+             "--proxy-headers", "--forwarded-allow-ips", "127.0.0.1", "--log-level", "warning", "--no-access-log"],
+            env={**os.environ, **overrides},
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            for _ in range(50):
+                try:
+                    httpx.get(f"http://127.0.0.1:{PORT}/1")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.2)
+            result = run_scenario(connections, seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{name:<8} {result['served']:>11.1f} {result['throttled']:>12.0f} {result['normal']:>9.0f} "
+              f"{result['normal_p50']:>7.1f} {result['normal_p99']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
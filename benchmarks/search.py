@@ -0,0 +1,56 @@
+"""Compare GET /products/search (FTS5 + BM25) with a LIKE '%term%' scan.
+
+Run with `python -m benchmarks.search [rows]` (default 1,000,000 products).
+"""
+import statistics
+import sys
+
+from benchmarks.common import seed, timed
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.database import engine
+from app.main import app
+
+# Common words, a prefix, a rare term (a product number) and a term with no matches
+TERMS = ("laptop", "wireless mouse", "silv", "98765", "nosuchterm")
+ROUNDS = 5
+
+
+def median_ms(run):
+    samples = []
+    for _ in range(ROUNDS):
+        with timed() as elapsed:
+            run()
+        samples.append(elapsed["seconds"] * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with timed() as elapsed:
+        seed(products=rows, users=1)
+    print(f"seeded {rows} products in {elapsed['seconds']:.1f} s")
+
+    # "like" stops at the first 20 unranked hits; "like all" finds every match, which ranking needs
+    print(f"{'query':<24} {'fts5 ms':>10} {'like ms':>10} {'like all ms':>12}")
+    with TestClient(app) as client, Session(engine) as session:
+        for term in TERMS:
+            fts_ms = median_ms(lambda: client.get("/products/search", params={"q": term}).raise_for_status())
+
+            # Equivalent LIKE scan: every word must appear in the name or description
+            where = " AND ".join(
+                f"(name LIKE :w{i} OR description LIKE :w{i})" for i in range(len(term.split()))
+            )
+            params = {f"w{i}": f"%{word}%" for i, word in enumerate(term.split())}
+            like_ms = median_ms(lambda: session.execute(
+                text(f"SELECT * FROM product WHERE {where} LIMIT 20"), params).all())
+            like_all_ms = median_ms(lambda: session.execute(
+                text(f"SELECT id FROM product WHERE {where}"), params).all())
+
+            print(f"{term:<24} {fts_ms:>10.2f} {like_ms:>10.2f} {like_all_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Compare the cost of turning the list endpoints' rows into JSON bytes, before and after orjson.
+
+Run with `python -m benchmarks.serialization [rounds]` (default 20). Each
+payload is encoded the old way (validated response models, FastAPI's
+response_model serialization, then json.dumps in JSONResponse) and the new
+way (model_construct and a prebuilt TypeAdapter, or ORJSONResponse for
+plain dicts); both outputs must decode to the same JSON. Database reads are
+done once up front and are not part of the timings.
+"""
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.common import fill_cart, seed
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.main import app
+from app.routes.cart import build_cart_response
+from app.routes.order import ADMIN_ORDERS, USER_ORDERS, to_ist
+from app.routes.product import PRODUCT_COLUMNS, PRODUCT_LIST
+from app.schemas import cartitem_schema, order_schema, user_schema
+from app.schemas.sql_models import CartItem, OrderHeader, OrderLine, Product, User
+
+PRODUCTS = 1000
+CART_LINES = 100
+ORDERS = 1000
+
+
+def response_field(path: str):
+    # The response_model field FastAPI serialized these routes' results with
+    for route in app.routes:
+        if getattr(route, "path", None) == path and "GET" in route.methods:
+            return route.response_field
+    raise LookupError(path)
+
+
+# serialize_response is a coroutine, though it never waits when is_coroutine is set
+loop = asyncio.new_event_loop()
+
+
+def encode_validated(field, content) -> bytes:
+    # What the routes did before: jsonable data from the response_model, then the stdlib encoder
+    data = loop.run_until_complete(serialize_response(field=field, response_content=content, is_coroutine=True))
+    return JSONResponse(data).body
+
+
+def constructor(construct: bool):
+    # model_construct skips validation, as the routes now do; calling the class is what they did before
+    if construct:
+        return lambda cls, **values: cls.model_construct(**values)
+    return lambda cls, **values: cls(**values)
+
+
+def user_order_models(construct: bool, rows, user):
+    make = constructor(construct)
+    user_details = make(order_schema.UserResponse, id=user.id, username=user.username, email=user.email)
+    return [
+        make(
+            order_schema.OrderResponse,
+            id=order.id,
+            user_details=user_details,
+            lines=[
+                make(order_schema.OrderLineResponse, product_id=line.product_id, product_details=line.product,
+                     quantity=line.quantity, unit_price=line.unit_price, line_total=line.line_total)
+                for line in order.lines
+            ],
+            total_quantity=order.total_quantity,
+            total_amount=order.total_amount,
+            order_date=to_ist(order.order_date)
+        )
+        for order in rows
+    ]
+
+
+def admin_order_models(construct: bool, rows):
+    make = constructor(construct)
+    return [
+        make(
+            order_schema.OrderEachResponse,
+            id=order.id,
+            line_id=line.id,
+            user_details=make(order_schema.UserResponse, id=user.id, username=user.username, email=user.email),
+            products=product,
+            quantity=line.quantity,
+            unit_price=line.unit_price,
+            total_amount=line.line_total,
+            order_date=to_ist(order.order_date)
+        )
+        for line, order, user, product in rows
+    ]
+
+
+def validated_cart(rows, db_user, lite: bool):
+    user_details = user_schema.UserResponse(id=db_user.id, username=db_user.username, email=db_user.email)
+    if lite:
+        return cartitem_schema.CartResponse(user_details=user_details, items=[
+            cartitem_schema.CartLineResponse(id=item.id, product_id=item.product_id, product_details=product,
+                                             quantity=item.quantity)
+            for item, product in rows
+        ])
+    return [
+        cartitem_schema.CartItemResponse(id=item.id, user_details=user_details, product_id=item.product_id,
+                                         product_details=product, quantity=item.quantity)
+        for item, product in rows
+    ]
+
+
+def load_payloads(session: Session):
+    products = session.exec(select(Product).order_by(Product.id).limit(PRODUCTS)).all()
+    product_rows = [dict(row._mapping) for row in session.execute(
+        select(*PRODUCT_COLUMNS.values()).order_by(Product.id).limit(PRODUCTS))]
+    cart_rows = session.exec(
+        select(CartItem, Product).join(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == 1).order_by(CartItem.id)
+    ).all()
+    user = session.get(User, 1)
+    user_orders = session.exec(
+        select(OrderHeader).options(selectinload(OrderHeader.lines).selectinload(OrderLine.product))
+        .where(OrderHeader.user_id == 1).order_by(OrderHeader.id).limit(ORDERS)
+    ).all()
+    admin_rows = session.exec(
+        select(OrderLine, OrderHeader, User, Product)
+        .join(OrderHeader, OrderHeader.id == OrderLine.order_id)
+        .join(User, User.id == OrderHeader.user_id)
+        .join(Product, Product.id == OrderLine.product_id)
+        .where(Product.admin_id == 1).order_by(OrderLine.id).limit(ORDERS)
+    ).all()
+
+    # (name, rows, old encoder, new encoder)
+    return [
+        ("allproducts", len(product_rows),
+         lambda: JSONResponse(product_rows).body,
+         lambda: ORJSONResponse(product_rows).body),
+        ("search / seller products", len(products),
+         lambda: encode_validated(response_field("/products/search"), products),
+         lambda: PRODUCT_LIST.dump_json(products)),
+        ("cart items", len(cart_rows),
+         lambda: encode_validated(response_field("/cart/items/"), validated_cart(cart_rows, user, False)),
+         lambda: build_cart_response(cart_rows, user, False).body),
+        ("cart items lite", len(cart_rows),
+         lambda: encode_validated(response_field("/cart/items/"), validated_cart(cart_rows, user, True)),
+         lambda: build_cart_response(cart_rows, user, True).body),
+        ("user orders", len(user_orders),
+         lambda: encode_validated(response_field("/orders/{user_id}"), user_order_models(False, user_orders, user)),
+         lambda: USER_ORDERS.dump_json(user_order_models(True, user_orders, user))),
+        ("admin orders", len(admin_rows),
+         lambda: encode_validated(response_field("/orders/admin/{admin_id}/orders"), admin_order_models(False, admin_rows)),
+         lambda: ADMIN_ORDERS.dump_json(admin_order_models(True, admin_rows))),
+    ]
+
+
+def best_of(encode, rounds: int) -> float:
+    # Fastest round in ms, the one least disturbed by the garbage collector and other processes
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encode()
+        samples.append(time.perf_counter() - start)
+    return min(samples) * 1000
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seed(products=PRODUCTS, users=20, orders=20_000, max_order_lines=4)
+    fill_cart(1, CART_LINES)
+
+    failures = 0
+    print(f"{'payload':<26} {'rows':>5} {'old ms':>8} {'new ms':>8} {'speedup':>8} {'bytes':>8}")
+    with Session(engine) as session:
+        for name, rows, old, new in load_payloads(session):
+            if json.loads(old()) != json.loads(new()):
+                print(f"FAIL {name}: the new encoding decodes to different JSON")
+                failures += 1
+                continue
+            old_best = best_of(old, rounds)
+            new_best = best_of(new, rounds)
+            print(f"{name:<26} {rows:>5} {old_best:>8.2f} {new_best:>8.2f} {old_best / new_best:>7.1f}x {len(new()):>8}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
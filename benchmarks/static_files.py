@@ -0,0 +1,139 @@
+"""Compare image fetches through the plain StaticFiles mount and CachedStaticFiles.
+
+Run with `python -m benchmarks.static_files [clients] [seconds]` (default 10
+clients for 5 seconds per scenario). Both mounts serve the same directory of
+hash-named JPEGs from one uvicorn subprocess. Full fetches measure raw
+serving; revalidations send the ETag each mount handed out and should get a
+304. Browsers skip the request entirely for immutable responses, which no
+requests/sec number captures.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import SCRATCH_DIR
+from fastapi import FastAPI
+from PIL import Image
+from starlette.staticfiles import StaticFiles
+
+import httpx
+
+from app.static import CachedStaticFiles
+
+PORT = 8766
+IMAGES = 20
+STATIC_DIR = os.environ.setdefault("STATIC_BENCH_DIR", os.path.join(SCRATCH_DIR, "static"))
+
+bench_app = FastAPI()
+bench_app.mount("/plain", StaticFiles(directory=STATIC_DIR, check_dir=False), name="plain")
+bench_app.mount("/cached", CachedStaticFiles(directory=STATIC_DIR, check_dir=False), name="cached")
+
+
+def write_images():
+    # Noisy JPEGs of roughly 150 KB, named by content hash like uploads
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    rng = random.Random(42)
+    names = []
+    for _ in range(IMAGES):
+        image = Image.effect_noise((640, 480), rng.randint(20, 80)).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=90)
+        data = buffer.getvalue()
+        name = hashlib.sha256(data).hexdigest() + ".jpg"
+        with open(os.path.join(STATIC_DIR, name), "wb") as file:
+            file.write(data)
+        names.append(name)
+    return names
+
+
+async def run_load(mount: str, names, etags, clients: int, seconds: float, revalidate=False, byte_range=None):
+    latencies = []
+    received = errors = 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    expected = 304 if revalidate else 206 if byte_range else 200
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal received, errors
+            rng = random.Random()
+            while time.perf_counter() < deadline:
+                name = rng.choice(names)
+                headers = {}
+                if revalidate:
+                    headers["If-None-Match"] = etags[mount, name]
+                if byte_range:
+                    headers["Range"] = byte_range
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f"/{mount}/{name}", headers=headers)
+                    ok = response.status_code == expected
+                    received += len(response.content)
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "rps": (len(latencies) - errors) / seconds,
+        "mbps": received / seconds / 1e6,
+        "errors": errors,
+    }
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    names = write_images()
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.static_files:bench_app",
+         "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+        env=os.environ.copy(),
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(50):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/plain/{names[0]}")
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+        etags = {
+            (mount, name): httpx.get(f"http://127.0.0.1:{PORT}/{mount}/{name}").headers["etag"]
+            for mount in ("plain", "cached") for name in names
+        }
+
+        print(f"{clients} concurrent clients, {seconds:.0f} s per run, {IMAGES} images")
+        print(f"{'scenario':<18} {'mount':<7} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'MB/s':>8} {'errors':>7}")
+        scenarios = (
+            ("full fetch", {}),
+            ("revalidate (304)", {"revalidate": True}),
+            ("range 64 KiB", {"byte_range": "bytes=0-65535"}),
+        )
+        for name, options in scenarios:
+            for mount in ("plain", "cached"):
+                # The plain mount ignores Range on this Starlette, so it answers 200 with the whole file
+                if mount == "plain" and "byte_range" in options:
+                    continue
+                result = asyncio.run(run_load(mount, names, etags, clients, seconds, **options))
+                print(f"{name:<18} {mount:<7} {result['p50']:>8.1f} {result['p99']:>8.1f} "
+                      f"{result['rps']:>8.0f} {result['mbps']:>8.1f} {result['errors']:>7}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Race buyers for a product with little stock and check nothing is oversold.
+
+Run with `python -m benchmarks.stock_contention [buyers] [stock] [clients]`
+(default 500 buyers for 10 units over 50 connections). Every buyer adds one
+unit to their cart and, when that succeeds, places an order against one
+uvicorn subprocess. Exactly `stock` orders should go through; every other
+buyer should get a 409, not a 500 or an oversold unit.
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from benchmarks.common import auth_headers, seed
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+
+import httpx
+
+from app.database import engine
+from app.schemas.sql_models import OrderLine, Product, StockReservation
+
+PORT = 8767
+PRODUCT_ID = 1
+
+
+async def run_buyers(buyers: int, clients: int):
+    latencies = []
+    outcomes = Counter()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    semaphore = asyncio.Semaphore(clients)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+        async def buyer(user_id: int):
+            async with semaphore:
+                start = time.perf_counter()
+                headers = auth_headers("user", user_id)
+                try:
+                    response = await client.post(f"/users/{user_id}/cart/add", json={"product_id": PRODUCT_ID, "quantity": 1},
+                                                 headers=headers)
+                    if response.status_code == 200:
+                        response = await client.post("/orders/place", params={"user_id": user_id}, headers=headers)
+                    outcomes[response.status_code] += 1
+                except httpx.HTTPError:
+                    outcomes["transport error"] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(buyer(user_id) for user_id in range(1, buyers + 1)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return outcomes, elapsed, latencies
+
+
+def main():
+    buyers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    stock = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    seed(products=10, users=buyers)
+    with Session(engine) as session:
+        session.exec(update(Product).where(Product.id == PRODUCT_ID).values(stock=stock))
+        session.commit()
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+        env=os.environ.copy(),
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(50):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/{PRODUCT_ID}")
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+        outcomes, elapsed, latencies = asyncio.run(run_buyers(buyers, clients))
+    finally:
+        server.terminate()
+        server.wait()
+
+    with Session(engine) as session:
+        remaining = session.exec(select(Product.stock).where(Product.id == PRODUCT_ID)).one()
+        sold = session.exec(select(func.coalesce(func.sum(OrderLine.quantity), 0))
+                            .where(OrderLine.product_id == PRODUCT_ID)).one()
+        held = session.exec(select(func.coalesce(func.sum(StockReservation.quantity), 0))
+                            .where(StockReservation.product_id == PRODUCT_ID)).one()
+
+    print(f"{buyers} buyers over {clients} connections for {stock} units")
+    print(f"elapsed {elapsed:.2f} s, {buyers / elapsed:.0f} buyers/s, "
+          f"p50 {statistics.median(latencies) * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print("responses " + ", ".join(f"{code}: {count}" for code, count in sorted(outcomes.items(), key=str)))
+    print(f"sold {sold}, held {held}, remaining {remaining}, "
+          f"{'ok' if sold + held + remaining == stock and sold <= stock and remaining >= 0 else 'OVERSOLD'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Benchmark the main endpoints on a generated dataset and compare against a stored baseline.
+
+Run with `python -m benchmarks.suite [--size 10k] [--save FILE [--queries-only]] [--compare FILE]`.
+By default every scenario sends --requests calls one at a time through an
+in-process ASGI client, counting the queries of each. With --load CLIENTS
+the app is served by uvicorn instead and --processes load generator
+processes share the clients for --seconds per scenario; queries per call
+then come from the app's /metrics. --compare exits with status 1 when a
+scenario runs more queries than the baseline, or is slower (p50 or p95)
+or, under load, has less throughput by more than --tolerance. Query
+counts are exact; latency is only comparable on the machine, size and
+mode the baseline was recorded with, so --queries-only saves the query
+counts alone. baselines/ holds such a baseline for the 1k dataset:
+`python -m benchmarks.suite --size 1k --compare benchmarks/baselines/1k-queries.json`.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from benchmarks.common import count_queries, timed
+from benchmarks.generate import SIZES, build_dataset
+from fastapi.testclient import TestClient
+
+import httpx
+
+from app.database import DATABASE_URL
+from app.utils import create_access_token
+
+PORT = 8771
+WARMUP_REQUESTS = 10
+WORDS = ("laptop", "silver", "garden", "wireless", "vintage")
+YEARS = (2022, 2023, 2024)
+# Latency changes smaller than this are noise, whatever the tolerance
+MIN_LATENCY_CHANGE_MS = 2.0
+
+# (method, url, json body, auth as (role, account id) or None)
+Call = namedtuple("Call", "method url json auth")
+# route is the template /metrics reports the scenario under; call(rng) returns the calls to make
+# unmeasured first, and the measured one
+Scenario = namedtuple("Scenario", "name route call")
+
+
+def scenarios(size: dict):
+    products, users, carts, admins = size["products"], size["users"], size["carts"], size["admins"]
+
+    def read_product(rng):
+        return [], Call("GET", f"/{rng.randint(1, products)}", None, None)
+
+    def list_products(rng):
+        return [], Call("GET", f"/allproducts?after_id={rng.randint(1, products)}&limit=50", None, None)
+
+    def search(rng):
+        return [], Call("GET", f"/products/search?q={rng.choice(WORDS)}", None, None)
+
+    def cart_items(rng):
+        # Users with a seeded cart, which the write scenarios leave alone
+        user_id = rng.randint(1, carts)
+        return [], Call("GET", f"/cart/items/?user_id={user_id}", None, ("user", user_id))
+
+    def add_to_cart(rng):
+        user_id = rng.randint(carts + 1, users)
+        return [], Call("POST", f"/users/{user_id}/cart/add", {"product_id": rng.randint(1, products), "quantity": 1},
+                        ("user", user_id))
+
+    def place_order(rng):
+        _, add = add_to_cart(rng)
+        user_id = add.auth[1]
+        return [add], Call("POST", f"/orders/place?user_id={user_id}", None, ("user", user_id))
+
+    def user_orders(rng):
+        user_id = rng.randint(1, users)
+        return [], Call("GET", f"/orders/{user_id}?limit=20", None, ("user", user_id))
+
+    def admin_orders(rng):
+        admin_id = rng.randint(1, admins)
+        return [], Call("GET", f"/orders/admin/{admin_id}/orders?limit=50", None, ("admin", admin_id))
+
+    def monthly_orders(rng):
+        admin_id = rng.randint(1, admins)
+        return [], Call("GET", f"/admins/{admin_id}/products/{rng.choice(YEARS)}/monthly-orders", None,
+                        ("admin", admin_id))
+
+    def product_sales(rng):
+        admin_id = rng.randint(1, admins)
+        return [], Call("GET", f"/admins/{admin_id}/product-sales", None, ("admin", admin_id))
+
+    return (
+        Scenario("read_product", "/{product_id}", read_product),
+        Scenario("list_products", "/allproducts", list_products),
+        Scenario("search", "/products/search", search),
+        Scenario("cart_items", "/cart/items/", cart_items),
+        Scenario("add_to_cart", "/users/{user_id}/cart/add", add_to_cart),
+        Scenario("place_order", "/orders/place", place_order),
+        Scenario("user_orders", "/orders/{user_id}", user_orders),
+        Scenario("admin_orders", "/orders/admin/{admin_id}/orders", admin_orders),
+        Scenario("monthly_orders", "/admins/{admin_id}/products/{year}/monthly-orders", monthly_orders),
+        Scenario("product_sales", "/admins/{admin_id}/product-sales", product_sales),
+    )
+
+
+tokens = {}
+
+
+def headers_for(call: Call):
+    if call.auth is None:
+        return None
+    if call.auth not in tokens:
+        tokens[call.auth] = {"Authorization": f"Bearer {create_access_token(*call.auth)}"}
+    return tokens[call.auth]
+
+
+def percentiles(samples, seconds: float):
+    samples = sorted(samples)
+
+    def at(fraction):
+        return samples[max(int(len(samples) * fraction) - 1, 0)] * 1000
+
+    return {"p50": statistics.median(samples) * 1000, "p95": at(0.95), "p99": at(0.99),
+            "rps": len(samples) / seconds}
+
+
+def run_in_process(size: dict, requests: int, seed_value: int):
+    from app.main import app
+
+    results = {}
+    with TestClient(app) as client:
+        def send(call: Call):
+            response = client.request(call.method, call.url, json=call.json, headers=headers_for(call))
+            if response.status_code >= 400:
+                raise RuntimeError(f"{call.method} {call.url} -> {response.status_code}: {response.text[:200]}")
+
+        for scenario in scenarios(size):
+            rng = random.Random(seed_value)
+            latencies, queries = [], []
+            for number in range(WARMUP_REQUESTS + requests):
+                setup, call = scenario.call(rng)
+                for setup_call in setup:
+                    send(setup_call)
+                with count_queries() as counted, timed() as elapsed:
+                    send(call)
+                if number >= WARMUP_REQUESTS:
+                    latencies.append(elapsed["seconds"])
+                    queries.append(counted["count"])
+            results[scenario.name] = {**percentiles(latencies, sum(latencies)), "queries": statistics.mean(queries)}
+    return results
+
+
+async def generate_load(size: dict, scenario_index: int, clients: int, seconds: float, seed_value: int):
+    scenario = scenarios(size)[scenario_index]
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+        async def worker(number: int):
+            nonlocal errors
+            rng = random.Random(seed_value * 1000 + number)
+            while time.perf_counter() < deadline:
+                setup, call = scenario.call(rng)
+                try:
+                    for setup_call in setup:
+                        await client.request(setup_call.method, setup_call.url, json=setup_call.json,
+                                             headers=headers_for(setup_call))
+                    start = time.perf_counter()
+                    response = await client.request(call.method, call.url, json=call.json, headers=headers_for(call))
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker(number) for number in range(clients)))
+    return latencies, errors
+
+
+def load_process(args):
+    size, scenario_index, clients, seconds, seed_value = args
+    return asyncio.run(generate_load(size, scenario_index, clients, seconds, seed_value))
+
+
+METRIC_LINE = re.compile(r'^(http_requests_total|db_queries_total)\{method="[A-Z]+",route="([^"]*)"[^}]*\} (\S+)$')
+
+
+def route_totals():
+    # (requests, queries) per route template, from the app's /metrics
+    totals = {}
+    for line in httpx.get(f"http://127.0.0.1:{PORT}/metrics").text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, route, value = match.groups()
+            requests, queries = totals.get(route, (0, 0))
+            if name == "http_requests_total":
+                totals[route] = (requests + float(value), queries)
+            else:
+                totals[route] = (requests, queries + float(value))
+    return totals
+
+
+def run_load(size: dict, clients: int, processes: int, seconds: float, seed_value: int):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "SLOW_REQUEST_SECONDS": "3600"},
+        stderr=subprocess.DEVNULL
+    )
+    results = {}
+    try:
+        for _ in range(50):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/1")
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+
+        per_process = [clients // processes + (number < clients % processes) for number in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            for index, scenario in enumerate(scenarios(size)):
+                before = route_totals().get(scenario.route, (0, 0))
+                runs = pool.map(load_process, [(size, index, count, seconds, seed_value + number)
+                                               for number, count in enumerate(per_process) if count])
+                after = route_totals().get(scenario.route, (0, 0))
+                latencies = [latency for run, _ in runs for latency in run]
+                if not latencies:
+                    raise RuntimeError(f"{scenario.name}: every request failed")
+                requests = after[0] - before[0]
+                results[scenario.name] = {
+                    **percentiles(latencies, seconds),
+                    "queries": (after[1] - before[1]) / requests if requests else 0.0,
+                    "errors": sum(errors for _, errors in runs),
+                }
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float, under_load: bool):
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["queries"] > base["queries"] + 0.01:
+            found.append(f"{name}: {result['queries']:.2f} queries per call, baseline {base['queries']:.2f}")
+        # Baselines saved with --queries-only hold no timings
+        for percentile in ("p50", "p95"):
+            if (percentile in base and result[percentile] > base[percentile] * (1 + tolerance)
+                    and result[percentile] - base[percentile] > MIN_LATENCY_CHANGE_MS):
+                found.append(f"{name}: {percentile} {result[percentile]:.1f} ms, baseline {base[percentile]:.1f} ms")
+        # One call at a time, throughput is only the latency again
+        if under_load and "rps" in base and result["rps"] < base["rps"] * (1 - tolerance):
+            found.append(f"{name}: {result['rps']:.0f} calls/s, baseline {base['rps']:.0f}")
+    return found
+
+
+def print_results(results: dict, baseline: dict):
+    # Baselines saved with --queries-only have no p95 to compare with
+    timed_baseline = {name: base for name, base in baseline.items() if "p95" in base}
+    print(f"{'scenario':<15} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'calls/s':>9} {'queries':>8}"
+          + (f" {'p95 vs base':>12}" if timed_baseline else ""))
+    for name, result in results.items():
+        line = (f"{name:<15} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f} "
+                f"{result['rps']:>9.0f} {result['queries']:>8.2f}")
+        if name in timed_baseline:
+            line += f" {(result['p95'] / timed_baseline[name]['p95'] - 1) * 100:>+11.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", choices=SIZES, default="10k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="calls per scenario in process")
+    parser.add_argument("--load", type=int, metavar="CLIENTS", help="concurrent clients against uvicorn")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--seconds", type=float, default=10, help="seconds per scenario under load")
+    parser.add_argument("--save", metavar="FILE", help="store the results as a baseline")
+    parser.add_argument("--queries-only", action="store_true", help="save only the query counts")
+    parser.add_argument("--compare", metavar="FILE", help="fail on regressions against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed latency and throughput change")
+    args = parser.parse_args()
+
+    # Per-call query means depend on how many calls share the cache misses, so an in-process
+    # baseline only compares with runs of the same --requests
+    mode = f"load-{args.load}" if args.load else f"inprocess-{args.requests}"
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            stored = json.load(baseline_file)
+        if (stored["size"], stored["mode"]) != (args.size, mode):
+            sys.exit(f"Baseline was recorded for {stored['size']} {stored['mode']}, not {args.size} {mode}")
+        baseline = stored["results"]
+
+    # Work on a copy, the write scenarios must not change the cached dataset
+    dataset = build_dataset(args.size, args.seed)
+    shutil.copyfile(dataset, DATABASE_URL.split(":///", 1)[1])
+
+    size = SIZES[args.size]
+    print(f"{args.size} dataset, {mode}, {os.cpu_count()} CPUs")
+    if args.load:
+        results = run_load(size, args.load, args.processes, args.seconds, args.seed)
+    else:
+        results = run_in_process(size, args.requests, args.seed)
+    print_results(results, baseline)
+
+    if args.save:
+        saved = {name: {"queries": result["queries"]} for name, result in results.items()} if args.queries_only else results
+        with open(args.save, "w") as baseline_file:
+            json.dump({"size": args.size, "mode": mode, "results": saved}, baseline_file, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        found = regressions(results, baseline, args.tolerance, bool(args.load))
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Point the app at a scratch database before app.database is imported, keep the image worker
+# out of the query counts, let one client exceed the rate limits and sign tokens with a test key
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='ecommerce-tests-'), 'test.db')}")
+os.environ.setdefault("IMAGE_WORKER_MODE", "external")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel
+
+from app.cache import catalog_cache, product_cache
+from app.database import create_database, engine
+from app.main import app
+from app.utils import account_cache, token_cache
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One app and event loop for the whole run; requests sent from several threads run concurrently on it
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(autouse=True)
+def empty_database():
+    # Every test seeds what it needs into empty tables, with cold caches
+    create_database()
+    with engine.begin() as connection:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            connection.execute(table.delete())
+    for cache in (product_cache, catalog_cache, token_cache, account_cache):
+        cache.clear()
+
+
+@pytest.fixture
+def concurrently():
+    # Start every call at once and return their results in order
+    def run(*calls):
+        with ThreadPoolExecutor(len(calls)) as executor:
+            return list(executor.map(lambda call: call(), calls))
+    return run
@@ -0,0 +1,76 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert
+from sqlmodel import Session
+
+from app.analytics import rebuild_sales_rollup
+from app.database import async_engine, engine
+from app.schemas.sql_models import Admin, CartItem, OrderHeader, OrderLine, Product, User
+from app.utils import create_access_token
+
+
+@contextmanager
+def count_queries():
+    # Count the statements sent to the database while the block runs
+    counter = {"count": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["count"] += 1
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        for target in (engine, async_engine.sync_engine):
+            event.remove(target, "before_cursor_execute", before_cursor_execute)
+
+
+def seed(products: int = 10, users: int = 2, orders: int = 0, max_order_lines: int = 1):
+    # Admin 1 owns every product, none with tracked stock; orders of 1-max_order_lines lines are spread
+    # over 2022-2024 and dealt round robin to the users
+    rng = random.Random(42)
+    with Session(engine) as session:
+        session.add(Admin(id=1, email="admin1@example.com", adminname="admin1", password="x"))
+        session.add_all(User(id=i, email=f"user{i}@example.com", username=f"user{i}", password="x")
+                        for i in range(1, users + 1))
+        prices = {i: round(rng.uniform(10, 500), 2) for i in range(1, products + 1)}
+        session.execute(insert(Product), [
+            {"id": i, "name": f"Product {i}", "description": f"Description of product {i}", "price": price,
+             "image_path": f"./static/uploads/{i}.jpg", "admin_id": 1}
+            for i, price in prices.items()
+        ])
+
+        headers, lines = [], []
+        spacing = timedelta(days=3 * 365) / max(orders, 1)
+        for i in range(1, orders + 1):
+            order_lines = []
+            for _ in range(rng.randint(1, max_order_lines)):
+                product_id, quantity = rng.randint(1, products), rng.randint(1, 5)
+                order_lines.append({"order_id": i, "product_id": product_id, "quantity": quantity,
+                                    "unit_price": prices[product_id],
+                                    "line_total": round(quantity * prices[product_id], 2)})
+            headers.append({"id": i, "user_id": (i - 1) % users + 1,
+                            "order_date": datetime(2022, 1, 1) + spacing * i,
+                            "total_quantity": sum(line["quantity"] for line in order_lines),
+                            "total_amount": round(sum(line["line_total"] for line in order_lines), 2)})
+            lines += order_lines
+        if orders:
+            session.execute(insert(OrderHeader), headers)
+            session.execute(insert(OrderLine), lines)
+        rebuild_sales_rollup(session.connection())
+        session.commit()
+
+
+def fill_cart(user_id: int, items: int):
+    # Cart lines of one unit each for products 1..items, written directly so no stock is held for them
+    with Session(engine) as session:
+        session.add_all(CartItem(user_id=user_id, product_id=i, quantity=1) for i in range(1, items + 1))
+        session.commit()
+
+
+def auth_headers(role: str = "user", account_id: int = 1):
+    # Bearer token for a seeded account, as the login endpoints would issue it
+    return {"Authorization": f"Bearer {create_access_token(role, account_id)}"}
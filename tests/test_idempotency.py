@@ -0,0 +1,88 @@
+from sqlmodel import Session, func, select
+
+from app.database import engine
+from app.idempotency import REPLAYED_HEADER
+from app.schemas.sql_models import CartItem, OrderHeader
+from tests.helpers import auth_headers, fill_cart, seed
+
+DUPLICATES = 8
+
+
+def add_to_cart(client, user_id: int, key: str, product_id: int = 1, quantity: int = 2):
+    return client.post(f"/users/{user_id}/cart/add", json={"product_id": product_id, "quantity": quantity},
+                       headers={**auth_headers("user", user_id), "Idempotency-Key": key})
+
+
+def place_order(client, user_id: int, key: str):
+    return client.post("/orders/place", params={"user_id": user_id},
+                       headers={**auth_headers("user", user_id), "Idempotency-Key": key})
+
+
+def cart_quantity(user_id: int, product_id: int = 1) -> int:
+    with Session(engine) as session:
+        item = session.exec(select(CartItem).where(CartItem.user_id == user_id, CartItem.product_id == product_id)).first()
+        return item.quantity if item else 0
+
+
+def order_count(user_id: int) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(OrderHeader).where(OrderHeader.user_id == user_id)).one()
+
+
+def assert_applied_once(responses, success: int):
+    # Duplicates racing the first request wait for it and replay it, or are told it is still in progress
+    statuses = {response.status_code for response in responses}
+    assert statuses <= {success, 409}
+    assert success in statuses
+    assert len({response.content for response in responses if response.status_code == success}) == 1
+
+
+def test_concurrent_duplicate_adds_apply_once(client, concurrently):
+    seed(products=3, users=2)
+
+    responses = concurrently(*(lambda: add_to_cart(client, 1, "add-1") for _ in range(DUPLICATES)))
+
+    assert_applied_once(responses, 200)
+    assert cart_quantity(1) == 2
+
+
+def test_concurrent_duplicate_orders_place_one_order(client, concurrently):
+    seed(products=3, users=2)
+    fill_cart(1, 3)
+
+    responses = concurrently(*(lambda: place_order(client, 1, "order-1") for _ in range(DUPLICATES)))
+
+    assert_applied_once(responses, 201)
+    assert order_count(1) == 1
+
+
+def test_retry_replays_the_stored_response(client):
+    seed(products=3, users=2)
+
+    first = add_to_cart(client, 1, "add-1")
+    retry = add_to_cart(client, 1, "add-1")
+
+    assert retry.status_code == first.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers[REPLAYED_HEADER] == "true"
+    assert REPLAYED_HEADER not in first.headers
+    assert cart_quantity(1) == 2
+
+
+def test_key_reused_for_a_different_request_is_rejected(client):
+    seed(products=3, users=2)
+
+    assert add_to_cart(client, 1, "add-1").status_code == 200
+    assert add_to_cart(client, 1, "add-1", quantity=5).status_code == 422
+    assert cart_quantity(1) == 2
+
+
+def test_keys_are_scoped_to_the_user(client):
+    seed(products=3, users=2)
+
+    assert add_to_cart(client, 1, "shared-key").status_code == 200
+    second = add_to_cart(client, 2, "shared-key")
+
+    assert second.status_code == 200
+    assert REPLAYED_HEADER not in second.headers
+    assert (cart_quantity(1), cart_quantity(2)) == (2, 2)
@@ -0,0 +1,45 @@
+import math
+
+import pytest
+
+from app.routes.order import ORDERS_MAX_LIMIT
+from tests.helpers import auth_headers, count_queries, seed
+
+ORDER_LISTINGS = (("/orders/1", "user"), ("/orders/admin/1/orders", "admin"))
+
+# selectinload loads the lines of at most this many orders per IN query
+SELECTIN_BATCH = 500
+
+
+@pytest.mark.parametrize("url, role", ORDER_LISTINGS)
+def test_order_listing_query_count_does_not_grow_with_page_size(client, url, role):
+    # One user and more orders than the largest page, so both page sizes come back full
+    seed(products=50, users=1, orders=ORDERS_MAX_LIMIT + 500, max_order_lines=4)
+    headers = auth_headers(role, 1)
+    # Warm the account cache so the first measured call does not count its lookup
+    client.get(url, params={"limit": 1}, headers=headers).raise_for_status()
+
+    counts, sizes = {}, {}
+    for limit in (10, ORDERS_MAX_LIMIT):
+        with count_queries() as queries:
+            response = client.get(url, params={"limit": limit}, headers=headers)
+        response.raise_for_status()
+        counts[limit], sizes[limit] = queries["count"], len(response.json())
+
+    assert (sizes[10], sizes[ORDERS_MAX_LIMIT]) == (10, ORDERS_MAX_LIMIT)
+    # No query per order or line; the only growth allowed is selectinload's batching of the lines
+    assert counts[ORDERS_MAX_LIMIT] - counts[10] <= math.ceil(ORDERS_MAX_LIMIT / SELECTIN_BATCH) - 1
+
+
+@pytest.mark.parametrize("url, role", ORDER_LISTINGS)
+def test_order_listing_pages_with_the_cursor(client, url, role):
+    seed(products=20, users=3, orders=100)
+    headers = auth_headers(role, 1)
+
+    first = client.get(url, params={"limit": 5}, headers=headers)
+    assert first.status_code == 200
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(url, params={"limit": 5, "after_id": cursor}, headers=headers)
+    assert second.status_code == 200
+    ids = [order["line_id" if role == "admin" else "id"] for order in first.json() + second.json()]
+    assert ids == sorted(set(ids))
@@ -0,0 +1,28 @@
+from tests.helpers import auth_headers, seed
+
+
+def test_monthly_orders_of_a_year_without_sales_is_not_found(client):
+    seed(products=10, users=3, orders=50)
+
+    response = client.get("/admins/1/products/2020/monthly-orders", headers=auth_headers("admin", 1))
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": "No orders found for this year"}
+
+
+def test_monthly_orders_are_grouped_by_month(client):
+    seed(products=10, users=3, orders=50)
+
+    response = client.get("/admins/1/products/2023/monthly-orders", headers=auth_headers("admin", 1))
+
+    assert response.status_code == 200
+    assert sorted(map(int, response.json())) == list(range(1, 13))
+    assert sum(count for month in response.json().values() for count in month.values()) > 0
+
+
+def test_product_sales_of_a_seller_without_sales_is_not_found(client):
+    seed(products=10, users=3)
+
+    response = client.get("/admins/1/product-sales", headers=auth_headers("admin", 1))
+
+    assert response.status_code == 404
@@ -0,0 +1,219 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.inventory import release_expired_reservations
+from app.schemas.sql_models import OrderHeader, Product, StockReservation
+from tests.helpers import auth_headers, fill_cart, seed
+
+BUYERS = 10
+
+
+def set_stock(product_id: int, stock: int):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE product SET stock = ? WHERE id = ?", (stock, product_id))
+
+
+def stock(product_id: int) -> int:
+    with Session(engine) as session:
+        return session.get(Product, product_id).stock
+
+
+def holds(product_id: int) -> dict:
+    with Session(engine) as session:
+        rows = session.exec(select(StockReservation).where(StockReservation.product_id == product_id))
+        return {row.user_id: row.quantity for row in rows}
+
+
+def add_to_cart(client, user_id: int, product_id: int, quantity: int):
+    return client.post(f"/users/{user_id}/cart/add", json={"product_id": product_id, "quantity": quantity},
+                       headers=auth_headers("user", user_id))
+
+
+def place_order(client, user_id: int):
+    return client.post("/orders/place", params={"user_id": user_id}, headers=auth_headers("user", user_id))
+
+
+def test_concurrent_adds_never_hold_more_than_the_stock(client, concurrently):
+    seed(products=3, users=BUYERS)
+    set_stock(1, 5)
+
+    responses = concurrently(*(lambda user_id=user_id: add_to_cart(client, user_id, 1, 1)
+                               for user_id in range(1, BUYERS + 1)))
+
+    assert sorted(response.status_code for response in responses) == [200] * 5 + [409] * 5
+    assert stock(1) == 0
+    assert sum(holds(1).values()) == 5
+
+
+def test_concurrent_orders_never_sell_more_than_the_stock(client, concurrently):
+    # Carts filled without holds, so every order has to take its units from the product
+    seed(products=3, users=BUYERS)
+    for user_id in range(1, BUYERS + 1):
+        fill_cart(user_id, 1)
+    set_stock(1, 3)
+
+    responses = concurrently(*(lambda user_id=user_id: place_order(client, user_id)
+                               for user_id in range(1, BUYERS + 1)))
+
+    assert sorted(response.status_code for response in responses) == [201] * 3 + [409] * 7
+    assert stock(1) == 0
+
+
+def test_order_takes_the_held_units(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+
+    assert add_to_cart(client, 1, 1, 2).status_code == 200
+    assert stock(1) == 3
+    assert place_order(client, 1).status_code == 201
+    assert stock(1) == 3
+    assert holds(1) == {}
+
+
+def test_deleting_a_line_releases_its_hold(client):
+    seed(products=3, users=2)
+    set_stock(1, 2)
+
+    assert add_to_cart(client, 1, 1, 2).status_code == 200
+    assert add_to_cart(client, 2, 1, 1).status_code == 409
+    assert client.delete("/1/cart/1", headers=auth_headers("user", 1)).status_code == 200
+
+    assert stock(1) == 2
+    assert holds(1) == {}
+    assert add_to_cart(client, 2, 1, 1).status_code == 200
+
+
+def test_lowering_a_quantity_releases_the_difference(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+
+    item_id = add_to_cart(client, 1, 1, 4).json()["id"]
+    response = client.put(f"/cart/items/{item_id}", params={"cart_item_id": item_id, "quantity": 1},
+                          headers=auth_headers("user", 1))
+
+    assert response.status_code == 200
+    assert stock(1) == 4
+    assert holds(1) == {1: 1}
+    cart = client.get("/cart/items/", params={"user_id": 1}, headers=auth_headers("user", 1)).json()
+    assert response.json() == cart[0]
+
+
+def test_batch_set_and_remove_release_holds(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+    set_stock(2, 5)
+    add_to_cart(client, 1, 1, 3)
+    add_to_cart(client, 1, 2, 2)
+
+    operations = [{"op": "set", "product_id": 1, "quantity": 1}, {"op": "remove", "product_id": 2}]
+    response = client.post("/users/1/cart/batch", json=operations, headers=auth_headers("user", 1))
+
+    assert response.status_code == 200
+    assert (stock(1), holds(1)) == (4, {1: 1})
+    assert (stock(2), holds(2)) == (5, {})
+
+
+def test_expired_holds_go_back_to_stock(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+    add_to_cart(client, 1, 1, 3)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE stockreservation SET expires_at = ?", (datetime.utcnow() - timedelta(seconds=1),))
+
+    assert release_expired_reservations() == 1
+    assert stock(1) == 5
+    assert holds(1) == {}
+
+
+def test_non_positive_adds_are_rejected(client):
+    seed(products=3, users=2)
+    set_stock(1, 2)
+
+    assert add_to_cart(client, 1, 1, -100).status_code == 422
+    assert add_to_cart(client, 1, 1, 0).status_code == 422
+    assert stock(1) == 2
+    assert holds(1) == {}
+
+
+def test_non_positive_quantity_updates_are_rejected(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+
+    item_id = add_to_cart(client, 1, 1, 2).json()["id"]
+    for quantity in (-3, 0):
+        response = client.put(f"/cart/items/{item_id}", params={"cart_item_id": item_id, "quantity": quantity},
+                              headers=auth_headers("user", 1))
+        assert response.status_code == 422
+    assert stock(1) == 3
+    assert holds(1) == {1: 2}
+
+
+def test_orders_with_non_positive_lines_are_rejected(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO cartitem (user_id, product_id, quantity) VALUES (1, 1, -4)")
+
+    assert place_order(client, 1).status_code == 400
+    assert stock(1) == 5
+    with Session(engine) as session:
+        assert session.exec(select(OrderHeader)).first() is None
+
+
+def test_batch_adds_and_sets_hold_stock(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+    set_stock(2, 5)
+    add_to_cart(client, 1, 2, 1)
+
+    operations = [{"op": "add", "product_id": 1, "quantity": 2}, {"op": "set", "product_id": 2, "quantity": 4}]
+    response = client.post("/users/1/cart/batch", json=operations, headers=auth_headers("user", 1))
+
+    assert response.status_code == 200
+    assert (stock(1), holds(1)) == (3, {1: 2})
+    assert (stock(2), holds(2)) == (1, {1: 4})
+    assert place_order(client, 1).status_code == 201
+    assert (stock(1), stock(2)) == (3, 1)
+
+
+def test_batch_beyond_the_stock_is_rejected(client):
+    seed(products=3, users=2)
+    set_stock(1, 3)
+
+    operations = [{"op": "add", "product_id": 1, "quantity": 50}]
+    response = client.post("/users/1/cart/batch", json=operations, headers=auth_headers("user", 1))
+
+    assert response.status_code == 409
+    assert (stock(1), holds(1)) == (3, {})
+    assert client.get("/cart/items/", params={"user_id": 1}, headers=auth_headers("user", 1)).status_code == 404
+
+
+def test_raising_a_quantity_holds_the_difference(client):
+    seed(products=3, users=2)
+    set_stock(1, 5)
+
+    item_id = add_to_cart(client, 1, 1, 1).json()["id"]
+
+    def update(quantity: int):
+        return client.put(f"/cart/items/{item_id}", params={"cart_item_id": item_id, "quantity": quantity},
+                          headers=auth_headers("user", 1))
+
+    assert update(3).status_code == 200
+    assert (stock(1), holds(1)) == (2, {1: 3})
+    assert update(9).status_code == 409
+    assert (stock(1), holds(1)) == (2, {1: 3})
+
+
+def test_add_reports_the_stock_left_after_the_hold(client):
+    seed(products=3, users=2)
+    set_stock(1, 10)
+    assert add_to_cart(client, 1, 1, 1).json()["product_details"]["stock"] == 9
+
+    # A write the product cache has not seen yet
+    set_stock(1, 3)
+    response = add_to_cart(client, 2, 1, 2)
+
+    assert response.status_code == 200
+    assert response.json()["product_details"]["stock"] == 1